@@ -1,11 +1,15 @@
 """A runner script for goal-conditioned hierarchical models."""
 import os
 import json
+from functools import partial
 from time import strftime
 import sys
 
+import ray
+
 from hbaselines.utils.misc import ensure_dir
 from hbaselines.utils.train import parse_options, get_hyperparameters
+from hbaselines.utils.train import run_seeds
 from hbaselines.algorithms import OffPolicyRLAlgorithm
 
 EXAMPLE_USAGE = 'python run_hrl.py "HalfCheetah-v2" --meta_period 10'
@@ -47,6 +51,11 @@ def run_exp(env,
     save_interval : int
         number of simulation steps in the training environment before the model
         is saved
+
+    Returns
+    -------
+    int
+        the total number of training steps that were performed
     """
     eval_env = env if evaluate else None
 
@@ -67,53 +76,96 @@ def run_exp(env,
         seed=seed,
     )
 
+    return alg.total_steps
+
+
+def run_seed(args, base_dir, seed, cpus=None):
+    """Execute the training operation of a single seed.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments of the training operation
+    base_dir : str
+        the directory the results of the training operation are stored in
+    seed : int
+        the random seed of the training operation
+    cpus : list of int or None
+        the CPUs that are assigned to the training operation when multiple
+        seeds are trained in parallel. None otherwise.
+
+    Returns
+    -------
+    int
+        the total number of training steps that were performed
+    """
+    # Connect to the Ray cluster that the rollout workers are created in.
+    # Seeds that are trained in parallel connect from their own process.
+    if args.ray_address is not None and not ray.is_initialized():
+        ray.init(redis_address=args.ray_address)
+
+    # The time when the current experiment started.
+    now = strftime("%Y-%m-%d-%H:%M:%S")
+
+    # Create a save directory folder (if it doesn't exist). Seeds that are
+    # trained in parallel may start at the same time, so the seed is added to
+    # the name of the folder.
+    dir_name = os.path.join(base_dir, '{}/{}'.format(args.env_name, now))
+    if cpus is not None:
+        dir_name = '{}-{}'.format(dir_name, seed)
+    ensure_dir(dir_name)
+
+    # Get the policy class.
+    if args.alg == "TD3":
+        from hbaselines.goal_conditioned.td3 import GoalConditionedPolicy
+    elif args.alg == "SAC":
+        from hbaselines.goal_conditioned.sac import GoalConditionedPolicy
+    else:
+        raise ValueError("Unknown algorithm: {}".format(args.alg))
+
+    # Get the hyperparameters.
+    hp = get_hyperparameters(args, GoalConditionedPolicy)
+
+    # Split the threads of the CPUs that are assigned to this seed.
+    if cpus is not None:
+        hp['n_cpus'] = len(cpus)
+        hp['cpu_affinity'] = cpus
+
+    # Add the seed for logging purposes.
+    params_with_extra = hp.copy()
+    params_with_extra['seed'] = seed
+    params_with_extra['env_name'] = args.env_name
+    params_with_extra['policy_name'] = "GoalConditionedPolicy"
+    params_with_extra['algorithm'] = args.alg
+    params_with_extra['date/time'] = now
+
+    # Add the hyperparameters to the folder.
+    with open(os.path.join(dir_name, 'hyperparameters.json'), 'w') as f:
+        json.dump(params_with_extra, f, sort_keys=True, indent=4)
+
+    return run_exp(env=args.env_name,
+                   policy=GoalConditionedPolicy,
+                   hp=hp,
+                   steps=args.total_steps,
+                   dir_name=dir_name,
+                   evaluate=args.evaluate,
+                   seed=seed,
+                   eval_interval=args.eval_interval,
+                   log_interval=args.log_interval,
+                   save_interval=args.save_interval)
+
 
 def main(args, base_dir):
     """Execute multiple training operations."""
-    for i in range(args.n_training):
-        # value of the next seed
-        seed = args.seed + i
-
-        # The time when the current experiment started.
-        now = strftime("%Y-%m-%d-%H:%M:%S")
-
-        # Create a save directory folder (if it doesn't exist).
-        dir_name = os.path.join(base_dir, '{}/{}'.format(args.env_name, now))
-        ensure_dir(dir_name)
-
-        # Get the policy class.
-        if args.alg == "TD3":
-            from hbaselines.goal_conditioned.td3 import GoalConditionedPolicy
-        elif args.alg == "SAC":
-            from hbaselines.goal_conditioned.sac import GoalConditionedPolicy
-        else:
-            raise ValueError("Unknown algorithm: {}".format(args.alg))
-
-        # Get the hyperparameters.
-        hp = get_hyperparameters(args, GoalConditionedPolicy)
-
-        # Add the seed for logging purposes.
-        params_with_extra = hp.copy()
-        params_with_extra['seed'] = seed
-        params_with_extra['env_name'] = args.env_name
-        params_with_extra['policy_name'] = "GoalConditionedPolicy"
-        params_with_extra['algorithm'] = args.alg
-        params_with_extra['date/time'] = now
-
-        # Add the hyperparameters to the folder.
-        with open(os.path.join(dir_name, 'hyperparameters.json'), 'w') as f:
-            json.dump(params_with_extra, f, sort_keys=True, indent=4)
-
-        run_exp(env=args.env_name,
-                policy=GoalConditionedPolicy,
-                hp=hp,
-                steps=args.total_steps,
-                dir_name=dir_name,
-                evaluate=args.evaluate,
-                seed=seed,
-                eval_interval=args.eval_interval,
-                log_interval=args.log_interval,
-                save_interval=args.save_interval)
+    # Create the folder of the summary of every seed.
+    ensure_dir(os.path.join(base_dir, args.env_name))
+
+    run_seeds(
+        run_seed=partial(run_seed, args, base_dir),
+        seeds=[args.seed + i for i in range(args.n_training)],
+        n_parallel=args.n_parallel,
+        summary_path=os.path.join(base_dir, args.env_name, 'seeds.csv'),
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+"""A runner script for hyperparameter sweeps."""
+import os
+import json
+import argparse
+from functools import partial
+from time import strftime
+import sys
+
+from hbaselines.utils.misc import ensure_dir
+from hbaselines.utils.train import parse_options
+from hbaselines.utils.sweep import expand_spec, apply_config, train_trial
+from hbaselines.utils.sweep import run_sweep, SuccessiveHalving
+
+EXAMPLE_USAGE = 'python run_sweep.py "AntMaze" --spec spec.json ' \
+                '--n_parallel 4 --grace_steps 100000'
+
+
+def parse_sweep_options(args):
+    """Parse the sweep options user can specify in command line.
+
+    The training options of every trial are parsed separately, see
+    `hbaselines.utils.train.parse_options`.
+
+    Returns
+    -------
+    argparse.Namespace
+        the output parser object
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='Perform a hyperparameter sweep.',
+        epilog=EXAMPLE_USAGE)
+
+    parser.add_argument(
+        '--spec', type=str, required=True,
+        help='the path to a json file with the search space. Lists of values '
+             'are searched over exhaustively, and dictionaries such as '
+             '{"loguniform": [1e-4, 1e-3]} are sampled from.')
+    parser.add_argument(
+        '--policy', type=str, default='GoalConditionedPolicy',
+        help='the policy to use. Must be one of [FeedForwardPolicy, '
+             'GoalConditionedPolicy].')
+    parser.add_argument(
+        '--num_samples', type=int, default=1,
+        help='the number of times the search space is sampled')
+    parser.add_argument(
+        '--grace_steps', type=int, default=None,
+        help='the number of training steps before trials may be stopped '
+             'early. If not specified, every trial is trained to completion.')
+    parser.add_argument(
+        '--reduction_factor', type=float, default=3,
+        help='the fraction of trials that are kept every time the trials '
+             'are compared is 1/reduction_factor')
+
+    flags, _ = parser.parse_known_args(args)
+
+    return flags
+
+
+def main(args, sweep_args, base_dir):
+    """Perform every trial of the hyperparameter sweep."""
+    # Get the policy class.
+    if args.alg == "TD3" and sweep_args.policy == "FeedForwardPolicy":
+        from hbaselines.fcnet.td3 import FeedForwardPolicy as policy
+    elif args.alg == "SAC" and sweep_args.policy == "FeedForwardPolicy":
+        from hbaselines.fcnet.sac import FeedForwardPolicy as policy
+    elif args.alg == "TD3" and sweep_args.policy == "GoalConditionedPolicy":
+        from hbaselines.goal_conditioned.td3 import GoalConditionedPolicy \
+            as policy
+    elif args.alg == "SAC" and sweep_args.policy == "GoalConditionedPolicy":
+        from hbaselines.goal_conditioned.sac import GoalConditionedPolicy \
+            as policy
+    else:
+        raise ValueError("Unknown algorithm or policy: {}, {}".format(
+            args.alg, sweep_args.policy))
+
+    # The trials are compared by their evaluation returns.
+    args.evaluate = True
+
+    # Collect the configuration of every trial. Unknown hyperparameters are
+    # detected before any trial is started.
+    with open(sweep_args.spec) as f:
+        spec = json.load(f)
+    configs = expand_spec(spec, sweep_args.num_samples, seed=args.seed)
+    for config in configs:
+        apply_config(args, config)
+
+    # Create a save directory folder (if it doesn't exist).
+    now = strftime("%Y-%m-%d-%H:%M:%S")
+    dir_name = os.path.join(base_dir, '{}/{}'.format(args.env_name, now))
+    ensure_dir(dir_name)
+    with open(os.path.join(dir_name, 'spec.json'), 'w') as f:
+        json.dump(spec, f, sort_keys=True, indent=4)
+
+    scheduler = None
+    if sweep_args.grace_steps is not None:
+        scheduler = SuccessiveHalving(
+            grace_steps=sweep_args.grace_steps,
+            max_steps=args.total_steps,
+            reduction_factor=sweep_args.reduction_factor)
+
+    run_sweep(
+        run_trial=partial(train_trial, args, policy),
+        configs=configs,
+        log_dirs=[os.path.join(dir_name, 'trial_{}'.format(i))
+                  for i in range(len(configs))],
+        n_parallel=args.n_parallel,
+        scheduler=scheduler,
+        summary_path=os.path.join(dir_name, 'trials.csv'),
+    )
+
+
+if __name__ == '__main__':
+    # collect arguments
+    args = parse_options(
+        description='Perform a hyperparameter sweep.',
+        example_usage=EXAMPLE_USAGE,
+        args=sys.argv[1:]
+    )
+    sweep_args = parse_sweep_options(sys.argv[1:])
+
+    # execute the sweep
+    main(args, sweep_args, 'data/sweep')
@@ -10,13 +10,16 @@ This algorithm class also contains modifications to support contextual
 environments and hierarchical policies.
 """
 import os
+import re
 import time
+import threading
 from collections import deque
 import csv
 import random
 from copy import deepcopy
 from gym.spaces import Box
 import numpy as np
+import ray
 import tensorflow as tf
 
 from hbaselines.algorithms.utils import is_td3_policy, is_sac_policy
@@ -24,6 +27,8 @@ from hbaselines.algorithms.utils import is_feedforward_policy
 from hbaselines.algorithms.utils import is_goal_conditioned_policy
 from hbaselines.utils.tf_util import make_session
 from hbaselines.utils.misc import ensure_dir, create_env
+from hbaselines.utils.vec_env import SubprocVecEnv
+from hbaselines.utils.ray_workers import create_rollout_workers
 
 
 # =========================================================================== #
@@ -80,6 +85,43 @@ FEEDFORWARD_PARAMS = dict(
     # specifies whether to use the huber distance function as the loss for the
     # critic. If set to False, the mean-squared error metric is used instead
     use_huber=False,
+    # whether to use prioritized experience replay. See:
+    # https://arxiv.org/abs/1511.05952
+    prioritized_replay=False,
+    # how much prioritization is used (0 - no prioritization, 1 - full
+    # prioritization)
+    prioritized_replay_alpha=0.6,
+    # to what degree to use importance weights (0 - no corrections, 1 - full
+    # correction)
+    prioritized_replay_beta=0.4,
+    # small positive term added to the priorities to ensure that every sample
+    # can be drawn
+    prioritized_replay_eps=1e-6,
+    # the storage backend of the replay buffer, one of "memory" (in-RAM numpy
+    # arrays) or "memmap" (numpy arrays memory-mapped to files in buffer_dir)
+    storage="memory",
+    # the directory memory-mapped replay buffer files are stored in. If set to
+    # None, the default temporary directory is used.
+    buffer_dir=None,
+    # whether to store every observation in the replay buffer once, instead of
+    # storing the observations and next observations separately
+    deduplicate_obs=False,
+    # the encoding observations are stored in within the replay buffer, one of
+    # "float32", "float16", "uint8", or "uint16". The integer encodings
+    # quantize every element of the observation affinely between its bounds in
+    # the observation space or, if these are not finite, its running minimum
+    # and maximum.
+    obs_encoding="float32",
+    # the number of minibatches that are sampled in advance by a background
+    # thread, overlapping the sampling procedure with the gradient updates. If
+    # set to 0, minibatches are sampled when they are needed.
+    prefetch_batches=0,
+    # the number of consecutive transitions used to compute the target values
+    # of the critic. If greater than 1, the discounted rewards of up to
+    # `n_step` transitions (of the same episode) are summed, and the value of
+    # the final next observation is discounted accordingly. Only used by the
+    # feedforward policies.
+    n_step=1,
 )
 
 
@@ -99,9 +141,28 @@ GOAL_CONDITIONED_PARAMS.update(dict(
     # whether to use off-policy corrections during the update procedure. See:
     # https://arxiv.org/abs/1805.08296
     off_policy_corrections=False,
+    # whether to perform the off-policy corrections within the tensorflow
+    # graph, as part of the update operation of the Manager policy
+    in_graph_corrections=False,
+    # the number of Worker updates after which the off-policy corrections
+    # cached in the replay buffer are recomputed. If set to None, the
+    # corrections are not cached.
+    correction_staleness=None,
     # whether to include hindsight action and goal transitions in the replay
     # buffer. See: https://arxiv.org/abs/1712.00948
     hindsight=False,
+    # whether to relabel the goals of the samples in hindsight when they are
+    # sampled from the replay buffer, instead of storing a second, relabeled
+    # copy of every meta period. Only used if `hindsight` is set to True.
+    lazy_hindsight=False,
+    # the strategy used to choose the hindsight goals, one of "final" (the goal
+    # achieved at the end of the meta period) or "future" (the goal achieved
+    # at a random later step of the meta period). Only used if
+    # `lazy_hindsight` is set to True.
+    hindsight_strategy="final",
+    # the fraction of the samples in every batch whose goals are relabeled.
+    # Only used if `lazy_hindsight` is set to True.
+    hindsight_fraction=0.5,
     # whether to use the connected gradient update actor update procedure to
     # the Manager policy. See: https://arxiv.org/abs/1912.02368v1
     connected_gradients=False,
@@ -140,6 +201,50 @@ class OffPolicyRLAlgorithm(object):
         the number of training steps
     nb_rollout_steps : int
         the number of rollout steps
+    num_envs : int
+        the number of training environments. If greater than one, the
+        environments are stepped in parallel worker processes, and every
+        rollout step collects one sample from each environment. The samples
+        of the different environments are interleaved in the replay buffer,
+        and can therefore not be combined with n-step returns or deduplicated
+        observations.
+    async_rollouts : bool
+        whether to collect samples in a separate actor thread while the policy
+        is trained. The actor computes actions with a copy of the policy whose
+        weights are periodically synced with the trained policy.
+    max_replay_ratio : float or None
+        the maximum number of training steps per collected sample. If the
+        learner gets ahead of the actor, training is paused until new samples
+        are collected. Only used if `async_rollouts` is set to True. If set to
+        None, the learner is never paused.
+    actor_sync_interval : int
+        the number of training steps after which the weights of the actor are
+        synced with the trained policy. The actor checks whether its weights
+        are stale before every `nb_rollout_steps` steps. Only used if
+        `async_rollouts` is set to True, or if `num_rollout_workers` is
+        greater than zero.
+    num_rollout_workers : int
+        the number of Ray actors that collect samples, each with its own
+        environment and copy of the policy. If greater than zero, every
+        rollout step collects one sample from each worker. Cannot be combined
+        with `num_envs` or `async_rollouts`.
+    n_cpus : int
+        the number of CPUs used by the tensorflow session. This is the default
+        size of both thread pools of the session.
+    intra_op_threads : int
+        the number of threads used to parallelize the computation of single
+        operations by the tensorflow session
+    inter_op_threads : int
+        the number of threads used to compute independent operations in
+        parallel by the tensorflow session
+    cpu_affinity : list of int or None
+        the CPUs that the process is pinned to. If set to None, the process
+        may run on any CPU.
+    autotune_threads : bool
+        whether to pick the fastest number of threads for the tensorflow
+        session when the model is created (see `_autotune_threads`). If set
+        to True, `intra_op_threads` and `inter_op_threads` are replaced by the
+        chosen number of threads.
     nb_eval_episodes : int
         the number of evaluation episodes
     actor_update_freq : int
@@ -182,16 +287,34 @@ class OffPolicyRLAlgorithm(object):
         the policy object
     sess : tf.compat.v1.Session
         the current tensorflow session
+    actor_tf : hbaselines.fcnet.base.ActorCriticPolicy
+        the policy object used to collect samples from the training
+        environment. If `async_rollouts` is set to True, this is a copy of
+        `policy_tf` in a separate graph and session, which stores its samples
+        in the replay buffer of `policy_tf`. Otherwise, this is `policy_tf`.
+    actor_graph : tf.Graph or None
+        the graph of the actor policy, if `async_rollouts` is set to True
+    actor_sess : tf.compat.v1.Session or None
+        the session of the actor policy, if `async_rollouts` is set to True
+    rollout_workers : list of ray.actor.ActorHandle
+        the Ray actors that collect samples. Empty if `num_rollout_workers` is
+        zero.
     summary : tf.Summary
         tensorboard summary object
     obs : array_like
-        the most recent training observation
-    episode_step : int
-        the number of steps since the most recent rollout began
+        the most recent training observation. If `num_envs` is greater than
+        one, this contains the observations of every environment.
+    episode_step : int or np.ndarray
+        the number of steps since the most recent rollout began. If `num_envs`
+        is greater than one, this is a vector with one element per
+        environment.
     episodes : int
         the total number of rollouts performed since training began
     total_steps : int
         the total number of steps that have been executed since training began
+    total_updates : int
+        the total number of training steps that have been performed since
+        training began
     epoch_episode_rewards : list of float
         a list of cumulative rollout rewards from the most recent training
         iterations
@@ -221,8 +344,9 @@ class OffPolicyRLAlgorithm(object):
         the total number of training iterations
     episode_rewards_history : list of float
         the cumulative return from the last 100 training episodes
-    episode_reward : float
-        the cumulative reward since the most reward began
+    episode_reward : float or np.ndarray
+        the cumulative reward since the most reward began. If `num_envs` is
+        greater than one, this is a vector with one element per environment.
     saver : tf.compat.v1.train.Saver
         tensorflow saver object
     trainable_vars : list of str
@@ -247,6 +371,16 @@ class OffPolicyRLAlgorithm(object):
                  eval_env=None,
                  nb_train_steps=1,
                  nb_rollout_steps=1,
+                 num_envs=1,
+                 async_rollouts=False,
+                 max_replay_ratio=None,
+                 actor_sync_interval=10,
+                 num_rollout_workers=0,
+                 n_cpus=3,
+                 intra_op_threads=None,
+                 inter_op_threads=None,
+                 cpu_affinity=None,
+                 autotune_threads=False,
                  nb_eval_episodes=50,
                  actor_update_freq=2,
                  meta_update_freq=10,
@@ -271,6 +405,53 @@ class OffPolicyRLAlgorithm(object):
             the number of training steps
         nb_rollout_steps : int
             the number of rollout steps
+        num_envs : int
+            the number of training environments. If greater than one, the
+            environments are stepped in parallel worker processes, and every
+            rollout step collects one sample from each environment. The
+            samples of the different environments are interleaved in the
+            replay buffer, and can therefore not be combined with n-step
+            returns or deduplicated observations.
+        async_rollouts : bool
+            whether to collect samples in a separate actor thread while the
+            policy is trained. The actor computes actions with a copy of the
+            policy whose weights are periodically synced with the trained
+            policy.
+        max_replay_ratio : float or None
+            the maximum number of training steps per collected sample. If the
+            learner gets ahead of the actor, training is paused until new
+            samples are collected. Only used if `async_rollouts` is set to
+            True. If set to None, the learner is never paused.
+        actor_sync_interval : int
+            the number of training steps after which the weights of the actor
+            are synced with the trained policy. The actor checks whether its
+            weights are stale before every `nb_rollout_steps` steps. Only used
+            if `async_rollouts` is set to True, or if `num_rollout_workers` is
+            greater than zero.
+        num_rollout_workers : int
+            the number of Ray actors that collect samples, each with its own
+            environment and copy of the policy. If greater than zero, every
+            rollout step collects one sample from each worker. If Ray has not
+            been initialized, a local Ray cluster is started. In order to
+            distribute the workers over multiple nodes, connect to an existing
+            cluster via `ray.init` before creating the algorithm.
+        n_cpus : int
+            the number of CPUs used by the tensorflow session. This is the
+            default size of both thread pools of the session.
+        intra_op_threads : int or None
+            the number of threads used to parallelize the computation of
+            single operations. Defaults to `n_cpus`.
+        inter_op_threads : int or None
+            the number of threads used to compute independent operations in
+            parallel. Defaults to `n_cpus`.
+        cpu_affinity : list of int or None
+            the CPUs that the process is pinned to. This is only supported on
+            Linux. If set to None, the process may run on any CPU.
+        autotune_threads : bool
+            whether to pick the fastest number of threads for the tensorflow
+            session when the model is created (see `_autotune_threads`). If
+            set to True, `intra_op_threads` and `inter_op_threads` are
+            replaced by the chosen number of threads.
         nb_eval_episodes : int
             the number of evaluation episodes
         actor_update_freq : int
@@ -298,13 +479,49 @@ class OffPolicyRLAlgorithm(object):
             policy-specific hyperparameters
         _init_setup_model : bool
             Whether or not to build the network at the creation of the instance
+
+        Raises
+        ------
+        ValueError
+            if rollout workers are combined with vectorized environments,
+            asynchronous rollouts, or fingerprints
+        ValueError
+            if vectorized environments are combined with n-step returns or
+            deduplicated observations
         """
+        if num_rollout_workers > 0 and (num_envs > 1 or async_rollouts):
+            raise ValueError(
+                "Rollout workers cannot be combined with multiple "
+                "environments or asynchronous rollouts.")
+
+        # The transitions of consecutive slots of the replay buffer belong to
+        # different environments, so they cannot be linked to one another.
+        if num_envs > 1 and (
+                (policy_kwargs or {}).get("n_step", 1) > 1
+                or (policy_kwargs or {}).get("deduplicate_obs", False)):
+            raise ValueError(
+                "Multiple environments cannot be combined with n-step "
+                "returns or deduplicated observations.")
+
         self.policy = policy
         self.env_name = deepcopy(env)
-        self.env = create_env(env, render, evaluate=False)
+        if num_envs > 1:
+            self.env = SubprocVecEnv(env, num_envs, render)
+        else:
+            self.env = create_env(env, render, evaluate=False)
         self.eval_env = create_env(eval_env, render_eval, evaluate=True)
         self.nb_train_steps = nb_train_steps
         self.nb_rollout_steps = nb_rollout_steps
+        self.num_envs = num_envs
+        self.async_rollouts = async_rollouts
+        self.max_replay_ratio = max_replay_ratio
+        self.actor_sync_interval = actor_sync_interval
+        self.num_rollout_workers = num_rollout_workers
+        self.n_cpus = n_cpus
+        self.intra_op_threads = intra_op_threads or n_cpus
+        self.inter_op_threads = inter_op_threads or n_cpus
+        self.cpu_affinity = cpu_affinity
+        self.autotune_threads = autotune_threads
         self.nb_eval_episodes = nb_eval_episodes
         self.actor_update_freq = actor_update_freq
         self.meta_update_freq = meta_update_freq
@@ -324,6 +541,9 @@ class OffPolicyRLAlgorithm(object):
         elif is_goal_conditioned_policy(policy):
             self.policy_kwargs.update(GOAL_CONDITIONED_PARAMS.copy())
             self.policy_kwargs['env_name'] = self.env_name.__str__()
+            # The samples of every rollout worker are assigned to a separate
+            # environment of the policy.
+            self.policy_kwargs['num_envs'] = num_rollout_workers or num_envs
 
         if is_td3_policy(policy):
             self.policy_kwargs.update(TD3_PARAMS.copy())
@@ -332,6 +552,11 @@ class OffPolicyRLAlgorithm(object):
 
         self.policy_kwargs.update(policy_kwargs or {})
 
+        if num_rollout_workers > 0 and \
+                self.policy_kwargs.get("use_fingerprints", False):
+            raise ValueError(
+                "Fingerprints are not supported by rollout workers.")
+
         # Compute the time horizon, which is used to check if an environment
         # terminated early and used to compute the done mask as per TD3
         # implementation (see appendix A of their paper). If the horizon cannot
@@ -351,11 +576,16 @@ class OffPolicyRLAlgorithm(object):
         self.graph = None
         self.policy_tf = None
         self.sess = None
+        self.actor_tf = None
+        self.actor_graph = None
+        self.actor_sess = None
+        self.rollout_workers = []
         self.summary = None
         self.obs = None
-        self.episode_step = 0
+        self.episode_step = 0 if num_envs == 1 else np.zeros(num_envs, int)
         self.episodes = 0
         self.total_steps = 0
+        self.total_updates = 0
         self.epoch_episode_rewards = []
         self.epoch_episode_steps = []
         self.epoch_actor_losses = []
@@ -367,12 +597,20 @@ class OffPolicyRLAlgorithm(object):
         self.epoch_episodes = 0
         self.epoch = 0
         self.episode_rewards_history = deque(maxlen=100)
-        self.episode_reward = 0
+        self.episode_reward = 0 if num_envs == 1 else np.zeros(num_envs)
         self.rew_ph = None
         self.rew_history_ph = None
         self.eval_rew_ph = None
         self.eval_success_ph = None
         self.saver = None
+        self._actor_weights_ph = None
+        self._actor_sync_op = None
+        self._actor_sync_updates = 0
+        self._ray_pending = None
+        self._actor_thread = None
+        self._actor_error = None
+        self._actor_stop = threading.Event()
+        self._samples_cv = threading.Condition()
 
         # Append the fingerprint dimension to the observation dimension, if
         # needed.
@@ -384,16 +622,31 @@ class OffPolicyRLAlgorithm(object):
                 (self.observation_space.high, fingerprint_range[1]))
             self.observation_space = Box(low=low, high=high)
 
+        # Pin the process to the requested CPUs. This is done before any of
+        # the threads of tensorflow are created.
+        if cpu_affinity is not None:
+            os.sched_setaffinity(0, cpu_affinity)
+
         # Create the model variables and operations.
         if _init_setup_model:
             self.trainable_vars = self.setup_model()
 
     def setup_model(self):
-        """Create the graph, session, policy, and summary objects."""
+        """Create the graph, session, policy, and summary objects.
+
+        If `async_rollouts` is set to True, the actor policy is created as
+        well (see `_setup_actor`). If `num_rollout_workers` is greater than
+        zero, the rollout workers are created.
+        """
+        # Pick the number of threads of the tensorflow session.
+        if self.autotune_threads:
+            self.intra_op_threads, self.inter_op_threads = \
+                self._autotune_threads()
+
         self.graph = tf.Graph()
         with self.graph.as_default():
             # Create the tensorflow session.
-            self.sess = make_session(num_cpu=3, graph=self.graph)
+            self.sess = self._make_session(self.graph)
 
             # Create the policy.
             self.policy_tf = self.policy(
@@ -423,15 +676,205 @@ class OffPolicyRLAlgorithm(object):
                 self.sess.run(tf.compat.v1.global_variables_initializer())
                 self.policy_tf.initialize()
 
-            return tf.compat.v1.get_collection(
+            trainable_vars = tf.compat.v1.get_collection(
                 tf.compat.v1.GraphKeys.TRAINABLE_VARIABLES)
 
+            # Create a saver object, so that checkpoints can be loaded before
+            # training. The saver is recreated by `learn` to keep all the
+            # checkpoints of the training run.
+            self.saver = tf.compat.v1.train.Saver(trainable_vars)
+
+        # Create the policy that is used to collect samples.
+        if self.async_rollouts:
+            self._setup_actor()
+        else:
+            self.actor_tf = self.policy_tf
+
+        # Create the Ray actors that collect samples.
+        if self.num_rollout_workers > 0:
+            worker_kwargs = self.policy_kwargs.copy()
+            worker_kwargs['verbose'] = 0
+            if is_goal_conditioned_policy(self.policy):
+                worker_kwargs['num_envs'] = 1
+
+            self.rollout_workers = create_rollout_workers(
+                self.num_rollout_workers,
+                env=self.env_name,
+                policy=self.policy,
+                observation_space=self.observation_space,
+                action_space=self.action_space,
+                context_space=self.context_space,
+                horizon=self.horizon,
+                policy_kwargs=worker_kwargs,
+                render=self.render,
+            )
+
+        return trainable_vars
+
+    def _make_session(self, graph, num_threads=None):
+        """Create a tensorflow session with the configured thread pools.
+
+        Parameters
+        ----------
+        graph : tf.Graph
+            the graph of the session
+        num_threads : int or None
+            the size of both thread pools. If set to None, the sizes are given
+            by `intra_op_threads` and `inter_op_threads`.
+
+        Returns
+        -------
+        tf.compat.v1.Session
+            a tensorflow session
+        """
+        if num_threads is not None:
+            return make_session(num_threads, graph=graph)
+
+        return make_session(
+            num_cpu=self.n_cpus,
+            graph=graph,
+            intra_op_threads=self.intra_op_threads,
+            inter_op_threads=self.inter_op_threads)
+
+    def _autotune_threads(self, num_updates=20):
+        """Return the fastest size of the thread pools of the session.
+
+        The candidate sizes range from one to `n_cpus` threads, in powers of
+        two, and are used for both thread pools. For every candidate, a copy
+        of the policy is created in a separate graph, and the duration of
+        `num_updates` calls to `update_from_batch` (on batches of zeros) is
+        measured. Goal-conditioned policies are timed via the updates of their
+        Manager and Worker policies.
+
+        Parameters
+        ----------
+        num_updates : int
+            the number of timed updates per candidate. An additional update is
+            performed beforehand, and is not timed.
+
+        Returns
+        -------
+        int
+            the number of intra-op threads
+        int
+            the number of inter-op threads
+        """
+        candidates = sorted({
+            min(2 ** i, self.n_cpus)
+            for i in range(int(np.log2(self.n_cpus)) + 2)})
+
+        durations = []
+        for num_threads in candidates:
+            graph = tf.Graph()
+            with graph.as_default():
+                sess = self._make_session(graph, num_threads)
+                policy = self.policy(
+                    sess,
+                    self.observation_space,
+                    self.action_space,
+                    self.context_space,
+                    **self.policy_kwargs
+                )
+                sess.run(tf.compat.v1.global_variables_initializer())
+
+                policies = [policy.manager, policy.worker] \
+                    if is_goal_conditioned_policy(self.policy) else [policy]
+
+                duration = 0
+                for pol in policies:
+                    batch_size = pol.batch_size
+                    obs = np.zeros(
+                        [batch_size] + pol.obs_ph.shape.as_list()[1:])
+                    action = np.zeros(
+                        [batch_size] + pol.action_ph.shape.as_list()[1:])
+                    zeros = np.zeros(batch_size)
+
+                    for i in range(num_updates + 1):
+                        start = time.time()
+                        pol.update_from_batch(obs, action, zeros, obs, zeros)
+                        if i > 0:
+                            duration += time.time() - start
+            sess.close()
+
+            durations.append(duration)
+            if self.verbose >= 1:
+                print("Autotune: {} threads, {:.4f} sec/update".format(
+                    num_threads, duration / num_updates))
+
+        num_threads = candidates[int(np.argmin(durations))]
+
+        return num_threads, num_threads
+
+    def _setup_actor(self):
+        """Create the actor policy used by asynchronous rollouts.
+
+        The actor policy is created in a separate graph and session, so that
+        its actions can be computed while the policy is trained. The samples
+        of the actor are stored in the replay buffer of the trained policy,
+        and its weights are updated via `_sync_actor_weights`.
+        """
+        # The actor is never trained, so no minibatches are prefetched for it.
+        actor_kwargs = self.policy_kwargs.copy()
+        actor_kwargs['prefetch_batches'] = 0
+
+        self.actor_graph = tf.Graph()
+        with self.actor_graph.as_default():
+            self.actor_sess = self._make_session(self.actor_graph)
+
+            self.actor_tf = self.policy(
+                self.actor_sess,
+                self.observation_space,
+                self.action_space,
+                self.context_space,
+                **actor_kwargs
+            )
+            self.actor_tf.replay_buffer = self.policy_tf.replay_buffer
+
+            # Create the operation that assigns the weights of the trained
+            # policy to the actor. Both graphs are created by the same
+            # procedure, so their trainable variables are in the same order.
+            self._actor_weights_ph = []
+            assign_ops = []
+            for var in tf.compat.v1.get_collection(
+                    tf.compat.v1.GraphKeys.TRAINABLE_VARIABLES):
+                ph = tf.compat.v1.placeholder(var.dtype.base_dtype, var.shape)
+                self._actor_weights_ph.append(ph)
+                assign_ops.append(tf.compat.v1.assign(var, ph))
+            self._actor_sync_op = tf.group(*assign_ops)
+
+            with self.actor_sess.as_default():
+                self.actor_sess.run(
+                    tf.compat.v1.global_variables_initializer())
+                self.actor_tf.initialize()
+
+    def _sync_actor_weights(self):
+        """Copy the weights of the trained policy to the actor policy.
+
+        If rollout workers are used, the weights are broadcast to all workers
+        instead. The workers assign the weights before collecting their next
+        samples.
+        """
+        total_updates = self.total_updates
+        weights = self.sess.run(self.trainable_vars)
+
+        if self.rollout_workers:
+            weights_id = ray.put(weights)
+            for worker in self.rollout_workers:
+                worker.set_weights.remote(weights_id)
+        else:
+            self.actor_sess.run(
+                self._actor_sync_op,
+                feed_dict=dict(zip(self._actor_weights_ph, weights)))
+
+        self._actor_sync_updates = total_updates
+
     def _policy(self,
                 obs,
                 context,
                 apply_noise=True,
                 compute_q=True,
-                random_actions=False):
+                random_actions=False,
+                evaluate=False):
         """Get the actions and critic output, from a given observation.
 
         Parameters
@@ -449,6 +892,9 @@ class OffPolicyRLAlgorithm(object):
             if set to True, actions are sampled randomly from the action space
             instead of being computed by the policy. This is used for
             exploration purposes.
+        evaluate : bool
+            whether the action is computed for the evaluation environment. If
+            so, the trained policy is used instead of the actor policy.
 
         Returns
         -------
@@ -457,15 +903,16 @@ class OffPolicyRLAlgorithm(object):
         float
             the critic value
         """
+        policy_tf = self.policy_tf if evaluate else self.actor_tf
         obs = np.array(obs).reshape((-1,) + self.observation_space.shape)
 
-        action = self.policy_tf.get_action(
+        action = policy_tf.get_action(
             obs, context,
             apply_noise=apply_noise,
             random_actions=random_actions
         )
 
-        q_value = self.policy_tf.value(obs, context, action) if compute_q \
+        q_value = policy_tf.value(obs, context, action) if compute_q \
             else None
 
         return action.flatten(), q_value
@@ -500,12 +947,15 @@ class OffPolicyRLAlgorithm(object):
             done mask.
         evaluate : bool
             whether the sample is being provided by the evaluation environment.
-            If so, the data is not stored in the replay buffer.
+            If so, the data is not stored in the replay buffer, and the
+            trained policy is used instead of the actor policy.
         """
+        policy_tf = self.policy_tf if evaluate else self.actor_tf
+
         # Scale the rewards by the provided term.
         reward *= self.reward_scale
 
-        self.policy_tf.store_transition(
+        policy_tf.store_transition(
             obs0, context0, action, reward, obs1, context1, terminal1,
             is_final_step, evaluate)
 
@@ -516,7 +966,8 @@ class OffPolicyRLAlgorithm(object):
               log_interval=2000,
               eval_interval=50000,
               save_interval=10000,
-              initial_exploration_steps=10000):
+              initial_exploration_steps=10000,
+              save_replay_buffer=False):
         """Perform the complete training operation.
 
         Parameters
@@ -538,7 +989,20 @@ class OffPolicyRLAlgorithm(object):
             model is saved
         initial_exploration_steps : int, optional
             number of timesteps that the policy is run before training to
-            initialize the replay buffer with samples
+            initialize the replay buffer with samples. If the replay buffer
+            already contains samples (e.g. it was restored via `load`), this
+            step is skipped.
+        save_replay_buffer : bool
+            whether to save a snapshot of the replay buffer next to every
+            checkpoint of the model. See the `save` method.
+
+        Notes
+        -----
+        If `async_rollouts` is set to True, samples are collected by an actor
+        thread once the initial exploration steps are done, and every
+        iteration of the learner performs a training step without waiting for
+        new samples. In this case, `log_interval` is the number of training
+        steps between logs.
         """
         # Create a saver object.
         self.saver = tf.compat.v1.train.Saver(
@@ -562,13 +1026,18 @@ class OffPolicyRLAlgorithm(object):
         random.seed(seed)
         np.random.seed(seed)
         tf.compat.v1.set_random_seed(seed)
+        if seed is not None:
+            for i, worker in enumerate(self.rollout_workers):
+                worker.seed.remote(seed + i + 1)
 
         if self.verbose >= 2:
             print('Using agent with the following configuration:')
             print(str(self.__dict__.items()))
 
-        eval_steps_incr = 0
-        save_steps_incr = 0
+        # The number of steps restored from a checkpoint, if any.
+        initial_steps = self.total_steps
+        eval_steps_incr = initial_steps
+        save_steps_incr = initial_steps
         start_time = time.time()
 
         with self.sess.as_default(), self.graph.as_default():
@@ -578,44 +1047,71 @@ class OffPolicyRLAlgorithm(object):
             self.obs = self._add_fingerprint(
                 self.obs, self.total_steps, total_timesteps)
 
-            # Collect preliminary random samples.
-            print("Collecting pre-samples...")
-            self._collect_samples(total_timesteps,
-                                  run_steps=initial_exploration_steps,
-                                  random_actions=True)
-            print("Done!")
-
-            # Reset total statistics variables.
+            # Start the rollout workers from the weights of the policy.
+            if self.rollout_workers:
+                self._sync_actor_weights()
+
+            # Collect preliminary random samples. This is not needed if the
+            # replay buffer was restored from a snapshot.
+            # Every step of vectorized environments (or rollout workers)
+            # collects one sample per environment (or worker).
+            if len(self.policy_tf.replay_buffer) == 0:
+                print("Collecting pre-samples...")
+                num_samples = self.num_rollout_workers or self.num_envs
+                self._collect_samples(
+                    total_timesteps,
+                    run_steps=-(-initial_exploration_steps // num_samples),
+                    random_actions=True)
+                print("Done!")
+
+            # Reset total statistics variables. The number of steps of a
+            # restored checkpoint is kept, so that the checkpoints and replay
+            # buffer snapshots of the resumed training do not overwrite the
+            # ones it was restored from.
             self.episodes = 0
-            self.total_steps = 0
+            self.total_steps = initial_steps
+            self.total_updates = 0
             self.episode_rewards_history = deque(maxlen=100)
 
+            # Start collecting samples in the actor thread, if needed.
+            if self.async_rollouts:
+                self._start_actor(total_timesteps)
+
             while True:
-                # Reset epoch-specific variables.
-                self.epoch_episodes = 0
-                self.epoch_actions = []
-                self.epoch_q1s = []
-                self.epoch_q2s = []
-                self.epoch_actor_losses = []
-                self.epoch_q1_losses = []
-                self.epoch_q2_losses = []
-                self.epoch_episode_rewards = []
-                self.epoch_episode_steps = []
+                # Reset epoch-specific variables. These are also updated by
+                # the actor thread, if any, while holding the samples lock.
+                with self._samples_cv:
+                    self.epoch_episodes = 0
+                    self.epoch_actions = []
+                    self.epoch_q1s = []
+                    self.epoch_q2s = []
+                    self.epoch_actor_losses = []
+                    self.epoch_q1_losses = []
+                    self.epoch_q2_losses = []
+                    self.epoch_episode_rewards = []
+                    self.epoch_episode_steps = []
 
                 for _ in range(log_interval):
                     # If the requirement number of time steps has been met,
                     # terminate training.
                     if self.total_steps >= total_timesteps:
+                        self._stop_actor()
                         return
 
-                    # Perform rollouts.
-                    self._collect_samples(total_timesteps)
+                    if self.async_rollouts:
+                        # Wait for the actor if the maximum replay ratio has
+                        # been met.
+                        self._wait_for_samples()
+                    else:
+                        # Perform rollouts.
+                        self._collect_samples(total_timesteps)
 
                     # Train.
                     self._train()
 
                 # Log statistics.
-                self._log_training(train_filepath, start_time)
+                with self._samples_cv:
+                    self._log_training(train_filepath, start_time)
 
                 # Evaluate.
                 if self.eval_env is not None and \
@@ -647,35 +1143,55 @@ class OffPolicyRLAlgorithm(object):
                     td_map = self.policy_tf.get_td_map()
                     # Check if td_map is empty.
                     if td_map:
-                        td_map.update({
-                            self.rew_ph: np.mean(self.epoch_episode_rewards),
-                            self.rew_history_ph: np.mean(
-                                self.episode_rewards_history),
-                        })
+                        with self._samples_cv:
+                            td_map.update({
+                                self.rew_ph: np.mean(
+                                    self.epoch_episode_rewards),
+                                self.rew_history_ph: np.mean(
+                                    self.episode_rewards_history),
+                            })
                         summary = self.sess.run(self.summary, td_map)
                         writer.add_summary(summary, self.total_steps)
 
                 # Save a checkpoint of the model.
                 if (self.total_steps - save_steps_incr) >= save_interval:
                     save_steps_incr += save_interval
-                    self.save(os.path.join(log_dir, "checkpoints/itr"))
+                    self.save(os.path.join(log_dir, "checkpoints/itr"),
+                              save_replay_buffer=save_replay_buffer)
 
                 # Update the epoch count.
                 self.epoch += 1
 
-    def save(self, save_path):
+    def save(self, save_path, save_replay_buffer=False):
         """Save the parameters of a tensorflow model.
 
+        If requested, a snapshot of the replay buffer is additionally stored
+        in the directory "<checkpoint>.replay". Snapshots after the first one
+        are incremental, and only contain the samples that were added since
+        the previous checkpoint.
+
         Parameters
         ----------
         save_path : str
             Prefix of filenames created for the checkpoint
+        save_replay_buffer : bool
+            whether to save a snapshot of the replay buffer
         """
-        self.saver.save(self.sess, save_path, global_step=self.total_steps)
+        ckpt_path = self.saver.save(
+            self.sess, save_path, global_step=self.total_steps)
+
+        if save_replay_buffer:
+            with self.policy_tf.replay_buffer.lock:
+                self.policy_tf.replay_buffer.save(
+                    ckpt_path + ".replay", incremental=True)
 
     def load(self, load_path):
         """Load model parameters from a checkpoint.
 
+        If a snapshot of the replay buffer was stored with the checkpoint, the
+        replay buffer is restored as well. The total number of steps is
+        restored from the global step the checkpoint was saved with.
+
         Parameters
         ----------
         load_path : str
@@ -683,6 +1199,21 @@ class OffPolicyRLAlgorithm(object):
         """
         self.saver.restore(self.sess, load_path)
 
+        match = re.search(r"-(\d+)$", load_path)
+        if match is not None:
+            self.total_steps = int(match.group(1))
+
+        if self.async_rollouts or self.rollout_workers:
+            self._sync_actor_weights()
+
+        if os.path.isdir(load_path + ".replay"):
+            # Discard any minibatches that were prefetched from the previous
+            # content of the replay buffer.
+            if self.policy_tf.prefetcher is not None:
+                self.policy_tf.prefetcher.close()
+
+            self.policy_tf.replay_buffer.load(load_path + ".replay")
+
     def _collect_samples(self,
                          total_timesteps,
                          run_steps=None,
@@ -706,6 +1237,15 @@ class OffPolicyRLAlgorithm(object):
             instead of being computed by the policy. This is used for
             exploration purposes.
         """
+        if self.num_envs > 1:
+            self._collect_vec_samples(total_timesteps, run_steps,
+                                      random_actions)
+            return
+
+        if self.rollout_workers:
+            self._collect_ray_samples(run_steps, random_actions)
+            return
+
         for _ in range(run_steps or self.nb_rollout_steps):
             # Collect the contextual term. None if it is not passed.
             context = [self.env.current_context] \
@@ -752,26 +1292,30 @@ class OffPolicyRLAlgorithm(object):
                 is_final_step=self.episode_step >= self.horizon - 1
             )
 
-            # Book-keeping.
-            self.total_steps += 1
-            self.episode_reward += reward
-            self.episode_step += 1
-            self.epoch_actions.append(action)
-            self.epoch_q1s.append(q1_value)
-            self.epoch_q2s.append(q2_value)
+            # Book-keeping. The statistics are updated while holding the
+            # samples lock, since they are logged and reset by the learner if
+            # samples are collected in the actor thread.
+            with self._samples_cv:
+                self.total_steps += 1
+                self.episode_reward += reward
+                self.episode_step += 1
+                self.epoch_actions.append(action)
+                self.epoch_q1s.append(q1_value)
+                self.epoch_q2s.append(q2_value)
 
             # Update the current observation.
             self.obs = new_obs.copy()
 
             if done:
                 # Episode done.
-                self.epoch_episode_rewards.append(self.episode_reward)
-                self.episode_rewards_history.append(self.episode_reward)
-                self.epoch_episode_steps.append(self.episode_step)
-                self.episode_reward = 0.
-                self.episode_step = 0
-                self.epoch_episodes += 1
-                self.episodes += 1
+                with self._samples_cv:
+                    self.epoch_episode_rewards.append(self.episode_reward)
+                    self.episode_rewards_history.append(self.episode_reward)
+                    self.epoch_episode_steps.append(self.episode_step)
+                    self.episode_reward = 0.
+                    self.episode_step = 0
+                    self.epoch_episodes += 1
+                    self.episodes += 1
 
                 # Reset the environment.
                 self.obs = self.env.reset()
@@ -780,35 +1324,304 @@ class OffPolicyRLAlgorithm(object):
                 self.obs = self._add_fingerprint(
                     self.obs, self.total_steps, total_timesteps)
 
+    def _collect_vec_samples(self,
+                             total_timesteps,
+                             run_steps=None,
+                             random_actions=False):
+        """Perform the sample collection operation on vectorized environments.
+
+        Every step computes the actions of all environments with a single call
+        to the policy, and stores the resulting transitions in the replay
+        buffer at once. Environments are reset independently once their
+        episodes are done.
+
+        See `_collect_samples` for a description of the arguments.
+        """
+        for _ in range(run_steps or self.nb_rollout_steps):
+            # Predict the next actions. Use random actions when initializing
+            # the replay buffer.
+            action, (q1_value, q2_value) = self._policy(
+                self.obs, self.env.contexts,
+                apply_noise=True,
+                random_actions=random_actions,
+                compute_q=True)
+            action = action.reshape(
+                (self.num_envs,) + self.action_space.shape)
+
+            # Execute the next actions. Environments whose episodes are done
+            # are reset by the workers.
+            new_obs, reward, done, info, context = self.env.step(action)
+
+            # Add the fingerprint term, if needed.
+            new_obs = self._add_fingerprint(
+                new_obs,
+                0 if random_actions else self.total_steps,
+                total_timesteps)
+
+            # Store the transitions in the replay buffer. The terminal flags
+            # are chosen as in `_collect_samples`.
+            self.actor_tf.store_transitions(
+                obs0=self.obs,
+                context0=context,
+                action=action,
+                reward=reward * self.reward_scale,
+                obs1=new_obs,
+                context1=context,
+                done=done,
+                is_final_step=self.episode_step >= self.horizon - 1
+            )
+
+            # Book-keeping. See `_collect_samples` for the use of the lock.
+            with self._samples_cv:
+                self.total_steps += self.num_envs
+                self.episode_reward += reward
+                self.episode_step += 1
+                self.epoch_actions.extend(action)
+                self.epoch_q1s.append(q1_value)
+                self.epoch_q2s.append(q2_value)
+
+            # Update the current observations. The environments that were
+            # reset start from the initial observations of their new episodes.
+            self.obs = np.where(
+                done[:, None],
+                self._add_fingerprint(
+                    self.env.obs, self.total_steps, total_timesteps),
+                new_obs)
+
+            with self._samples_cv:
+                for i in np.flatnonzero(done):
+                    # Episode done.
+                    self.epoch_episode_rewards.append(self.episode_reward[i])
+                    self.episode_rewards_history.append(
+                        self.episode_reward[i])
+                    self.epoch_episode_steps.append(self.episode_step[i])
+                    self.episode_reward[i] = 0.
+                    self.episode_step[i] = 0
+                    self.epoch_episodes += 1
+                    self.episodes += 1
+
+    def _start_actor(self, total_timesteps):
+        """Start collecting samples in the actor thread.
+
+        Parameters
+        ----------
+        total_timesteps : int
+            the total number of samples to train on. The actor stops once this
+            many samples have been collected.
+        """
+        self._sync_actor_weights()
+        self._actor_error = None
+        self._actor_stop.clear()
+        self._actor_thread = threading.Thread(
+            target=self._run_actor, args=(total_timesteps,), daemon=True)
+        self._actor_thread.start()
+
+    def _stop_actor(self):
+        """Stop the actor thread, if it is running."""
+        if self._actor_thread is None:
+            return
+
+        self._actor_stop.set()
+        self._actor_thread.join()
+        self._actor_thread = None
+
+    def _run_actor(self, total_timesteps):
+        """Collect samples in the actor thread until training is done.
+
+        The weights of the actor are synced with the trained policy whenever
+        `actor_sync_interval` training steps have been performed since the
+        last sync. Any exception raised while collecting samples is stored in
+        `_actor_error`, and raised by the learner.
+        """
+        try:
+            with self.actor_sess.as_default(), self.actor_graph.as_default():
+                while not self._actor_stop.is_set() \
+                        and self.total_steps < total_timesteps:
+                    if self.total_updates - self._actor_sync_updates \
+                            >= self.actor_sync_interval:
+                        self._sync_actor_weights()
+
+                    self._collect_samples(total_timesteps)
+
+                    # Wake up the learner if it is waiting for samples.
+                    with self._samples_cv:
+                        self._samples_cv.notify_all()
+        except Exception as e:
+            self._actor_error = e
+        finally:
+            with self._samples_cv:
+                self._samples_cv.notify_all()
+
+    def _wait_for_samples(self):
+        """Wait until the learner may perform the next training step.
+
+        If `max_replay_ratio` is set, this blocks until the number of training
+        steps per collected sample, including the next training step, does
+        not exceed it.
+
+        Raises
+        ------
+        Exception
+            any exception that was raised by the actor thread
+        """
+        def ready():
+            return not self._actor_thread.is_alive() or \
+                self.max_replay_ratio is None or \
+                self.total_updates + self.nb_train_steps \
+                <= self.max_replay_ratio * self.total_steps
+
+        with self._samples_cv:
+            self._samples_cv.wait_for(ready)
+
+        if self._actor_error is not None:
+            raise self._actor_error
+
+    def _collect_ray_samples(self, run_steps=None, random_actions=False):
+        """Perform the sample collection operation with the rollout workers.
+
+        Every worker collects `run_steps` samples. Once the samples have been
+        received, the workers start collecting the next samples, so that
+        sample collection is overlapped with the storage of the samples and
+        training. Before doing so, the weights of the workers are synced with
+        the trained policy if `actor_sync_interval` training steps have been
+        performed since the last sync. Random samples are not collected in
+        advance.
+
+        See `_collect_samples` for a description of the arguments.
+        """
+        num_steps = run_steps or self.nb_rollout_steps
+
+        if random_actions:
+            pending = [worker.collect.remote(num_steps, True)
+                       for worker in self.rollout_workers]
+        elif self._ray_pending is not None:
+            pending = self._ray_pending
+        else:
+            pending = [worker.collect.remote(num_steps)
+                       for worker in self.rollout_workers]
+
+        batches = ray.get(pending)
+
+        # Start collecting the next samples.
+        if not random_actions:
+            if self.total_updates - self._actor_sync_updates \
+                    >= self.actor_sync_interval:
+                self._sync_actor_weights()
+            self._ray_pending = [worker.collect.remote(num_steps)
+                                 for worker in self.rollout_workers]
+
+        self._store_ray_samples(batches)
+
+        # Book-keeping.
+        for batch in batches:
+            self.total_steps += len(batch["reward"])
+            self.epoch_actions.extend(batch["action"])
+            self.epoch_q1s.extend(batch["q1"])
+            self.epoch_q2s.extend(batch["q2"])
+            for episode_reward, episode_step in zip(
+                    batch["episode_rewards"], batch["episode_steps"]):
+                self.epoch_episode_rewards.append(episode_reward)
+                self.episode_rewards_history.append(episode_reward)
+                self.epoch_episode_steps.append(episode_step)
+                self.epoch_episodes += 1
+                self.episodes += 1
+
+    def _store_ray_samples(self, batches):
+        """Store the samples of the rollout workers in the replay buffer.
+
+        The samples of goal-conditioned policies are stored one step at a
+        time, with the samples of every worker assigned to a separate
+        environment of the policy. The Manager actions of these samples are
+        the ones computed by the workers. The samples of feedforward policies
+        are stored one worker after the other, so that the trajectory of every
+        worker remains contiguous in the replay buffer (as is required by
+        n-step returns and deduplicated observations).
+
+        Parameters
+        ----------
+        batches : list of dict
+            the samples of every worker (see the `collect` method of
+            hbaselines.utils.ray_workers.RolloutWorker)
+        """
+        keys = ["obs0", "context0", "action", "reward", "obs1", "context1",
+                "done", "is_final_step"]
+
+        if is_goal_conditioned_policy(self.policy):
+            def stack(key):
+                if batches[0][key] is None:
+                    return None
+                return np.stack([batch[key] for batch in batches], axis=1)
+
+            # Samples with shape (num_steps, num_workers, ...).
+            samples = {key: stack(key) for key in keys}
+            samples["reward"] = samples["reward"] * self.reward_scale
+            meta_action = stack("meta_action")
+
+            for t in range(len(samples["reward"])):
+                self.policy_tf.meta_action = meta_action[t]
+                self.policy_tf.store_transitions(**{
+                    key: None if val is None else val[t]
+                    for key, val in samples.items()})
+        else:
+            def concatenate(key):
+                if batches[0][key] is None:
+                    return None
+                return np.concatenate([batch[key] for batch in batches])
+
+            # Samples with shape (num_workers * num_steps, ...).
+            samples = {key: concatenate(key) for key in keys}
+            samples["reward"] = samples["reward"] * self.reward_scale
+            self.policy_tf.store_transitions(**samples)
+
     def _train(self):
         """Perform the training operation.
 
         Through this method, the actor and critic networks are updated within
         the policy, and the summary information is logged to tensorboard.
         """
-        for t_train in range(self.nb_train_steps):
-            if is_goal_conditioned_policy(self.policy):
+        # The update frequencies are based on the number of samples. If the
+        # samples are collected asynchronously, the number of samples may not
+        # change between training steps, so the number of training steps is
+        # used instead.
+        steps = self.total_updates if self.async_rollouts \
+            else self.total_steps
+
+        # specifies whether to update the actor policy, base on the actor
+        # update frequency
+        update_actor = [
+            (steps + t_train) % self.actor_update_freq == 0
+            for t_train in range(self.nb_train_steps)
+        ]
+
+        if is_goal_conditioned_policy(self.policy):
+            critic_losses = []
+            actor_losses = []
+            for t_train in range(self.nb_train_steps):
                 # specifies whether to update the meta actor and critic
                 # policies based on the meta and actor update frequencies
                 kwargs = {
                     "update_meta":
-                        (self.total_steps + t_train)
+                        (steps + t_train)
                         % self.meta_update_freq == 0,
                     "update_meta_actor":
-                        (self.total_steps + t_train)
+                        (steps + t_train)
                         % (self.meta_update_freq * self.actor_update_freq) == 0
                 }
-            else:
-                kwargs = {}
 
-            # specifies whether to update the actor policy, base on the actor
-            # update frequency
-            update = (self.total_steps + t_train) % self.actor_update_freq == 0
+                # Run a step of training from batch.
+                critic_loss, actor_loss = self.policy_tf.update(
+                    update_actor=update_actor[t_train], **kwargs)
+                critic_losses.append(critic_loss)
+                actor_losses.append(actor_loss)
+        else:
+            # Run all steps of training, with the batches of all steps sampled
+            # at once.
+            critic_losses, actor_losses = self.policy_tf.update_many(
+                update_actor)
 
-            # Run a step of training from batch.
-            critic_loss, actor_loss = self.policy_tf.update(
-                update_actor=update, **kwargs)
+        self.total_updates += self.nb_train_steps
 
+        for critic_loss, actor_loss in zip(critic_losses, actor_losses):
             # Add actor and critic loss information for logging purposes.
             if isinstance(critic_loss, tuple):
                 # For hierarchical policies
@@ -886,7 +1699,7 @@ class OffPolicyRLAlgorithm(object):
                 eval_action, _ = self._policy(
                     eval_obs, context,
                     apply_noise=not self.eval_deterministic,
-                    random_actions=False, compute_q=False)
+                    random_actions=False, compute_q=False, evaluate=True)
 
                 obs, eval_r, done, info = env.step(eval_action)
 
@@ -991,7 +1804,8 @@ class OffPolicyRLAlgorithm(object):
         Parameters
         ----------
         obs : array_like
-            the current observation without the fingerprint element
+            the current observation without the fingerprint element, or a
+            matrix of observations (one per row)
         steps : int
             the total number of steps that have been performed
 
@@ -1008,9 +1822,10 @@ class OffPolicyRLAlgorithm(object):
         # compute the fingerprint term
         frac_steps = float(steps) / float(total_steps)
         fp = [5 * frac_steps, 5 * (1 - frac_steps)]
+        fp = np.broadcast_to(fp, np.shape(obs)[:-1] + (2,))
 
         # append the fingerprint term to the current observation
-        new_obs = np.concatenate((obs, fp), axis=0)
+        new_obs = np.concatenate((obs, fp), axis=-1)
 
         return new_obs
 
@@ -1047,9 +1862,18 @@ class OffPolicyRLAlgorithm(object):
 
             # Total statistics.
             'total/epochs': self.epoch + 1,
-            'total/steps': self.total_steps
+            'total/steps': self.total_steps,
+            'total/updates': self.total_updates,
+            'total/updates_per_sample':
+                self.total_updates / max(self.total_steps, 1),
         }
 
+        # Add the hit rate of the cached off-policy corrections, if used.
+        replay_buffer = getattr(self.policy_tf, "replay_buffer", None)
+        if getattr(replay_buffer, "correction_staleness", None) is not None:
+            combined_stats['train/correction_hit_rate'] = \
+                replay_buffer.correction_hit_rate
+
         # Save combined_stats in a csv file.
         if file_path is not None:
             exists = os.path.exists(file_path)
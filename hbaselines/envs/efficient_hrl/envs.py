@@ -3,7 +3,7 @@ import numpy as np
 import random
 from gym.spaces import Box
 
-from hbaselines.utils.reward_fns import negative_distance
+from hbaselines.utils.reward_fns import NegativeDistance
 from hbaselines.envs.efficient_hrl.ant_maze_env import AntMazeEnv
 
 # scale to the contextual reward. Does not affect the environmental reward.
@@ -239,16 +239,12 @@ class AntMaze(UniversalAntMazeEnv):
         """
         maze_id = "Maze"
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 1],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=REWARD_SCALE
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 1],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=REWARD_SCALE
+        )
 
         super(AntMaze, self).__init__(
             maze_id=maze_id,
@@ -298,16 +294,12 @@ class AntPush(UniversalAntMazeEnv):
         """
         maze_id = "Push"
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 1],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=REWARD_SCALE
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 1],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=REWARD_SCALE
+        )
 
         super(AntPush, self).__init__(
             maze_id=maze_id,
@@ -359,16 +351,12 @@ class AntFall(UniversalAntMazeEnv):
         """
         maze_id = "Fall"
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 1, 2],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=REWARD_SCALE
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 1, 2],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=REWARD_SCALE
+        )
 
         super(AntFall, self).__init__(
             maze_id=maze_id,
@@ -412,16 +400,12 @@ class AntFourRooms(UniversalAntMazeEnv):
         """
         maze_id = "FourRooms"
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 1],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=REWARD_SCALE
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 1],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=REWARD_SCALE
+        )
 
         super(AntFourRooms, self).__init__(
             maze_id=maze_id,
@@ -4,7 +4,7 @@ import gym
 from gym.spaces import Box
 import os
 from hbaselines.envs.hac.env_utils import check_validity
-from hbaselines.utils.reward_fns import negative_distance
+from hbaselines.utils.reward_fns import NegativeDistance
 
 try:
     import mujoco_py
@@ -325,16 +325,12 @@ class UR5(Environment):
         angle_threshold = np.deg2rad(10)
         end_goal_thresholds = np.array([angle_threshold for _ in range(3)])
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 1, 2],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=1.0
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 1, 2],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=1.0
+        )
 
         super(UR5, self).__init__(
             model_name=model_name,
@@ -550,16 +546,12 @@ class Pendulum(Environment):
         # for each dimension, the end goal has been achieved.
         end_goal_thresholds = np.array([np.deg2rad(9.5), 0.6])
 
-        def contextual_reward(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                goals=goals,
-                next_states=next_states,
-                state_indices=[0, 2],
-                relative_context=False,
-                offset=0.0,
-                reward_scales=1.0
-            )
+        contextual_reward = NegativeDistance(
+            state_indices=[0, 2],
+            relative_context=False,
+            offset=0.0,
+            reward_scales=1.0
+        )
 
         super(Pendulum, self).__init__(
             model_name=model_name,
@@ -5,6 +5,7 @@ import tensorflow.contrib.slim as slim
 
 from hbaselines.utils.tf_util import get_trainable_vars
 from hbaselines.utils.tf_util import get_target_updates
+from hbaselines.utils.prefetch import ReplayPrefetcher
 
 
 class ActorCriticPolicy(object):
@@ -44,6 +45,48 @@ class ActorCriticPolicy(object):
         specifies whether to use the huber distance function as the loss for
         the critic. If set to False, the mean-squared error metric is used
         instead
+    prioritized_replay : bool
+        whether to use prioritized experience replay. See:
+        https://arxiv.org/abs/1511.05952
+    prioritized_replay_alpha : float
+        how much prioritization is used (0 - no prioritization, 1 - full
+        prioritization)
+    prioritized_replay_beta : float
+        to what degree to use importance weights (0 - no corrections, 1 - full
+        correction)
+    prioritized_replay_eps : float
+        small positive term added to the priorities to ensure that every
+        sample can be drawn
+    storage : str
+        the storage backend of the replay buffer, one of "memory" (in-RAM numpy
+        arrays) or "memmap" (numpy arrays memory-mapped to files in
+        `buffer_dir`)
+    buffer_dir : str or None
+        the directory memory-mapped replay buffer files are stored in. If set
+        to None, the default temporary directory is used. Only used if
+        `storage` is set to "memmap".
+    deduplicate_obs : bool
+        whether to store every observation in the replay buffer once, instead
+        of storing the observations and next observations separately. This
+        roughly halves the memory used by the observations.
+    obs_encoding : str
+        the encoding observations are stored in within the replay buffer, one
+        of "float32", "float16", "uint8", or "uint16". The integer encodings
+        quantize every element of the observation affinely between its bounds
+        in the observation space or, if these are not finite, its running
+        minimum and maximum.
+    prefetch_batches : int
+        the number of minibatches that are sampled in advance by a background
+        thread, overlapping the sampling procedure with the gradient updates.
+        If set to 0, minibatches are sampled when they are needed.
+    n_step : int
+        the number of consecutive transitions used to compute the target values
+        of the critic. If greater than 1, the discounted rewards of up to
+        `n_step` transitions (of the same episode) are summed, and the value of
+        the final next observation is discounted accordingly.
+    prefetcher : hbaselines.utils.prefetch.ReplayPrefetcher or None
+        the object that samples minibatches from the replay buffer in a
+        background thread. Set to None if `prefetch_batches` is 0.
     """
 
     def __init__(self,
@@ -61,7 +104,17 @@ class ActorCriticPolicy(object):
                  layer_norm,
                  layers,
                  act_fun,
-                 use_huber):
+                 use_huber,
+                 prioritized_replay,
+                 prioritized_replay_alpha,
+                 prioritized_replay_beta,
+                 prioritized_replay_eps,
+                 storage,
+                 buffer_dir,
+                 deduplicate_obs,
+                 obs_encoding,
+                 prefetch_batches,
+                 n_step):
         """Instantiate the base policy object.
 
         Parameters
@@ -99,6 +152,47 @@ class ActorCriticPolicy(object):
             specifies whether to use the huber distance function as the loss
             for the critic. If set to False, the mean-squared error metric is
             used instead
+        prioritized_replay : bool
+            whether to use prioritized experience replay. See:
+            https://arxiv.org/abs/1511.05952
+        prioritized_replay_alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization)
+        prioritized_replay_beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction)
+        prioritized_replay_eps : float
+            small positive term added to the priorities to ensure that every
+            sample can be drawn
+        storage : str
+            the storage backend of the replay buffer, one of "memory" (in-RAM
+            numpy arrays) or "memmap" (numpy arrays memory-mapped to files in
+            `buffer_dir`)
+        buffer_dir : str or None
+            the directory memory-mapped replay buffer files are stored in. If
+            set to None, the default temporary directory is used. Only used if
+            `storage` is set to "memmap".
+        deduplicate_obs : bool
+            whether to store every observation in the replay buffer once,
+            instead of storing the observations and next observations
+            separately. This roughly halves the memory used by the
+            observations.
+        obs_encoding : str
+            the encoding observations are stored in within the replay buffer,
+            one of "float32", "float16", "uint8", or "uint16". The integer
+            encodings quantize every element of the observation affinely
+            between its bounds in the observation space or, if these are not
+            finite, its running minimum and maximum.
+        prefetch_batches : int
+            the number of minibatches that are sampled in advance by a
+            background thread, overlapping the sampling procedure with the
+            gradient updates. If set to 0, minibatches are sampled when they
+            are needed.
+        n_step : int
+            the number of consecutive transitions used to compute the target
+            values of the critic. If greater than 1, the discounted rewards of
+            up to `n_step` transitions (of the same episode) are summed, and
+            the value of the final next observation is discounted accordingly.
         """
         self.sess = sess
         self.ob_space = ob_space
@@ -115,6 +209,17 @@ class ActorCriticPolicy(object):
         self.layer_norm = layer_norm
         self.act_fun = act_fun
         self.use_huber = use_huber
+        self.prioritized_replay = prioritized_replay
+        self.prioritized_replay_alpha = prioritized_replay_alpha
+        self.prioritized_replay_beta = prioritized_replay_beta
+        self.prioritized_replay_eps = prioritized_replay_eps
+        self.storage = storage
+        self.buffer_dir = buffer_dir
+        self.deduplicate_obs = deduplicate_obs
+        self.obs_encoding = obs_encoding
+        self.prefetch_batches = prefetch_batches
+        self.n_step = n_step
+        self.prefetcher = None
 
     def initialize(self):
         """Initialize the policy.
@@ -142,6 +247,148 @@ class ActorCriticPolicy(object):
         """
         raise NotImplementedError
 
+    def update_many(self, update_actor):
+        """Perform multiple gradient update steps.
+
+        The batches of all update steps are sampled together via the
+        `sample_many` method of the replay buffer, and are then used by one
+        call to `update_from_batch` per step (see `update_from_batches`).
+        This removes the overhead of sampling the batches one at a time, but
+        not that of the session runs of the update steps.
+
+        If prioritized experience replay is used, all batches are sampled with
+        the priorities from before the update steps, and the priorities of the
+        samples are only updated once all update steps are done.
+
+        Parameters
+        ----------
+        update_actor : list of bool
+            specifies whether to update the actor policy in every update step.
+            The number of update steps is equal to the length of this list.
+
+        Returns
+        -------
+        list of [float, float]
+            Q1 loss, Q2 loss of every update step
+        list of float
+            actor loss of every update step
+        """
+        num_updates = len(update_actor)
+
+        # Not enough samples in the replay buffer.
+        if not self.replay_buffer.can_sample():
+            return [[0, 0]] * num_updates, [0] * num_updates
+
+        if self.prefetcher is not None:
+            # The minibatches are already sampled in the background, one at a
+            # time.
+            outputs = [self.update(update_actor=update)
+                       for update in update_actor]
+            return [out[0] for out in outputs], [out[1] for out in outputs]
+
+        # Get the batches (see `update`).
+        with self.replay_buffer.lock:
+            samples = self.replay_buffer.sample_many(
+                num_updates, **self._sample_kwargs)
+        obs0, actions, rewards, obs1, terminals1 = samples[:5]
+        discount = samples[5] if self.n_step > 1 else None
+        weights, idxes = samples[-2:] if self.prioritized_replay \
+            else (None, None)
+
+        outputs = self.update_from_batches(
+            obs0, actions, rewards, obs1, terminals1,
+            update_actor=update_actor,
+            weights=weights,
+            discount=discount,
+            return_td_error=self.prioritized_replay)
+
+        # Update the priorities of the samples based on their TD error.
+        if self.prioritized_replay:
+            with self.replay_buffer.lock:
+                self.replay_buffer.update_priorities(
+                    idxes.flatten(), outputs[2].flatten())
+
+        return outputs[:2]
+
+    def update_from_batches(self,
+                            obs0,
+                            actions,
+                            rewards,
+                            obs1,
+                            terminals1,
+                            update_actor=True,
+                            weights=None,
+                            discount=None,
+                            return_td_error=False):
+        """Perform multiple gradient update steps given stacked batches.
+
+        Every term consists of the batches of all update steps, stacked along
+        a leading dimension (e.g. as returned by the `sample_many` method of
+        the replay buffer). One update step is performed per batch, in order,
+        via a separate call to `update_from_batch`.
+
+        Parameters
+        ----------
+        obs0 : np.ndarray
+            (num_updates, batch_size, obs_dim) batches of observations
+        actions : numpy float
+            batches of actions executed given obs_batch
+        rewards : numpy float
+            rewards received as results of executing act_batch
+        obs1 : np.ndarray
+            next set of observations seen after executing act_batch
+        terminals1 : numpy bool
+            done_mask[i, j] = 1 if executing act_batch[i, j] resulted in the
+            end of an episode and 0 otherwise.
+        update_actor : bool or list of bool
+            specifies whether to update the actor policy, either for all or
+            for every update step
+        weights : array_like or None
+            importance weights of every sample in the batches. If set to None,
+            all samples are weighted equally.
+        discount : array_like or None
+            the discount term of the value of the next observation of every
+            sample in the batches. If set to None, gamma is used for every
+            sample.
+        return_td_error : bool
+            whether to additionally return the TD error of every sample in the
+            batches
+
+        Returns
+        -------
+        list of [float, float]
+            Q1 loss, Q2 loss of every update step
+        list of float
+            actor loss of every update step
+        np.ndarray
+            (num_updates, batch_size) array of TD errors. Only returned if
+            `return_td_error` is set to True.
+        """
+        num_updates = len(obs0)
+        if isinstance(update_actor, bool):
+            update_actor = [update_actor] * num_updates
+
+        critic_loss = []
+        actor_loss = []
+        td_error = []
+        for i in range(num_updates):
+            vals = self.update_from_batch(
+                obs0[i], actions[i], rewards[i], obs1[i], terminals1[i],
+                update_actor=update_actor[i],
+                weights=None if weights is None else weights[i],
+                discount=None if discount is None else discount[i],
+                return_td_error=return_td_error)
+
+            critic_loss.append(vals[0])
+            actor_loss.append(vals[1])
+            if return_td_error:
+                td_error.append(vals[2])
+
+        if return_td_error:
+            return critic_loss, actor_loss, np.array(td_error)
+
+        return critic_loss, actor_loss
+
     def get_action(self, obs, context, apply_noise, random_actions):
         """Call the actor methods to compute policy actions.
 
@@ -219,10 +466,75 @@ class ActorCriticPolicy(object):
         """
         raise NotImplementedError
 
+    def store_transitions(self, obs0, context0, action, reward, obs1,
+                          context1, done, is_final_step, evaluate=False):
+        """Store a batch of transitions in the replay buffer.
+
+        This is used to store the transitions of multiple environments that
+        are stepped in parallel. The arguments are the same as for
+        `store_transition`, with an additional leading dimension of the number
+        of transitions.
+
+        Parameters
+        ----------
+        obs0 : array_like
+            the last observations
+        context0 : array_like or None
+            the last contextual terms. Set to None if no context is provided by
+            the environment.
+        action : array_like
+            the actions
+        reward : array_like
+            the rewards
+        obs1 : array_like
+            the current observations
+        context1 : array_like or None
+            the current contextual terms. Set to None if no context is provided
+            by the environment.
+        done : array_like
+            the done masks
+        is_final_step : array_like
+            whether the time horizon was met in the steps corresponding to
+            every sample
+        evaluate : bool
+            whether the samples are being provided by the evaluation
+            environment. If so, the data is not stored in the replay buffer.
+        """
+        raise NotImplementedError
+
     def get_td_map(self):
         """Return dict map for the summary (to be run in the algorithm)."""
         raise NotImplementedError
 
+    def _setup_prefetcher(self, **kwargs):
+        """Create the object that prefetches minibatches, if needed.
+
+        This should be called once the replay buffer has been created.
+
+        Parameters
+        ----------
+        kwargs : dict
+            additional arguments that are passed to the `sample` method of the
+            replay buffer
+        """
+        if self.prefetch_batches > 0:
+            self.prefetcher = ReplayPrefetcher(
+                self.replay_buffer, self.prefetch_batches, **kwargs)
+
+    def _sample_batch(self, **kwargs):
+        """Return a minibatch from the replay buffer.
+
+        If minibatches are prefetched, the next prefetched minibatch is
+        returned instead, and the kwargs are ignored (see
+        `_setup_prefetcher`). Otherwise, the replay buffer is sampled while
+        holding its lock, as samples may be added by another thread.
+        """
+        if self.prefetcher is not None:
+            return self.prefetcher.get()
+
+        with self.replay_buffer.lock:
+            return self.replay_buffer.sample(**kwargs)
+
     @staticmethod
     def _get_obs(obs, context, axis=0):
         """Return the processed observation.
@@ -279,6 +591,33 @@ class ActorCriticPolicy(object):
             ob_dim = tuple(map(sum, zip(ob_dim, co_space.shape)))
         return ob_dim
 
+    @staticmethod
+    def _get_ob_bounds(ob_space, co_space):
+        """Return the bounds of the processed observation.
+
+        If the context space is not None, its bounds are concatenated to the
+        bounds of the observation space, in the same manner as `_get_obs`.
+
+        Parameters
+        ----------
+        ob_space : gym.spaces.*
+            the observation space of the environment
+        co_space : gym.spaces.*
+            the context space of the environment
+
+        Returns
+        -------
+        np.ndarray
+            the lower bound of every element of the processed observation
+        np.ndarray
+            the upper bound of every element of the processed observation
+        """
+        low, high = ob_space.low.flatten(), ob_space.high.flatten()
+        if co_space is not None:
+            low = np.concatenate((low, co_space.low.flatten()))
+            high = np.concatenate((high, co_space.high.flatten()))
+        return low, high
+
     @staticmethod
     def _layer(val,
                num_outputs,
@@ -1,11 +1,64 @@
 """Script containing the ReplayBuffer object."""
+import os
+import threading
 import numpy as np
 
+from hbaselines.utils.segment_tree import SumSegmentTree, MinSegmentTree
+from hbaselines.utils.storage import ArrayAllocator, ObservationEncoder
+from hbaselines.utils.storage import save_snapshot, load_snapshot
+
 
 class ReplayBuffer(object):
-    """Experience replay buffer."""
+    """Experience replay buffer.
+
+    If `prioritized` is set to True, samples are drawn with probabilities
+    proportional to their priorities, as presented in [1]. The priorities are
+    stored in array-based sum and min segment trees, resulting in O(log N)
+    updates and sampling.
+
+    [1] Schaul, Tom, et al. "Prioritized experience replay." arXiv preprint
+        arXiv:1511.05952 (2015).
+
+    The arrays of the buffer may either be stored in memory, or in files on
+    disk via np.memmap (see hbaselines/utils/storage.py). The latter allows
+    for buffers whose capacity exceeds the available memory.
+
+    The content of the buffer can be saved to and restored from disk via the
+    `save` and `load` methods. Snapshots after the first may be incremental,
+    in which case only the elements added since the previous snapshot are
+    written.
 
-    def __init__(self, buffer_size, batch_size, obs_dim, ac_dim):
+    If `deduplicate_obs` is set to True, every observation is stored once in a
+    single array `obs`, instead of once in `obs_t` and once in `obs_tp1`. The
+    transition stored at slot i then consists of obs[i] and obs[i + 1]. When a
+    new episode begins, the final observation of the previous episode keeps
+    its own slot, which is marked as invalid in the `valid` mask and is never
+    sampled. This roughly halves the memory used by the observations, at the
+    cost of one slot per episode.
+
+    Observations may also be stored in a compact encoding (float16, or affine
+    uint8/uint16 quantization, see hbaselines/utils/storage.py), and are then
+    decoded back to float32 when sampled.
+
+    The `lock` attribute of the buffer is used to guard the buffer when it is
+    sampled from a background thread (see hbaselines/utils/prefetch.py).
+    """
+
+    def __init__(self,
+                 buffer_size,
+                 batch_size,
+                 obs_dim,
+                 ac_dim,
+                 prioritized=False,
+                 alpha=0.6,
+                 beta=0.4,
+                 eps=1e-6,
+                 storage="memory",
+                 buffer_dir=None,
+                 deduplicate_obs=False,
+                 obs_encoding="float32",
+                 obs_low=None,
+                 obs_high=None):
         """Instantiate a ring buffer (FIFO).
 
         Parameters
@@ -19,18 +72,86 @@ class ReplayBuffer(object):
             number of elements in the observations
         ac_dim : int
             number of elements in the actions
+        prioritized : bool
+            whether to sample elements in proportion to their priorities. If
+            set to True, the `sample` method additionally returns the
+            importance weights and the indices of the sampled elements.
+        alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization). Only used if `prioritized` is set to True.
+        beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction). Only used if `prioritized` is set to True.
+        eps : float
+            small positive term added to the priorities to ensure that every
+            element can be sampled. Only used if `prioritized` is set to True.
+        storage : str
+            the storage backend of the buffer, one of "memory", "memmap", or
+            "shared"
+        buffer_dir : str or None
+            the directory memory-mapped files are stored in. Not used if
+            `storage` is set to "memory".
+        deduplicate_obs : bool
+            whether to store every observation once, and recover the next
+            observations from the following slots of the buffer. In this case,
+            `buffer_size` is the number of slots, which includes one slot per
+            episode for its final observation.
+        obs_encoding : str
+            the encoding the observations are stored in, one of "float32",
+            "float16", "uint8", or "uint16"
+        obs_low : array_like or None
+            the lower bound of every element in the observations. Used to
+            calibrate the "uint8" and "uint16" encodings. Elements without
+            finite bounds are calibrated from the observations instead.
+        obs_high : array_like or None
+            the upper bound of every element in the observations. Used to
+            calibrate the "uint8" and "uint16" encodings. Elements without
+            finite bounds are calibrated from the observations instead.
         """
         self._maxsize = buffer_size
         self._size = 0
         self._current_idx = 0
         self._next_idx = 0
         self._batch_size = batch_size
+        self._num_added = 0
+        self._snapshot = None
+        self.lock = threading.RLock()
+        self._prioritized = prioritized
+        self._alpha = alpha
+        self._beta = beta
+        self._eps = eps
+        self._deduplicate_obs = deduplicate_obs
+
+        self._allocator = self._create_allocator(storage, buffer_dir)
+        self._obs_encoders = {"obs": ObservationEncoder(
+            obs_encoding, obs_dim, obs_low, obs_high)}
+        obs_dtype = self._obs_encoders["obs"].dtype
 
-        self.obs_t = np.zeros((buffer_size, obs_dim), dtype=np.float32)
-        self.action_t = np.zeros((buffer_size, ac_dim), dtype=np.float32)
-        self.reward = np.zeros(buffer_size, dtype=np.float32)
-        self.obs_tp1 = np.zeros((buffer_size, obs_dim), dtype=np.float32)
-        self.done = np.zeros(buffer_size, dtype=np.float32)
+        if deduplicate_obs:
+            self._obs_names = ["obs"]
+            self.obs = self._allocator.zeros(
+                "obs", (buffer_size, obs_dim), dtype=obs_dtype)
+            self.valid = self._allocator.zeros(
+                "valid", (buffer_size,), dtype=bool)
+        else:
+            self._obs_names = ["obs_t", "obs_tp1"]
+            self.obs_t = self._allocator.zeros(
+                "obs_t", (buffer_size, obs_dim), dtype=obs_dtype)
+            self.obs_tp1 = self._allocator.zeros(
+                "obs_tp1", (buffer_size, obs_dim), dtype=obs_dtype)
+        self.action_t = self._allocator.zeros(
+            "action_t", (buffer_size, ac_dim))
+        self.reward = self._allocator.zeros("reward", (buffer_size,))
+        self.done = self._allocator.zeros("done", (buffer_size,))
+
+        if prioritized:
+            self._it_sum = SumSegmentTree(buffer_size)
+            self._it_min = MinSegmentTree(buffer_size)
+            self._max_priority = 1.0
+
+    def _create_allocator(self, storage, buffer_dir):
+        """Return the allocator that creates the arrays of the buffer."""
+        return ArrayAllocator(storage, buffer_dir)
 
     def __len__(self):
         """Return the number of elements stored."""
@@ -41,6 +162,11 @@ class ReplayBuffer(object):
         """Return the (float) max capacity of the buffer."""
         return self._maxsize
 
+    @property
+    def prioritized(self):
+        """Return whether the buffer performs prioritized sampling."""
+        return self._prioritized
+
     def can_sample(self):
         """Check if n_samples samples can be sampled from the buffer.
 
@@ -54,6 +180,10 @@ class ReplayBuffer(object):
     def is_full(self):
         """Check whether the replay buffer is full or not.
 
+        Note that, if observations are deduplicated, the buffer is never full,
+        as at least one slot holds only the next observation of the most
+        recent transition.
+
         Returns
         -------
         bool
@@ -77,25 +207,261 @@ class ReplayBuffer(object):
         done : float
             is the episode done
         """
-        self.obs_t[self._next_idx, :] = obs_t
-        self.action_t[self._next_idx, :] = action
-        self.reward[self._next_idx] = reward
-        self.obs_tp1[self._next_idx, :] = obs_tp1
-        self.done[self._next_idx] = done
+        idx = self._next_idx
+        obs_t, obs_tp1 = self._encode_obs(
+            "obs", self._obs_names, obs_t, obs_tp1)
+
+        if self._deduplicate_obs:
+            # The next slot already holds the next observation of the previous
+            # transition. If this does not match the current observation, a
+            # new episode has begun, and the slot is kept (as invalid) to store
+            # the final observation of the previous episode.
+            if self._num_added > 0 and \
+                    not np.array_equal(self.obs[idx], obs_t):
+                idx = (idx + 1) % self._maxsize
+                self._num_added += 1
+
+            next_idx = (idx + 1) % self._maxsize
+            self.obs[idx, :] = obs_t
+            self.obs[next_idx, :] = obs_tp1
+            self._set_valid(next_idx, False)
+            self._set_valid(idx, True)
+        else:
+            self.obs_t[idx, :] = obs_t
+            self.obs_tp1[idx, :] = obs_tp1
+            self._size = min(self._size + 1, self._maxsize)
+
+        self.action_t[idx, :] = action
+        self.reward[idx] = reward
+        self.done[idx] = done
+        self._init_priority(idx)
 
         # Increment the next index and size terms
-        self._current_idx = self._next_idx
-        self._next_idx = (self._next_idx + 1) % self._maxsize
-        self._size = min(self._size + 1, self._maxsize)
+        self._current_idx = idx
+        self._next_idx = (idx + 1) % self._maxsize
+        self._num_added += 1
+
+    def add_batch(self, obs_t, action, reward, obs_tp1, done):
+        """Add a batch of transitions to the buffer.
+
+        The transitions are stored in order, as if they were added one at a
+        time via the `add` method.
+
+        Parameters
+        ----------
+        obs_t : array_like
+            (n, obs_dim) matrix of the last observations
+        action : array_like
+            (n, ac_dim) matrix of the actions
+        reward : array_like
+            (n,) vector of the rewards of the transitions
+        obs_tp1 : array_like
+            (n, obs_dim) matrix of the current observations
+        done : array_like
+            (n,) vector of the done masks
+        """
+        # Deduplicated buffers need to check whether every transition starts
+        # a new episode, so the transitions are added individually.
+        if self._deduplicate_obs:
+            for i in range(len(reward)):
+                self.add(obs_t[i], action[i], reward[i], obs_tp1[i], done[i])
+            return
+
+        n = len(reward)
+        idxes = (self._next_idx + np.arange(n)) % self._maxsize
+        obs_t, obs_tp1 = self._encode_obs(
+            "obs", self._obs_names, obs_t, obs_tp1)
+
+        self.obs_t[idxes, :] = obs_t
+        self.obs_tp1[idxes, :] = obs_tp1
+        self.action_t[idxes, :] = action
+        self.reward[idxes] = reward
+        self.done[idxes] = done
+        self._init_priority(idxes)
+
+        self._size = min(self._size + n, self._maxsize)
+        self._current_idx = int(idxes[-1])
+        self._next_idx = int(idxes[-1] + 1) % self._maxsize
+        self._num_added += n
+
+    def _encode_obs(self, key, names, *obs):
+        """Return the encoded forms of new observations.
+
+        If the range of the encoding needs to be expanded to fit these
+        observations, all stored observations are re-encoded as well.
+
+        Parameters
+        ----------
+        key : str
+            the name of the encoder to use
+        names : list of str
+            the names of the arrays that store observations with this encoder
+        obs : array_like
+            the observations to encode
+
+        Returns
+        -------
+        list of np.ndarray
+            the encoded observations
+        """
+        encoder = self._obs_encoders[key]
+        offset = encoder.offset
+        scale = encoder.scale
+
+        if any([encoder.update(ob) for ob in obs]):
+            num_slots = min(self._num_added + 1, self._maxsize)
+            for name in names:
+                encoder.requantize(
+                    getattr(self, name)[:num_slots], offset, scale)
+
+            # Every stored observation was modified, so the next snapshot
+            # cannot be incremental.
+            self._snapshot = None
+
+        return [encoder.encode(ob) for ob in obs]
+
+    def _set_valid(self, idx, valid):
+        """Mark whether a slot holds a transition, for deduplicated buffers.
+
+        The size of the buffer is updated accordingly, and slots that do not
+        hold transitions are given zero priority.
+        """
+        if self.valid[idx] != valid:
+            self._size += 1 if valid else -1
+            self.valid[idx] = valid
+
+        if not valid and self._prioritized:
+            self._it_sum[idx] = 0.
+            self._it_min[idx] = float('inf')
 
     def _encode_sample(self, idxes, **kwargs):
         """Convert the indices to appropriate samples."""
-        return self.obs_t[idxes, :], self.action_t[idxes, :], \
-            self.reward[idxes], self.obs_tp1[idxes, :], self.done[idxes]
+        if kwargs.get("n_step") is not None:
+            return self._encode_n_step_sample(
+                idxes, kwargs["n_step"], kwargs["gamma"])
+
+        if self._deduplicate_obs:
+            obs_t = self.obs[idxes, :]
+            obs_tp1 = self.obs[(idxes + 1) % self._maxsize, :]
+        else:
+            obs_t = self.obs_t[idxes, :]
+            obs_tp1 = self.obs_tp1[idxes, :]
+
+        # Recover the float32 observations from their stored encoding.
+        obs_t = self._obs_encoders["obs"].decode(obs_t)
+        obs_tp1 = self._obs_encoders["obs"].decode(obs_tp1)
+
+        return obs_t, self.action_t[idxes, :], self.reward[idxes], obs_tp1, \
+            self.done[idxes]
+
+    def _encode_n_step_sample(self, idxes, n_step, gamma):
+        """Convert the indices to n-step samples.
+
+        Every sample consists of up to `n_step` consecutive transitions,
+        starting from the transition at the sampled index. The sequence is cut
+        short at the end of an episode, and at the most recent transition of
+        the buffer.
+
+        Parameters
+        ----------
+        idxes : np.ndarray
+            the indices of the first transition of every sample
+        n_step : int
+            the maximum number of transitions in every sample
+        gamma : float
+            the discount factor
+
+        Returns
+        -------
+        np.ndarray
+            batch of observations
+        numpy float
+            batch of actions executed given obs_batch
+        numpy float
+            discounted sum of the rewards of the transitions in every sample
+        np.ndarray
+            the next observations of the final transition in every sample
+        numpy bool
+            done_mask[i] = 1 if the final transition in sample i resulted in
+            the end of an episode and 0 otherwise.
+        np.ndarray
+            the discount term that the value of the next observations should
+            be multiplied by, i.e. gamma ** k for samples of k transitions
+        """
+        idxes = np.asarray(idxes)
+        steps = np.arange(n_step)
+        pos = (idxes[:, None] + steps) % self._maxsize
+
+        # Transitions after the most recent transition are not available. The
+        # indices are taken modulo the buffer size to account for wraparound.
+        available = steps <= ((self._current_idx - idxes) % self._maxsize)[
+            :, None]
+
+        # Check whether every transition continues from the previous one.
+        if self._deduplicate_obs:
+            continues = self.valid[pos[:, 1:]]
+        else:
+            continues = np.all(
+                self.obs_tp1[pos[:, :-1]] == self.obs_t[pos[:, 1:]], axis=-1)
+        done = self.done[pos]
+        continues &= done[:, :-1] == 0
+
+        # A transition is included if it and all previous transitions are
+        # available and continue from the previous one.
+        available[:, 1:] &= continues
+        included = np.cumprod(available, axis=1, dtype=bool)
+        num_steps = included.sum(axis=1)
+        last = pos[np.arange(len(idxes)), num_steps - 1]
+
+        rewards = np.sum(self.reward[pos] * included * gamma ** steps, axis=1)
+
+        if self._deduplicate_obs:
+            obs_t = self.obs[idxes, :]
+            obs_tpn = self.obs[(last + 1) % self._maxsize, :]
+        else:
+            obs_t = self.obs_t[idxes, :]
+            obs_tpn = self.obs_tp1[last, :]
+
+        # Recover the float32 observations from their stored encoding.
+        obs_t = self._obs_encoders["obs"].decode(obs_t)
+        obs_tpn = self._obs_encoders["obs"].decode(obs_tpn)
+
+        return obs_t, self.action_t[idxes, :], rewards.astype(np.float32), \
+            obs_tpn, self.done[last], \
+            (gamma ** num_steps).astype(np.float32)
+
+    def _num_slots(self):
+        """Return the number of slots that have been written to."""
+        if self._deduplicate_obs:
+            return min(self._num_added, self._maxsize)
+        return self._size
+
+    def _sample_uniform(self, batch_size):
+        """Sample indices of stored transitions uniformly at random."""
+        if not self._deduplicate_obs:
+            return np.random.randint(0, self._size, size=batch_size)
+
+        # Only slots that have been written to are considered. Slots that do
+        # not hold a transition are resampled until all indices are valid.
+        high = self._num_slots()
+        indices = np.random.randint(0, high, size=batch_size)
+        invalid = np.flatnonzero(~self.valid[indices])
+        while len(invalid) > 0:
+            indices[invalid] = np.random.randint(0, high, size=len(invalid))
+            invalid = invalid[~self.valid[indices[invalid]]]
+
+        return indices
 
     def sample(self, **kwargs):
         """Sample a batch of experiences.
 
+        If the `n_step` and `gamma` keyword arguments are specified, every
+        sample consists of up to `n_step` consecutive transitions of the same
+        episode (see `_encode_n_step_sample`). The rewards are then the
+        discounted sums of the rewards of these transitions, the next
+        observations are those of the final transition, and the discount term
+        of every sample is returned after the done masks.
+
         Returns
         -------
         np.ndarray
@@ -109,6 +475,264 @@ class ReplayBuffer(object):
         numpy bool
             done_mask[i] = 1 if executing act_batch[i] resulted in the end of
             an episode and 0 otherwise.
+        np.ndarray
+            (batch_size,) vector of the discount terms of the next
+            observations. Only returned if `n_step` is specified.
+        np.ndarray
+            (batch_size,) vector of importance weights of the sampled elements.
+            Only returned if the buffer is prioritized.
+        np.ndarray
+            (batch_size,) vector of indices of the sampled elements. Used to
+            update the priorities of the elements. Only returned if the buffer
+            is prioritized.
+        """
+        if not self._prioritized:
+            indices = self._sample_uniform(self._batch_size)
+            return self._encode_sample(indices, **kwargs)
+
+        indices = self._sample_proportional(self._batch_size)
+        weights = self._importance_weights(
+            indices, kwargs.get("beta", self._beta))
+
+        return tuple(self._encode_sample(indices, **kwargs)) + \
+            (weights, indices)
+
+    def sample_many(self, n, **kwargs):
+        """Sample multiple batches of experiences at once.
+
+        The indices of all batches are drawn together, and the samples are
+        collected via a single (vectorized) gather.
+
+        Note that, if the buffer is prioritized, all batches are drawn from the
+        current priorities. Any priorities that are updated between the use of
+        these batches are not reflected in the later batches.
+
+        Parameters
+        ----------
+        n : int
+            the number of batches
+
+        Returns
+        -------
+        tuple of np.ndarray
+            the same terms as returned by `sample`, but with an additional
+            leading dimension of size `n`, e.g. the observations are of shape
+            (n, batch_size, obs_dim)
         """
-        indices = np.random.randint(0, self._size, size=self._batch_size)
-        return self._encode_sample(indices, **kwargs)
+        if not self._prioritized:
+            indices = self._sample_uniform(n * self._batch_size)
+            samples = self._encode_sample(indices, **kwargs)
+        else:
+            indices = self._sample_proportional(self._batch_size, n)
+            weights = self._importance_weights(
+                indices, kwargs.get("beta", self._beta))
+            samples = tuple(self._encode_sample(indices, **kwargs)) + \
+                (weights, indices)
+
+        return tuple(self._split_batches(val, n) for val in samples)
+
+    @staticmethod
+    def _split_batches(val, n):
+        """Split the leading dimension of samples into n batches.
+
+        Dictionaries (e.g. additional information) are split element-wise, and
+        None values are returned as is.
+        """
+        if val is None:
+            return None
+        elif isinstance(val, dict):
+            return {key: val[key].reshape((n, -1) + val[key].shape[1:])
+                    for key in val.keys()}
+        else:
+            return val.reshape((n, -1) + val.shape[1:])
+
+    def update_priorities(self, idxes, priorities):
+        """Update the priorities of sampled elements.
+
+        The priority of every element is set to |priorities[i]| + eps, where
+        eps is the small positive term specified when creating the buffer.
+
+        Parameters
+        ----------
+        idxes : array_like
+            (batch_size,) vector of indices of the sampled elements, as
+            returned by the `sample` method
+        priorities : array_like
+            (batch_size,) vector of new priorities, e.g. the TD errors of the
+            sampled elements
+        """
+        assert self._prioritized, "The replay buffer is not prioritized."
+
+        idxes = np.asarray(idxes)
+        priorities = np.abs(np.asarray(priorities).flatten()) + self._eps
+        assert idxes.shape == priorities.shape
+
+        self._it_sum[idxes] = priorities ** self._alpha
+        self._it_min[idxes] = priorities ** self._alpha
+        self._max_priority = max(self._max_priority, np.max(priorities))
+
+    def save(self, path, incremental=False):
+        """Save a snapshot of the replay buffer.
+
+        Parameters
+        ----------
+        path : str
+            the directory to store the snapshot in
+        incremental : bool
+            whether to only store the elements that were added since the last
+            snapshot was saved (or loaded). If no such snapshot exists, or all
+            elements in the buffer have since been replaced, a full snapshot
+            is stored instead. Incremental snapshots reference the previous
+            snapshot, which must remain available when loading them.
+        """
+        arrays = {name: getattr(self, name) for name in self._allocator.names}
+        info = {
+            "next_idx": self._next_idx,
+            "size": self._size,
+            "num_added": self._num_added,
+            "parent": None,
+        }
+
+        # Collect the indices of the elements that were added since the last
+        # snapshot, starting from the index the next element was stored in.
+        rows = None
+        if incremental and self._snapshot is not None:
+            last_path, last_num_added, last_next_idx = self._snapshot
+            num_new = self._num_added - last_num_added
+            if self._deduplicate_obs:
+                # The slot holding the most recent next observation.
+                num_new += 1
+            if num_new < self._maxsize:
+                rows = (last_next_idx + np.arange(num_new)) % self._maxsize
+                info["parent"] = os.path.relpath(
+                    os.path.abspath(last_path),
+                    os.path.dirname(os.path.abspath(path)))
+
+        # The priorities may change for any element, and are always stored in
+        # full. Only the priorities of the occupied slots are collected.
+        if self._prioritized:
+            info["max_priority"] = self._max_priority
+            priorities = self._it_sum[np.arange(self._num_slots())]
+        else:
+            priorities = None
+
+        save_snapshot(path, arrays, info, rows=rows)
+        if priorities is not None:
+            np.save(os.path.join(path, "_priorities.npy"), priorities)
+        for key, encoder in self._obs_encoders.items():
+            if encoder.quantized:
+                np.save(os.path.join(path, "_bounds_{}.npy".format(key)),
+                        np.stack([encoder.low, encoder.high]))
+
+        self._snapshot = (path, self._num_added, self._next_idx)
+
+    def load(self, path):
+        """Restore the replay buffer from a snapshot.
+
+        For the "memory" storage backend, the arrays are memory-mapped from
+        the snapshot (in copy-on-write mode) instead of being copied, so
+        restoring large buffers is nearly instantaneous. For the other
+        backends, the snapshot is copied into the arrays of the buffer, so
+        that later writes still go to the files backing the buffer.
+
+        Parameters
+        ----------
+        path : str
+            the directory the snapshot is stored in
+
+        Raises
+        ------
+        ValueError
+            if the arrays stored in the snapshot do not match the buffer
+        """
+        arrays, info, rows = load_snapshot(path)
+
+        # Restore the snapshots that the current snapshot was computed from.
+        if info["parent"] is not None:
+            self.load(os.path.join(os.path.dirname(path), info["parent"]))
+
+        for name in self._allocator.names:
+            if name not in arrays:
+                raise ValueError("{} missing from the snapshot.".format(name))
+
+            current = getattr(self, name)
+            if arrays[name].shape[1:] != current.shape[1:] or \
+                    (rows is None and arrays[name].shape != current.shape) or \
+                    arrays[name].dtype != current.dtype:
+                raise ValueError(
+                    "Mismatch for {}: expected {} {}, got {} {}.".format(
+                        name, current.dtype, current.shape,
+                        arrays[name].dtype, arrays[name].shape))
+
+            if rows is None and self._allocator.storage == "memory":
+                setattr(self, name, arrays[name])
+            elif rows is None:
+                current[:] = arrays[name]
+            else:
+                current[rows] = arrays[name]
+
+        self._next_idx = info["next_idx"]
+        self._current_idx = (self._next_idx - 1) % self._maxsize
+        self._size = info["size"]
+        self._num_added = info["num_added"]
+
+        for key, encoder in self._obs_encoders.items():
+            bounds_path = os.path.join(path, "_bounds_{}.npy".format(key))
+            if encoder.quantized and os.path.exists(bounds_path):
+                encoder.set_bounds(*np.load(bounds_path))
+
+        if self._prioritized:
+            # If the snapshot was taken from a buffer without priorities, all
+            # elements are assigned the same priority.
+            priorities_path = os.path.join(path, "_priorities.npy")
+            if os.path.exists(priorities_path):
+                priorities = np.load(priorities_path)
+                self._max_priority = info["max_priority"]
+            else:
+                priorities = np.ones(self._num_slots())
+                if self._deduplicate_obs:
+                    priorities *= self.valid[:len(priorities)]
+                self._max_priority = 1.0
+
+            # Slots without a transition are excluded from the min tree.
+            self._it_sum = SumSegmentTree(self._maxsize)
+            self._it_min = MinSegmentTree(self._maxsize)
+            if len(priorities) > 0:
+                idxes = np.arange(len(priorities))
+                self._it_sum[idxes] = priorities
+                self._it_min[idxes] = np.where(
+                    priorities > 0, priorities, float('inf'))
+
+        self._snapshot = (path, self._num_added, self._next_idx)
+
+    def _init_priority(self, idx):
+        """Assign the max priority to a new element, if needed."""
+        if self._prioritized:
+            self._it_sum[idx] = self._max_priority ** self._alpha
+            self._it_min[idx] = self._max_priority ** self._alpha
+
+    def _sample_proportional(self, batch_size, num_batches=1):
+        """Sample indices in proportion to their priorities.
+
+        For every batch, the total priority mass is split into `batch_size`
+        equal segments, and one index is sampled from each segment (stratified
+        sampling). The indices of all batches are concatenated.
+        """
+        total = self._it_sum.reduce()
+        mass = (np.tile(np.arange(batch_size), num_batches)
+                + np.random.random_sample(batch_size * num_batches)) \
+            * (total / batch_size)
+        indices = self._it_sum.find_prefixsum_idx(mass)
+
+        # Protect against floating-point errors at the right edge of the tree.
+        return np.minimum(indices, self._num_slots() - 1)
+
+    def _importance_weights(self, idxes, beta):
+        """Compute the normalized importance weights of sampled elements."""
+        total = self._it_sum.reduce()
+        p_min = self._it_min.reduce() / total
+        max_weight = (p_min * self._size) ** (-beta)
+        p_sample = self._it_sum[idxes] / total
+
+        return ((p_sample * self._size) ** (-beta) / max_weight).astype(
+            np.float32)
@@ -0,0 +1,305 @@
+"""Script containing the SharedReplayBuffer object."""
+import json
+import os
+
+import numpy as np
+
+from hbaselines.fcnet.replay_buffer import ReplayBuffer
+from hbaselines.utils.storage import ArrayAllocator
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    """Experience replay buffer shared by multiple processes.
+
+    The arrays of the buffer are stored in shared memory (see the "shared"
+    storage backend in hbaselines/utils/storage.py), and may be mapped by
+    other processes via the `attach` method. Transitions added by any process
+    are then visible to all processes without being copied or pickled, so
+    that the environments may be stepped in (one or more) actor processes
+    while the policy is trained in a separate learner process.
+
+    The buffer is split into `num_shards` equally sized ring buffers (shards).
+    Every shard is written to by a single process, which is assigned the shard
+    when attaching to the buffer. The number of transitions added to every
+    shard is stored in the shared `shard_counts` array, and is only
+    incremented once a transition has been fully written. Batches of
+    transitions are published one transition at a time, so that at most one
+    slot per shard is being written to at any time. Transitions can
+    therefore be added and sampled without any locks. In order to never
+    sample the slot that is currently being written to, one slot per shard is
+    excluded from sampling. Note, however, that samples may still contain
+    transitions that are overwritten while they are being gathered if the
+    actors add more than `buffer_size / num_shards - 1` transitions to a shard
+    in the meantime.
+
+    Prioritized sampling, deduplicated observations, quantized observation
+    encodings and n-step returns are not supported, as these require state
+    that is local to the process modifying the buffer.
+
+    Attributes
+    ----------
+    path : str
+        the directory the shared arrays are stored in. Used to attach to the
+        buffer from other processes.
+    num_shards : int
+        the number of shards
+    shard : int or None
+        the shard that the `add` method writes to
+    shard_counts : np.ndarray
+        the number of transitions that have been added to every shard
+    """
+
+    def __init__(self,
+                 buffer_size,
+                 batch_size,
+                 obs_dim,
+                 ac_dim,
+                 num_shards=1,
+                 obs_encoding="float32",
+                 buffer_dir=None,
+                 path=None,
+                 shard=None):
+        """Instantiate the shared buffer.
+
+        Parameters
+        ----------
+        buffer_size : int
+            Max number of transitions to store in the buffer. This is rounded
+            down to a multiple of `num_shards`.
+        batch_size : int
+            number of elements that are to be returned as a batch
+        obs_dim : int
+            number of elements in the observations
+        ac_dim : int
+            number of elements in the actions
+        num_shards : int
+            the number of shards, i.e. the maximum number of processes that
+            may add transitions to the buffer
+        obs_encoding : str
+            the encoding the observations are stored in, one of "float32" or
+            "float16"
+        buffer_dir : str or None
+            the directory the shared arrays are created in. If set to None,
+            the shared memory filesystem of the system is used.
+        path : str or None
+            the directory of an existing buffer to attach to (see `attach`).
+            If set to None, a new buffer is created.
+        shard : int or None
+            the shard that the `add` method writes to. If set to None,
+            transitions cannot be added from this instance.
+
+        Raises
+        ------
+        ValueError
+            if the buffer is too small for the number of shards, if `shard` is
+            not a valid shard, or if `obs_encoding` is a quantized encoding
+        """
+        shard_size = buffer_size // num_shards
+        if shard_size < 2:
+            raise ValueError("buffer_size must be at least twice num_shards, "
+                             "got {} and {}.".format(buffer_size, num_shards))
+        if shard is not None and not 0 <= shard < num_shards:
+            raise ValueError("shard must be in [0, {}), not {}.".format(
+                num_shards, shard))
+        if obs_encoding not in ["float32", "float16"]:
+            raise ValueError("Quantized observation encodings are not "
+                             "supported by shared buffers.")
+
+        self._attach_path = path
+        self._shard_size = shard_size
+        self.num_shards = num_shards
+        self.shard = shard
+
+        super(SharedReplayBuffer, self).__init__(
+            buffer_size=shard_size * num_shards,
+            batch_size=batch_size,
+            obs_dim=obs_dim,
+            ac_dim=ac_dim,
+            storage="shared",
+            buffer_dir=buffer_dir,
+            obs_encoding=obs_encoding,
+        )
+
+        self.shard_counts = self._allocator.zeros(
+            "shard_counts", (num_shards,), dtype=np.int64)
+        self.path = self._allocator.path
+
+        # Store the arguments needed by other processes to attach to the
+        # buffer.
+        if path is None:
+            with open(os.path.join(self.path, "info.json"), "w") as f:
+                json.dump({
+                    "buffer_size": buffer_size,
+                    "batch_size": batch_size,
+                    "obs_dim": obs_dim,
+                    "ac_dim": ac_dim,
+                    "num_shards": num_shards,
+                    "obs_encoding": obs_encoding,
+                }, f)
+
+    @classmethod
+    def attach(cls, path, shard=None):
+        """Map an existing shared buffer into the current process.
+
+        The shared arrays are only deleted once the buffer that created them
+        is garbage collected, which should therefore outlive all buffers that
+        attach to it.
+
+        Parameters
+        ----------
+        path : str
+            the `path` attribute of the buffer to attach to
+        shard : int or None
+            the shard that the `add` method writes to. If set to None,
+            transitions cannot be added from the returned buffer.
+
+        Returns
+        -------
+        hbaselines.fcnet.shared_replay_buffer.SharedReplayBuffer
+            the attached buffer
+        """
+        with open(os.path.join(path, "info.json")) as f:
+            kwargs = json.load(f)
+
+        return cls(path=path, shard=shard, **kwargs)
+
+    def _create_allocator(self, storage, buffer_dir):
+        """See parent class."""
+        if self._attach_path is not None:
+            return ArrayAllocator.attach(self._attach_path, storage)
+        return ArrayAllocator(storage, buffer_dir)
+
+    def __len__(self):
+        """Return the number of elements that can be sampled."""
+        return int(np.sum(self._num_valid(self.shard_counts)))
+
+    def _num_valid(self, counts):
+        """Return the number of elements that can be sampled per shard."""
+        return np.minimum(counts, self._shard_size - 1)
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        """Add a new transition to the shard of this instance.
+
+        See the parent class for a description of the arguments.
+
+        Raises
+        ------
+        ValueError
+            if no shard is assigned to this instance
+        """
+        self.add_batch([obs_t], [action], [reward], [obs_tp1], [done])
+
+    def add_batch(self, obs_t, action, reward, obs_tp1, done):
+        """Add a batch of transitions to the shard of this instance.
+
+        The transitions are written and published one at a time, since only
+        the slot following the most recent transition of every shard is
+        excluded from sampling. See the parent class for a description of the
+        arguments.
+
+        Raises
+        ------
+        ValueError
+            if no shard is assigned to this instance
+        """
+        if self.shard is None:
+            raise ValueError("A shard must be assigned to add transitions.")
+
+        n = len(reward)
+        count = int(self.shard_counts[self.shard])
+        idxes = self.shard * self._shard_size + \
+            (count + np.arange(n)) % self._shard_size
+        obs_t, obs_tp1 = self._encode_obs(
+            "obs", self._obs_names, obs_t, obs_tp1)
+
+        for i, idx in enumerate(idxes):
+            self.obs_t[idx, :] = obs_t[i]
+            self.obs_tp1[idx, :] = obs_tp1[i]
+            self.action_t[idx, :] = action[i]
+            self.reward[idx] = reward[i]
+            self.done[idx] = done[i]
+
+            # Publish the transition once all of its terms have been written.
+            self.shard_counts[self.shard] = count + i + 1
+
+        self._current_idx = int(idxes[-1])
+        self._num_added += n
+
+    def _sample_uniform(self, batch_size):
+        """Sample indices of stored transitions uniformly at random.
+
+        The elements of all shards are enumerated by shard, and from the
+        oldest to the most recent element within every shard.
+
+        Raises
+        ------
+        ValueError
+            if none of the shards holds a transition that can be sampled
+        """
+        counts = np.array(self.shard_counts)
+        num_valid = self._num_valid(counts)
+        cum_valid = np.cumsum(num_valid)
+
+        if cum_valid[-1] == 0:
+            raise ValueError("Cannot sample from an empty buffer.")
+
+        samples = np.random.randint(0, cum_valid[-1], size=batch_size)
+        shards = np.searchsorted(cum_valid, samples, side="right")
+        offsets = samples - (cum_valid[shards] - num_valid[shards])
+        rows = (counts[shards] - num_valid[shards] + offsets) \
+            % self._shard_size
+
+        return shards * self._shard_size + rows
+
+    def sample(self, **kwargs):
+        """See parent class.
+
+        Raises
+        ------
+        ValueError
+            if n-step returns are requested
+        """
+        return super(SharedReplayBuffer, self).sample(
+            **self._check_sample_kwargs(kwargs))
+
+    def sample_many(self, n, **kwargs):
+        """See parent class.
+
+        Raises
+        ------
+        ValueError
+            if n-step returns are requested
+        """
+        return super(SharedReplayBuffer, self).sample_many(
+            n, **self._check_sample_kwargs(kwargs))
+
+    @staticmethod
+    def _check_sample_kwargs(kwargs):
+        """Return the sampling arguments, without the n-step terms.
+
+        Raises
+        ------
+        ValueError
+            if `n_step` is greater than one
+        """
+        if kwargs.get("n_step", 1) > 1:
+            raise ValueError(
+                "n-step returns are not supported by shared buffers.")
+
+        return {key: val for key, val in kwargs.items()
+                if key not in ["n_step", "gamma"]}
+
+    def save(self, path, incremental=False):
+        """Save a snapshot of the replay buffer.
+
+        Snapshots of shared buffers are always stored in full, as elements
+        may be added by other processes.
+
+        Parameters
+        ----------
+        path : str
+            the directory to store the snapshot in
+        incremental : bool
+            not used
+        """
+        super(SharedReplayBuffer, self).save(path, incremental=False)
@@ -74,6 +74,12 @@ class FeedForwardPolicy(ActorCriticPolicy):
         placeholder for the observations
     obs1_ph : tf.compat.v1.placeholder
         placeholder for the next step observations
+    weights_ph : tf.compat.v1.placeholder
+        placeholder for the importance weights of the samples in the batch.
+        Defaults to ones if not fed.
+    discount_ph : tf.compat.v1.placeholder
+        placeholder for the discount term of the value of the next observation
+        of every sample in the batch. Defaults to gamma if not fed.
     actor_tf : tf.Variable
         the output from the actor network
     critic_tf : list of tf.Variable
@@ -95,6 +101,9 @@ class FeedForwardPolicy(ActorCriticPolicy):
         the operation that returns the loss of the critic
     critic_optimizer : tf.Operation
         the operation that updates the trainable parameters of the critic
+    td_error : tf.Variable
+        the per-sample TD error of the first Q-function. Used to update the
+        priorities of the samples when prioritized experience replay is used.
     """
 
     def __init__(self,
@@ -113,12 +122,23 @@ class FeedForwardPolicy(ActorCriticPolicy):
                  layers,
                  act_fun,
                  use_huber,
+                 prioritized_replay,
+                 prioritized_replay_alpha,
+                 prioritized_replay_beta,
+                 prioritized_replay_eps,
+                 storage,
+                 buffer_dir,
+                 deduplicate_obs,
+                 obs_encoding,
+                 prefetch_batches,
+                 n_step,
                  noise,
                  target_policy_noise,
                  target_noise_clip,
                  scope=None,
                  zero_fingerprint=False,
-                 fingerprint_dim=2):
+                 fingerprint_dim=2,
+                 default_action=None):
         """Instantiate the feed-forward neural network policy.
 
         Parameters
@@ -156,6 +176,47 @@ class FeedForwardPolicy(ActorCriticPolicy):
             specifies whether to use the huber distance function as the loss
             for the critic. If set to False, the mean-squared error metric is
             used instead
+        prioritized_replay : bool
+            whether to use prioritized experience replay. See:
+            https://arxiv.org/abs/1511.05952
+        prioritized_replay_alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization)
+        prioritized_replay_beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction)
+        prioritized_replay_eps : float
+            small positive term added to the priorities to ensure that every
+            sample can be drawn
+        storage : str
+            the storage backend of the replay buffer, one of "memory" (in-RAM
+            numpy arrays) or "memmap" (numpy arrays memory-mapped to files in
+            `buffer_dir`)
+        buffer_dir : str or None
+            the directory memory-mapped replay buffer files are stored in. If
+            set to None, the default temporary directory is used. Only used if
+            `storage` is set to "memmap".
+        deduplicate_obs : bool
+            whether to store every observation in the replay buffer once,
+            instead of storing the observations and next observations
+            separately. This roughly halves the memory used by the
+            observations.
+        obs_encoding : str
+            the encoding observations are stored in within the replay buffer,
+            one of "float32", "float16", "uint8", or "uint16". The integer
+            encodings quantize every element of the observation affinely
+            between its bounds in the observation space or, if these are not
+            finite, its running minimum and maximum.
+        prefetch_batches : int
+            the number of minibatches that are sampled in advance by a
+            background thread, overlapping the sampling procedure with the
+            gradient updates. If set to 0, minibatches are sampled when they
+            are needed.
+        n_step : int
+            the number of consecutive transitions used to compute the target
+            values of the critic. If greater than 1, the discounted rewards of
+            up to `n_step` transitions (of the same episode) are summed, and
+            the value of the final next observation is discounted accordingly.
         noise : float
             scaling term to the range of the action space, that is subsequently
             used as the standard deviation of Gaussian noise added to the
@@ -174,6 +235,11 @@ class FeedForwardPolicy(ActorCriticPolicy):
         fingerprint_dim : int
             the number of fingerprint elements in the observation. Used when
             trying to zero the fingerprint elements.
+        default_action : tf.Tensor or None
+            the actions that are used by the update operations if no actions
+            are fed to the action placeholder, e.g. the relabeled goals of the
+            Manager policy when the off-policy corrections are performed
+            within the graph. If set to None, the actions must always be fed.
 
         Raises
         ------
@@ -195,7 +261,17 @@ class FeedForwardPolicy(ActorCriticPolicy):
             layer_norm=layer_norm,
             layers=layers,
             act_fun=act_fun,
-            use_huber=use_huber
+            use_huber=use_huber,
+            prioritized_replay=prioritized_replay,
+            prioritized_replay_alpha=prioritized_replay_alpha,
+            prioritized_replay_beta=prioritized_replay_beta,
+            prioritized_replay_eps=prioritized_replay_eps,
+            storage=storage,
+            buffer_dir=buffer_dir,
+            deduplicate_obs=deduplicate_obs,
+            obs_encoding=obs_encoding,
+            prefetch_batches=prefetch_batches,
+            n_step=n_step,
         )
 
         # action magnitudes
@@ -212,6 +288,7 @@ class FeedForwardPolicy(ActorCriticPolicy):
         # Compute the shape of the input observation space, which may include
         # the contextual term.
         ob_dim = self._get_ob_dim(ob_space, co_space)
+        ob_low, ob_high = self._get_ob_bounds(ob_space, co_space)
 
         # =================================================================== #
         # Step 1: Create a replay buffer object.                              #
@@ -222,8 +299,28 @@ class FeedForwardPolicy(ActorCriticPolicy):
             batch_size=self.batch_size,
             obs_dim=ob_dim[0],
             ac_dim=self.ac_space.shape[0],
+            prioritized=self.prioritized_replay,
+            alpha=self.prioritized_replay_alpha,
+            beta=self.prioritized_replay_beta,
+            eps=self.prioritized_replay_eps,
+            storage=self.storage,
+            buffer_dir=self.buffer_dir,
+            deduplicate_obs=self.deduplicate_obs,
+            obs_encoding=self.obs_encoding,
+            obs_low=ob_low,
+            obs_high=ob_high,
         )
 
+        # Additional arguments to the sampling procedure of the replay buffer.
+        # For n-step samples, the buffer computes the discounted rewards of the
+        # transitions and the discount term of the value of the final
+        # observation.
+        self._sample_kwargs = {"n_step": n_step, "gamma": gamma} \
+            if n_step > 1 else {}
+
+        # Sample minibatches in a background thread, if requested.
+        self._setup_prefetcher(**self._sample_kwargs)
+
         # =================================================================== #
         # Step 2: Create input variables.                                     #
         # =================================================================== #
@@ -237,10 +334,16 @@ class FeedForwardPolicy(ActorCriticPolicy):
                 tf.float32,
                 shape=(None, 1),
                 name='rewards')
-            self.action_ph = tf.compat.v1.placeholder(
-                tf.float32,
-                shape=(None,) + ac_space.shape,
-                name='actions')
+            if default_action is None:
+                self.action_ph = tf.compat.v1.placeholder(
+                    tf.float32,
+                    shape=(None,) + ac_space.shape,
+                    name='actions')
+            else:
+                self.action_ph = tf.compat.v1.placeholder_with_default(
+                    default_action,
+                    shape=(None,) + ac_space.shape,
+                    name='actions')
             self.obs_ph = tf.compat.v1.placeholder(
                 tf.float32,
                 shape=(None,) + ob_dim,
@@ -249,6 +352,14 @@ class FeedForwardPolicy(ActorCriticPolicy):
                 tf.float32,
                 shape=(None,) + ob_dim,
                 name='obs1')
+            self.weights_ph = tf.compat.v1.placeholder_with_default(
+                tf.ones_like(self.rew_ph),
+                shape=(None, 1),
+                name='weights')
+            self.discount_ph = tf.compat.v1.placeholder_with_default(
+                self.gamma * tf.ones_like(self.rew_ph),
+                shape=(None, 1),
+                name='discount')
 
         # logging of rewards to tensorboard
         with tf.compat.v1.variable_scope("input_info", reuse=False):
@@ -358,18 +469,23 @@ class FeedForwardPolicy(ActorCriticPolicy):
         with tf.compat.v1.variable_scope("loss", reuse=False):
             q_obs1 = tf.minimum(critic_target[0], critic_target[1])
             target_q = tf.stop_gradient(
-                self.rew_ph + (1. - self.terminals1) * self.gamma * q_obs1)
+                self.rew_ph +
+                (1. - self.terminals1) * self.discount_ph * q_obs1)
 
             tf.compat.v1.summary.scalar('critic_target',
                                         tf.reduce_mean(target_q))
 
+            # the TD error of the first Q-function, used for prioritization
+            self.td_error = self.critic_tf[0] - target_q
+
         # choose the loss function
         if self.use_huber:
             loss_fn = tf.compat.v1.losses.huber_loss
         else:
             loss_fn = tf.compat.v1.losses.mean_squared_error
 
-        self.critic_loss = [loss_fn(q, target_q) for q in self.critic_tf]
+        self.critic_loss = [loss_fn(q, target_q, weights=self.weights_ph)
+                            for q in self.critic_tf]
 
         self.critic_optimizer = []
 
@@ -519,11 +635,28 @@ class FeedForwardPolicy(ActorCriticPolicy):
         if not self.replay_buffer.can_sample():
             return [0, 0], 0
 
-        # Get a batch
-        obs0, actions, rewards, obs1, terminals1 = self.replay_buffer.sample()
-
-        return self.update_from_batch(obs0, actions, rewards, obs1, terminals1,
-                                      update_actor=update_actor)
+        # Get a batch. The discount terms of the samples are only returned for
+        # n-step samples, and the importance weights and indices of the
+        # samples only if prioritized experience replay is being used.
+        samples = self._sample_batch(**self._sample_kwargs)
+        obs0, actions, rewards, obs1, terminals1 = samples[:5]
+        discount = samples[5] if self.n_step > 1 else None
+        weights, idxes = samples[-2:] if self.prioritized_replay \
+            else (None, None)
+
+        outputs = self.update_from_batch(
+            obs0, actions, rewards, obs1, terminals1,
+            update_actor=update_actor,
+            weights=weights,
+            discount=discount,
+            return_td_error=self.prioritized_replay)
+
+        # Update the priorities of the samples based on their TD error.
+        if self.prioritized_replay:
+            with self.replay_buffer.lock:
+                self.replay_buffer.update_priorities(idxes, outputs[2])
+
+        return outputs[:2]
 
     def update_from_batch(self,
                           obs0,
@@ -531,7 +664,10 @@ class FeedForwardPolicy(ActorCriticPolicy):
                           rewards,
                           obs1,
                           terminals1,
-                          update_actor=True):
+                          update_actor=True,
+                          weights=None,
+                          discount=None,
+                          return_td_error=False):
         """Perform gradient update step given a batch of data.
 
         Parameters
@@ -551,6 +687,17 @@ class FeedForwardPolicy(ActorCriticPolicy):
             specified whether to perform gradient update procedures to the
             actor policy. Default set to True. Note that the update procedure
             for the critic is always performed when calling this method.
+        weights : array_like or None
+            importance weights of every sample in the batch, used to weight the
+            critic loss. If set to None, all samples are weighted equally.
+        discount : array_like or None
+            the discount term of the value of the next observation of every
+            sample in the batch, e.g. gamma ** k for n-step samples of k
+            transitions. If set to None, gamma is used for every sample.
+        return_td_error : bool
+            whether to additionally return the TD error of every sample in the
+            batch. This is used to update the priorities of the samples when
+            prioritized experience replay is used.
 
         Returns
         -------
@@ -558,6 +705,47 @@ class FeedForwardPolicy(ActorCriticPolicy):
             Q1 loss, Q2 loss
         float
             actor loss
+        np.ndarray
+            (batch_size,) vector of TD errors. Only returned if
+            `return_td_error` is set to True.
+        """
+        step_ops, feed_dict = self.get_update_ops(
+            obs0, actions, rewards, obs1, terminals1,
+            update_actor=update_actor,
+            weights=weights,
+            discount=discount,
+            return_td_error=return_td_error)
+
+        # Perform the update operations and collect the losses.
+        vals = self.sess.run(step_ops, feed_dict=feed_dict)
+
+        return self.parse_update_outputs(
+            vals, update_actor=update_actor, return_td_error=return_td_error)
+
+    def get_update_ops(self,
+                       obs0,
+                       actions,
+                       rewards,
+                       obs1,
+                       terminals1,
+                       update_actor=True,
+                       weights=None,
+                       discount=None,
+                       return_td_error=False):
+        """Return the operations and feed_dict of a gradient update step.
+
+        This allows the update step to be run together with other operations
+        in a single session call (e.g. the update steps of both levels of a
+        hierarchy). The outputs of the operations are parsed via the
+        `parse_update_outputs` method. See `update_from_batch` for a
+        description of the arguments.
+
+        Returns
+        -------
+        list of tf.Operation or tf.Tensor
+            the operations of the update step
+        dict
+            the feed_dict of the update step
         """
         # Reshape to match previous behavior and placeholder shape.
         rewards = rewards.reshape(-1, 1)
@@ -574,18 +762,56 @@ class FeedForwardPolicy(ActorCriticPolicy):
                          self.actor_optimizer,
                          self.target_soft_updates]
 
-        # Perform the update operations and collect the critic loss.
-        critic_loss, *_vals = self.sess.run(step_ops, feed_dict={
+        if return_td_error:
+            step_ops += [self.td_error]
+
+        feed_dict = {
             self.obs_ph: obs0,
             self.action_ph: actions,
             self.rew_ph: rewards,
             self.obs1_ph: obs1,
             self.terminals1: terminals1
-        })
+        }
+
+        if weights is not None:
+            feed_dict[self.weights_ph] = weights.reshape(-1, 1)
+
+        if discount is not None:
+            feed_dict[self.discount_ph] = discount.reshape(-1, 1)
+
+        return step_ops, feed_dict
+
+    @staticmethod
+    def parse_update_outputs(vals, update_actor=True, return_td_error=False):
+        """Return the losses of a gradient update step.
+
+        Parameters
+        ----------
+        vals : list
+            the outputs of the operations returned by `get_update_ops`
+        update_actor : bool
+            whether the actor policy was updated
+        return_td_error : bool
+            whether the TD errors of the samples were computed
+
+        Returns
+        -------
+        [float, float]
+            Q1 loss, Q2 loss
+        float
+            actor loss
+        np.ndarray
+            (batch_size,) vector of TD errors. Only returned if
+            `return_td_error` is set to True.
+        """
+        critic_loss, *_vals = vals
 
         # Extract the actor loss.
         actor_loss = _vals[2] if update_actor else 0
 
+        if return_td_error:
+            return critic_loss, actor_loss, _vals[-1].flatten()
+
         return critic_loss, actor_loss
 
     def get_action(self, obs, context, apply_noise, random_actions):
@@ -594,7 +820,8 @@ class FeedForwardPolicy(ActorCriticPolicy):
         obs = self._get_obs(obs, context, axis=1)
 
         if random_actions:
-            action = np.array([self.ac_space.sample()])
+            action = np.array(
+                [self.ac_space.sample() for _ in range(len(obs))])
         else:
             action = self.sess.run(self.actor_tf, {self.obs_ph: obs})
 
@@ -629,7 +856,24 @@ class FeedForwardPolicy(ActorCriticPolicy):
             # masks that correspond to the final step are set to False.
             done = done and not is_final_step
 
-            self.replay_buffer.add(obs0, action, reward, obs1, float(done))
+            with self.replay_buffer.lock:
+                self.replay_buffer.add(
+                    obs0, action, reward, obs1, float(done))
+
+    def store_transitions(self, obs0, context0, action, reward, obs1,
+                          context1, done, is_final_step, evaluate=False):
+        """See parent class."""
+        if not evaluate:
+            # Add the contextual observations, if applicable.
+            obs0 = self._get_obs(obs0, context0, axis=1)
+            obs1 = self._get_obs(obs1, context1, axis=1)
+
+            # Modify the done masks in accordance with the TD3 algorithm.
+            done = np.logical_and(done, np.logical_not(is_final_step))
+
+            with self.replay_buffer.lock:
+                self.replay_buffer.add_batch(
+                    obs0, action, reward, obs1, done.astype(np.float32))
 
     def initialize(self):
         """See parent class.
@@ -686,11 +930,20 @@ class FeedForwardPolicy(ActorCriticPolicy):
             return {}
 
         # Get a batch.
-        obs0, actions, rewards, obs1, done1 = self.replay_buffer.sample()
-
-        return self.get_td_map_from_batch(obs0, actions, rewards, obs1, done1)
-
-    def get_td_map_from_batch(self, obs0, actions, rewards, obs1, terminals1):
+        samples = self._sample_batch(**self._sample_kwargs)
+        obs0, actions, rewards, obs1, done1 = samples[:5]
+        discount = samples[5] if self.n_step > 1 else None
+
+        return self.get_td_map_from_batch(
+            obs0, actions, rewards, obs1, done1, discount=discount)
+
+    def get_td_map_from_batch(self,
+                              obs0,
+                              actions,
+                              rewards,
+                              obs1,
+                              terminals1,
+                              discount=None):
         """Convert a batch to a td_map."""
         # Reshape to match previous behavior and placeholder shape.
         rewards = rewards.reshape(-1, 1)
@@ -704,4 +957,7 @@ class FeedForwardPolicy(ActorCriticPolicy):
             self.terminals1: terminals1
         }
 
+        if discount is not None:
+            td_map[self.discount_ph] = discount.reshape(-1, 1)
+
         return td_map
@@ -1,11 +1,10 @@
 """Base goal-conditioned hierarchical policy."""
 import tensorflow as tf
 import numpy as np
-from copy import deepcopy
 
 from hbaselines.fcnet.base import ActorCriticPolicy
 from hbaselines.goal_conditioned.replay_buffer import HierReplayBuffer
-from hbaselines.utils.reward_fns import negative_distance
+from hbaselines.utils.reward_fns import NegativeDistance
 from hbaselines.utils.misc import get_manager_ac_space, get_state_indices
 
 
@@ -58,9 +57,30 @@ class GoalConditionedPolicy(ActorCriticPolicy):
     off_policy_corrections : bool
         whether to use off-policy corrections during the update procedure. See:
         https://arxiv.org/abs/1805.08296.
+    in_graph_corrections : bool
+        whether to perform the off-policy corrections within the tensorflow
+        graph, as part of the update operation of the Manager policy. Only
+        used if `off_policy_corrections` is set to True.
+    correction_staleness : int or None
+        the number of Worker updates after which the off-policy corrections
+        cached in the replay buffer are recomputed. If set to None, the
+        corrections are recomputed every time they are sampled. Not used if
+        the corrections are performed within the tensorflow graph.
     hindsight : bool
         whether to use hindsight action and goal transitions, as well as
         subgoal testing. See: https://arxiv.org/abs/1712.00948
+    lazy_hindsight : bool
+        whether to relabel the goals of the samples in hindsight when they are
+        sampled from the replay buffer, instead of storing a second, relabeled
+        copy of every meta period. Only used if `hindsight` is set to True.
+    hindsight_strategy : str
+        the strategy used to choose the hindsight goals, one of "final" (the
+        goal achieved at the end of the meta period) or "future" (the goal
+        achieved at a random later step of the meta period). Only used if
+        `lazy_hindsight` is set to True.
+    hindsight_fraction : float
+        the fraction of the samples in every batch whose goals are relabeled.
+        Only used if `lazy_hindsight` is set to True.
     connected_gradients : bool
         whether to connect the graph between the manager and worker
     use_fingerprints : bool
@@ -78,13 +98,15 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         weights for the gradients of the loss of the worker with respect to the
         parameters of the manager. Only used if `connected_gradients` is set to
         True.
+    num_envs : int
+        the number of environments the policy interacts with in parallel
     prev_meta_obs : array_like
-        previous observation by the Manager
+        previous observation by the Manager, for every environment
     meta_action : array_like
-        current action by the Manager
-    meta_reward : float
+        current action by the Manager, for every environment
+    meta_reward : array_like
         current meta reward, counting as the cumulative environment reward
-        during the meta period
+        during the meta period, for every environment
     batch_size : int
         SGD batch size
     worker : hbaselines.fcnet.base.ActorCriticPolicy
@@ -109,17 +131,33 @@ class GoalConditionedPolicy(ActorCriticPolicy):
                  layers,
                  act_fun,
                  use_huber,
+                 prioritized_replay,
+                 prioritized_replay_alpha,
+                 prioritized_replay_beta,
+                 prioritized_replay_eps,
+                 storage,
+                 buffer_dir,
+                 deduplicate_obs,
+                 obs_encoding,
+                 prefetch_batches,
+                 n_step,
                  meta_period,
                  worker_reward_scale,
                  relative_goals,
                  off_policy_corrections,
+                 in_graph_corrections,
+                 correction_staleness,
                  hindsight,
+                 lazy_hindsight,
+                 hindsight_strategy,
+                 hindsight_fraction,
                  connected_gradients,
                  use_fingerprints,
                  fingerprint_range,
                  centralized_value_functions,
                  cg_weights,
                  env_name="",
+                 num_envs=1,
                  meta_policy=None,
                  worker_policy=None,
                  additional_params=None):
@@ -160,6 +198,51 @@ class GoalConditionedPolicy(ActorCriticPolicy):
             specifies whether to use the huber distance function as the loss
             for the critic. If set to False, the mean-squared error metric is
             used instead
+        prioritized_replay : bool
+            whether to use prioritized experience replay. See:
+            https://arxiv.org/abs/1511.05952
+        prioritized_replay_alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization)
+        prioritized_replay_beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction)
+        prioritized_replay_eps : float
+            small positive term added to the priorities to ensure that every
+            sample can be drawn
+        storage : str
+            the storage backend of the replay buffer, one of "memory" (in-RAM
+            numpy arrays) or "memmap" (numpy arrays memory-mapped to files in
+            `buffer_dir`)
+        buffer_dir : str or None
+            the directory memory-mapped replay buffer files are stored in. If
+            set to None, the default temporary directory is used. Only used if
+            `storage` is set to "memmap".
+        deduplicate_obs : bool
+            whether to store every observation in the replay buffer once,
+            instead of storing the observations and next observations
+            separately. This roughly halves the memory used by the
+            observations. Note that the hierarchical replay buffer already
+            stores every Worker observation once, so this only affects the
+            (unused) replay buffers of the Manager and Worker policies.
+        obs_encoding : str
+            the encoding observations are stored in within the replay buffer,
+            one of "float32", "float16", "uint8", or "uint16". The integer
+            encodings quantize every element of the observation affinely
+            between its bounds in the observation space or, if these are not
+            finite, its running minimum and maximum. Running bounds are always
+            used for the goals of the Worker if relative goals are used.
+        prefetch_batches : int
+            the number of minibatches that are sampled in advance by a
+            background thread, overlapping the sampling procedure with the
+            gradient updates. If set to 0, minibatches are sampled when they
+            are needed.
+        n_step : int
+            the number of consecutive transitions used to compute the target
+            values of the critic. If greater than 1, the discounted rewards of
+            up to `n_step` transitions (of the same episode) are summed, and
+            the value of the final next observation is discounted accordingly.
+            Only used by the feedforward policies.
         meta_period : int
             manger action period
         worker_reward_scale : float
@@ -170,9 +253,32 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         off_policy_corrections : bool
             whether to use off-policy corrections during the update procedure.
             See: https://arxiv.org/abs/1805.08296
+        in_graph_corrections : bool
+            whether to perform the off-policy corrections within the
+            tensorflow graph, as part of the update operation of the Manager
+            policy. Only used if `off_policy_corrections` is set to True.
+        correction_staleness : int or None
+            the number of Worker updates after which the off-policy
+            corrections cached in the replay buffer are recomputed. If set to
+            None, the corrections are recomputed every time they are sampled.
+            Not used if the corrections are performed within the tensorflow
+            graph.
         hindsight : bool
             whether to include hindsight action and goal transitions in the
             replay buffer. See: https://arxiv.org/abs/1712.00948
+        lazy_hindsight : bool
+            whether to relabel the goals of the samples in hindsight when they
+            are sampled from the replay buffer, instead of storing a second,
+            relabeled copy of every meta period. Only used if `hindsight` is
+            set to True.
+        hindsight_strategy : str
+            the strategy used to choose the hindsight goals, one of "final"
+            (the goal achieved at the end of the meta period) or "future" (the
+            goal achieved at a random later step of the meta period). Only used
+            if `lazy_hindsight` is set to True.
+        hindsight_fraction : float
+            the fraction of the samples in every batch whose goals are
+            relabeled. Only used if `lazy_hindsight` is set to True.
         connected_gradients : bool
             whether to connect the graph between the manager and worker
         cg_weights : float
@@ -188,6 +294,10 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         centralized_value_functions : bool
             specifies whether to use centralized value functions for the
             Manager and Worker critic functions
+        num_envs : int
+            the number of environments the policy interacts with in parallel.
+            The transitions of every environment are collected separately,
+            and the Manager issues goals for every environment independently.
         meta_policy : type [ hbaselines.fcnet.base.ActorCriticPolicy ]
             the policy model to use for the Manager
         worker_policy : type [ hbaselines.fcnet.base.ActorCriticPolicy ]
@@ -211,20 +321,40 @@ class GoalConditionedPolicy(ActorCriticPolicy):
             layer_norm=layer_norm,
             layers=layers,
             act_fun=act_fun,
-            use_huber=use_huber
+            use_huber=use_huber,
+            prioritized_replay=prioritized_replay,
+            prioritized_replay_alpha=prioritized_replay_alpha,
+            prioritized_replay_beta=prioritized_replay_beta,
+            prioritized_replay_eps=prioritized_replay_eps,
+            storage=storage,
+            buffer_dir=buffer_dir,
+            deduplicate_obs=deduplicate_obs,
+            obs_encoding=obs_encoding,
+            prefetch_batches=prefetch_batches,
+            n_step=n_step,
         )
 
         self.meta_period = meta_period
         self.worker_reward_scale = worker_reward_scale
         self.relative_goals = relative_goals
         self.off_policy_corrections = off_policy_corrections
+        self.in_graph_corrections = in_graph_corrections
+        self.correction_staleness = correction_staleness
         self.hindsight = hindsight
+        self.lazy_hindsight = lazy_hindsight
+        self.hindsight_strategy = hindsight_strategy
+        self.hindsight_fraction = hindsight_fraction
         self.connected_gradients = connected_gradients
         self.use_fingerprints = use_fingerprints
         self.fingerprint_range = fingerprint_range
         self.fingerprint_dim = (len(self.fingerprint_range[0]),)
         self.centralized_value_functions = centralized_value_functions
         self.cg_weights = cg_weights
+        self.num_envs = num_envs
+
+        # the number of update steps performed by the Worker policy. This is
+        # used to determine when cached off-policy corrections are stale.
+        self._worker_updates = 0
 
         # Get the Manager's action space.
         manager_ac_space = get_manager_ac_space(
@@ -234,6 +364,32 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         # Manager observation size
         meta_ob_dim = self._get_ob_dim(ob_space, co_space)
 
+        # Manager and Worker observation bounds. These are used to calibrate
+        # quantized encodings of the observations in the replay buffer.
+        meta_ob_low, meta_ob_high = self._get_ob_bounds(ob_space, co_space)
+        worker_ob_low, worker_ob_high = self._get_ob_bounds(
+            ob_space, manager_ac_space)
+
+        # If relative goals are used, the goal transition function moves the
+        # goals of the Worker outside the action space of the Manager, so
+        # running bounds are used for them instead.
+        if relative_goals:
+            worker_ob_low[-manager_ac_space.shape[0]:] = -np.inf
+            worker_ob_high[-manager_ac_space.shape[0]:] = np.inf
+
+        # Collect the state indices for the worker rewards.
+        state_indices = get_state_indices(
+            ob_space, env_name, use_fingerprints, self.fingerprint_dim)
+
+        # reward function for the worker. This is computed for batches of
+        # samples (e.g. every meta period) at once.
+        worker_reward_fn = NegativeDistance(
+            state_indices=state_indices,
+            relative_context=relative_goals,
+            offset=0.0
+        )
+        self.worker_reward_fn = worker_reward_fn
+
         # Create the replay buffer.
         self.replay_buffer = HierReplayBuffer(
             buffer_size=int(buffer_size/meta_period),
@@ -243,12 +399,88 @@ class GoalConditionedPolicy(ActorCriticPolicy):
             meta_ac_dim=manager_ac_space.shape[0],
             worker_obs_dim=ob_space.shape[0] + manager_ac_space.shape[0],
             worker_ac_dim=ac_space.shape[0],
+            prioritized=prioritized_replay,
+            alpha=prioritized_replay_alpha,
+            beta=prioritized_replay_beta,
+            eps=prioritized_replay_eps,
+            storage=storage,
+            buffer_dir=buffer_dir,
+            obs_encoding=obs_encoding,
+            relabel_strategy=hindsight_strategy
+            if hindsight and lazy_hindsight else None,
+            relabel_fraction=hindsight_fraction,
+            relative_goals=relative_goals,
+            reward_fn=worker_reward_fn,
+            reward_scale=worker_reward_scale,
+            meta_obs_low=meta_ob_low,
+            meta_obs_high=meta_ob_high,
+            worker_obs_low=worker_ob_low,
+            worker_obs_high=worker_ob_high,
+            correction_staleness=correction_staleness
+            if off_policy_corrections and not (
+                in_graph_corrections and not connected_gradients) else None,
         )
 
+        # Sample minibatches in a background thread, if requested. Additional
+        # data is only needed when using off-policy corrections.
+        self._setup_prefetcher(with_additional=off_policy_corrections)
+
+        # =================================================================== #
+        # Part 1. Setup the Worker                                            #
+        # =================================================================== #
+
+        # Create the Worker policy.
+        with tf.compat.v1.variable_scope("Worker"):
+            self.worker = worker_policy(
+                sess,
+                ob_space=ob_space,
+                ac_space=ac_space,
+                co_space=manager_ac_space,
+                buffer_size=buffer_size,
+                batch_size=batch_size,
+                actor_lr=actor_lr,
+                critic_lr=critic_lr,
+                verbose=verbose,
+                tau=tau,
+                gamma=gamma,
+                layer_norm=layer_norm,
+                layers=layers,
+                act_fun=act_fun,
+                use_huber=use_huber,
+                # The replay buffers of the Manager and Worker policies are not
+                # used, so no priorities need to be maintained for them, no
+                # minibatches need to be prefetched from them, and no n-step
+                # samples need to be computed.
+                prioritized_replay=False,
+                prioritized_replay_alpha=prioritized_replay_alpha,
+                prioritized_replay_beta=prioritized_replay_beta,
+                prioritized_replay_eps=prioritized_replay_eps,
+                storage=storage,
+                buffer_dir=buffer_dir,
+                deduplicate_obs=deduplicate_obs,
+                obs_encoding=obs_encoding,
+                prefetch_batches=0,
+                n_step=1,
+                scope="Worker",
+                zero_fingerprint=self.use_fingerprints,
+                fingerprint_dim=self.fingerprint_dim[0],
+                **(additional_params or {}),
+            )
+
         # =================================================================== #
-        # Part 1. Setup the Manager                                           #
+        # Part 2. Setup the Manager                                           #
         # =================================================================== #
 
+        # Create the operation that relabels the goals of the Manager, if
+        # needed. The relabeled goals are used by the update operations of the
+        # Manager policy unless other goals are fed. This is not supported by
+        # the connected gradients update procedure.
+        relabeled_goals = None
+        if off_policy_corrections and in_graph_corrections \
+                and not connected_gradients:
+            relabeled_goals = self._setup_off_policy_corrections(
+                manager_ac_space, meta_period)
+
         # Create the Manager policy.
         with tf.compat.v1.variable_scope("Manager"):
             self.manager = meta_policy(
@@ -267,9 +499,24 @@ class GoalConditionedPolicy(ActorCriticPolicy):
                 layers=layers,
                 act_fun=act_fun,
                 use_huber=use_huber,
+                # The replay buffers of the Manager and Worker policies are not
+                # used, so no priorities need to be maintained for them, no
+                # minibatches need to be prefetched from them, and no n-step
+                # samples need to be computed.
+                prioritized_replay=False,
+                prioritized_replay_alpha=prioritized_replay_alpha,
+                prioritized_replay_beta=prioritized_replay_beta,
+                prioritized_replay_eps=prioritized_replay_eps,
+                storage=storage,
+                buffer_dir=buffer_dir,
+                deduplicate_obs=deduplicate_obs,
+                obs_encoding=obs_encoding,
+                prefetch_batches=0,
+                n_step=1,
                 scope="Manager",
                 zero_fingerprint=False,
                 fingerprint_dim=self.fingerprint_dim[0],
+                default_action=relabeled_goals,
                 **(additional_params or {}),
             )
 
@@ -284,87 +531,58 @@ class GoalConditionedPolicy(ActorCriticPolicy):
                 return goal
         self.goal_transition_fn = goal_transition_fn
 
+        # The following is redundant but necessary if the changes to the update
+        # function are to be in the GoalConditionedPolicy policy and not
+        # FeedForwardPolicy.
+        self.batch_size = batch_size
+
+        # The samples of the current meta period are stored separately for
+        # every environment, in arrays with one row per environment. The step
+        # of the meta period that every environment is currently in is stored
+        # in `_num_steps`.
+        goal_dim = manager_ac_space.shape[0]
+        worker_ob_dim = ob_space.shape[0] + goal_dim
+
         # previous observation by the Manager
-        self.prev_meta_obs = None
+        self.prev_meta_obs = np.zeros((num_envs, meta_ob_dim[0]))
 
         # current action by the Manager
-        self.meta_action = None
+        self.meta_action = np.zeros((num_envs, goal_dim))
 
         # current meta reward, counting as the cumulative environment reward
         # during the meta period
-        self.meta_reward = None
+        self.meta_reward = np.zeros(num_envs)
 
-        # The following is redundant but necessary if the changes to the update
-        # function are to be in the GoalConditionedPolicy policy and not
-        # FeedForwardPolicy.
-        self.batch_size = batch_size
-
-        # Use this to store a list of observations that stretch as long as the
+        # Use this to store the observations that stretch as long as the
         # dilated horizon chosen for the Manager. These observations correspond
         # to the s(t) in the HIRO paper.
-        self._observations = []
+        self._observations = np.zeros(
+            (num_envs, meta_period + 1, worker_ob_dim))
 
-        # Use this to store the list of environmental actions that the worker
-        # takes. These actions correspond to the a(t) in the HIRO paper.
-        self._worker_actions = []
+        # Use this to store the environmental actions that the worker takes.
+        # These actions correspond to the a(t) in the HIRO paper.
+        self._worker_actions = np.zeros(
+            (num_envs, meta_period, ac_space.shape[0]))
 
         # rewards provided by the policy to the worker
-        self._worker_rewards = []
+        self._worker_rewards = np.zeros((num_envs, meta_period))
 
         # done masks at every time step for the worker
-        self._dones = []
+        self._dones = np.zeros((num_envs, meta_period), dtype=bool)
 
         # actions performed by the manager during a given meta period. Used by
         # the replay buffer.
-        self._meta_actions = []
+        self._meta_actions = np.zeros((num_envs, meta_period, goal_dim))
 
-        # =================================================================== #
-        # Part 2. Setup the Worker                                            #
-        # =================================================================== #
-
-        # Create the Worker policy.
-        with tf.compat.v1.variable_scope("Worker"):
-            self.worker = worker_policy(
-                sess,
-                ob_space=ob_space,
-                ac_space=ac_space,
-                co_space=manager_ac_space,
-                buffer_size=buffer_size,
-                batch_size=batch_size,
-                actor_lr=actor_lr,
-                critic_lr=critic_lr,
-                verbose=verbose,
-                tau=tau,
-                gamma=gamma,
-                layer_norm=layer_norm,
-                layers=layers,
-                act_fun=act_fun,
-                use_huber=use_huber,
-                scope="Worker",
-                zero_fingerprint=self.use_fingerprints,
-                fingerprint_dim=self.fingerprint_dim[0],
-                **(additional_params or {}),
-            )
-
-        # Collect the state indices for the worker rewards.
-        state_indices = get_state_indices(
-            ob_space, env_name, use_fingerprints, self.fingerprint_dim)
-
-        # reward function for the worker
-        def worker_reward_fn(states, goals, next_states):
-            return negative_distance(
-                states=states,
-                state_indices=state_indices,
-                goals=goals,
-                next_states=next_states,
-                relative_context=relative_goals,
-                offset=0.0
-            )
-        self.worker_reward_fn = worker_reward_fn
+        # the number of steps of the current meta period that have been stored
+        self._num_steps = np.zeros(num_envs, dtype=int)
 
         if self.connected_gradients:
             self._setup_connected_gradients()
 
+        # Create the operation that computes the actions of both levels.
+        self._setup_inference()
+
     def initialize(self):
         """See parent class.
 
@@ -372,7 +590,7 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         """
         self.manager.initialize()
         self.worker.initialize()
-        self.meta_reward = 0
+        self.meta_reward = np.zeros(self.num_envs)
 
     def update(self, update_actor=True, **kwargs):
         """Perform a gradient update step.
@@ -391,6 +609,9 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         worker policies occur at the same frequency as their respective actor
         update frequencies.
 
+        Unless connected gradients are used, the update steps of the manager
+        and worker policies are performed in a single session call.
+
         Parameters
         ----------
         update_actor : bool
@@ -414,22 +635,28 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         with_additional = self.off_policy_corrections
 
         # Get a batch.
+        samples = self._sample_batch(with_additional=with_additional)
         meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
             worker_obs1, worker_act, worker_rew, worker_done, additional = \
-            self.replay_buffer.sample(with_additional=with_additional)
+            samples[:11]
+
+        # Importance weights and indices of the samples. These are only
+        # returned if prioritized experience replay is being used.
+        weights, idxes = samples[11:] if self.prioritized_replay \
+            else (None, None)
 
-        # Update the Manager policy.
+        # Collect the update operations of the Manager policy.
+        m_ops, feed_dict = [], {}
         if kwargs['update_meta']:
+            # Specifies whether the goals are relabeled within the update
+            # operation of the Manager policy.
+            in_graph_corrections = self.off_policy_corrections \
+                and self.in_graph_corrections and not self.connected_gradients
+
             # Replace the goals with the most likely goals.
-            if self.off_policy_corrections:
-                meta_act = self._sample_best_meta_action(
-                    meta_obs0=meta_obs0,
-                    meta_obs1=meta_obs1,
-                    meta_action=meta_act,
-                    worker_obses=additional["worker_obses"],
-                    worker_actions=additional["worker_actions"],
-                    k=8
-                )
+            if self.off_policy_corrections and not in_graph_corrections:
+                meta_act = self._corrected_meta_action(
+                    meta_obs0, meta_obs1, meta_act, additional)
 
             if self.connected_gradients:
                 # Perform the connected gradients update procedure.
@@ -445,136 +672,354 @@ class GoalConditionedPolicy(ActorCriticPolicy):
                     worker_actions=worker_act,
                 )
             else:
-                # Perform the regular manager update procedure.
-                m_critic_loss, m_actor_loss = self.manager.update_from_batch(
+                # Collect the regular manager update procedure.
+                m_ops, feed_dict = self.manager.get_update_ops(
                     obs0=meta_obs0,
                     actions=meta_act,
                     rewards=meta_rew,
                     obs1=meta_obs1,
                     terminals1=meta_done,
                     update_actor=kwargs['update_meta_actor'],
+                    weights=weights,
                 )
+
+                if in_graph_corrections:
+                    # The most likely goals are computed by the update
+                    # operation, so the original goals are not fed to it.
+                    del feed_dict[self.manager.action_ph]
+                    feed_dict.update({
+                        self.meta_obs0_ph: meta_obs0,
+                        self.meta_obs1_ph: meta_obs1,
+                        self.meta_actions_ph: meta_act,
+                        self.worker_obses_ph: additional["worker_obses"],
+                        self.worker_actions_ph: additional["worker_actions"],
+                    })
         else:
             m_critic_loss, m_actor_loss = [0, 0], 0
 
-        # Update the Worker policy.
-        w_critic_loss, w_actor_loss = self.worker.update_from_batch(
+        # Collect the update operations of the Worker policy.
+        w_ops, w_feed_dict = self.worker.get_update_ops(
             obs0=worker_obs0,
             actions=worker_act,
             rewards=worker_rew,
             obs1=worker_obs1,
             terminals1=worker_done,
             update_actor=update_actor,
+            weights=weights,
+            return_td_error=self.prioritized_replay,
         )
+        feed_dict.update(w_feed_dict)
+
+        # Update both policies in a single session call. The update steps of
+        # the two levels are independent, and may be computed concurrently.
+        m_vals, w_vals = self.sess.run([m_ops, w_ops], feed_dict=feed_dict)
+
+        if m_ops:
+            m_critic_loss, m_actor_loss = self.manager.parse_update_outputs(
+                m_vals, update_actor=kwargs['update_meta_actor'])
+        w_outputs = self.worker.parse_update_outputs(
+            w_vals,
+            update_actor=update_actor,
+            return_td_error=self.prioritized_replay,
+        )
+        w_critic_loss, w_actor_loss = w_outputs[:2]
+
+        self._worker_updates += 1
+
+        # Update the priorities of the samples based on the TD error of the
+        # Worker policy, which is updated at every step.
+        if self.prioritized_replay:
+            with self.replay_buffer.lock:
+                self.replay_buffer.update_priorities(idxes, w_outputs[2])
 
         return (m_critic_loss, w_critic_loss), (m_actor_loss, w_actor_loss)
 
     def get_action(self, obs, context, apply_noise, random_actions):
-        """See parent class."""
-        if self._update_meta:
-            # Update the meta action based on the output from the policy if the
-            # time period requires is.
-            self.meta_action = self.manager.get_action(
-                obs, context, apply_noise, random_actions)
-        else:
-            # Update the meta-action in accordance with the fixed transition
-            # function.
-            goal_dim = self.meta_action.shape[1]
-            self.meta_action = self.goal_transition_fn(
-                obs0=np.asarray([self._observations[-1][:goal_dim]]),
-                goal=self.meta_action,
-                obs1=obs[:, :goal_dim]
+        """See parent class.
+
+        The observations (and contexts) may contain one row for each of the
+        first `len(obs)` environments. New goals are only computed for the
+        environments whose meta periods have expired, via a single call to
+        the Manager policy.
+        """
+        n = len(obs)
+        meta_action = self._meta_action_matrix()
+        update_meta = self._update_meta[:n]
+        goal_dim = meta_action.shape[1]
+
+        # The goals of the environments whose meta periods have not expired
+        # are updated in accordance with the fixed transition function, from
+        # the most recent observation.
+        prev_obs = self._observations[
+            np.arange(n), self._num_steps[:n] - 1, :goal_dim]
+
+        if not random_actions:
+            # Compute the goals and the worker actions in a single call.
+            goal, worker_action = self.sess.run(
+                [self.inference_goal, self.inference_action],
+                feed_dict={
+                    self.manager.obs_ph: self._get_obs(obs, context, axis=1),
+                    self.update_meta_ph: update_meta,
+                    self.meta_action_ph: meta_action[:n],
+                    self.prev_obs_ph: prev_obs,
+                    self.apply_noise_ph: apply_noise,
+                })
+            meta_action[:n] = goal
+            self.meta_action = meta_action
+
+            return worker_action
+
+        if update_meta.any():
+            # Update the meta actions based on the output from the policy for
+            # the environments that require it.
+            meta_action[:n][update_meta] = self.manager.get_action(
+                obs[update_meta],
+                None if context is None else np.asarray(context)[update_meta],
+                apply_noise, random_actions)
+
+        if not update_meta.all():
+            # Update the remaining meta-actions in accordance with the fixed
+            # transition function.
+            keep = np.flatnonzero(~update_meta)
+            meta_action[keep] = self.goal_transition_fn(
+                obs0=prev_obs[keep],
+                goal=meta_action[keep],
+                obs1=obs[keep, :goal_dim]
             )
 
+        self.meta_action = meta_action
+
         # Return the worker action.
         worker_action = self.worker.get_action(
-            obs, self.meta_action, apply_noise, random_actions)
+            obs, self.meta_action[:n], apply_noise, random_actions)
 
         return worker_action
 
+    def _setup_inference(self):
+        """Create the operation that computes the actions of both levels.
+
+        The goals of the environments whose meta periods have expired are
+        computed by the Manager policy, and the goals of all other
+        environments via the goal transition function. The actions of the
+        Worker policy are then computed from these goals, so that a single
+        session call is needed per step (see `get_action`).
+        """
+        ob_dim = self.ob_space.shape[0]
+        goal_dim = self.manager.ac_space.shape[0]
+
+        with tf.compat.v1.variable_scope("inference", reuse=False):
+            self.update_meta_ph = tf.compat.v1.placeholder(
+                tf.bool, shape=(None,), name="update_meta")
+            self.meta_action_ph = tf.compat.v1.placeholder(
+                tf.float32, shape=(None, goal_dim), name="meta_action")
+            self.prev_obs_ph = tf.compat.v1.placeholder(
+                tf.float32, shape=(None, goal_dim), name="prev_obs")
+            self.apply_noise_ph = tf.compat.v1.placeholder_with_default(
+                False, shape=(), name="apply_noise")
+
+        # The observations are the first elements of the input to the Manager
+        # policy, which may additionally contain the contextual terms.
+        obs = self.manager.obs_ph[:, :ob_dim]
+
+        # Compute the goals of both kinds of environments.
+        manager_goal = self._inference_action(
+            self.manager, "Manager", self.manager.obs_ph, self.apply_noise_ph)
+        transition_goal = self.goal_transition_fn(
+            obs0=self.prev_obs_ph,
+            goal=self.meta_action_ph,
+            obs1=obs[:, :goal_dim])
+        self.inference_goal = tf.compat.v1.where(
+            self.update_meta_ph, manager_goal, transition_goal)
+
+        # Compute the worker actions from the goals.
+        self.inference_action = self._inference_action(
+            self.worker, "Worker", tf.concat([obs, self.inference_goal], 1),
+            self.apply_noise_ph)
+
+    def _inference_action(self, policy, scope, obs, apply_noise):
+        """Create the action of a policy given an observation tensor.
+
+        The variables of the actor of the policy are reused.
+
+        Parameters
+        ----------
+        policy : hbaselines.fcnet.base.ActorCriticPolicy
+            the Manager or Worker policy
+        scope : str
+            the scope of the policy
+        obs : tf.Tensor
+            the input observations, including the contextual terms
+        apply_noise : tf.Tensor
+            a boolean tensor specifying whether to apply exploration noise to
+            the actions
+
+        Returns
+        -------
+        tf.Tensor
+            the actions of the policy
+        """
+        raise NotImplementedError
+
     def value(self, obs, context, action):
         """See parent class."""
         return 0, 0  # FIXME
 
     def store_transition(self, obs0, context0, action, reward, obs1, context1,
                          done, is_final_step, evaluate=False):
-        """See parent class."""
-        # Compute the worker reward and append it to the list of rewards.
-        self._worker_rewards.append(
-            self.worker_reward_scale *
-            self.worker_reward_fn(obs0, self.meta_action.flatten(), obs1)
+        """See parent class.
+
+        The transition is assigned to the first environment.
+        """
+        def expand(x):
+            return None if x is None else np.asarray(x).flatten()[None]
+
+        self.store_transitions(
+            obs0=expand(obs0),
+            context0=expand(context0),
+            action=expand(action),
+            reward=np.array([reward]),
+            obs1=expand(obs1),
+            context1=expand(context1),
+            done=np.array([done]),
+            is_final_step=np.array([is_final_step]),
+            evaluate=evaluate,
         )
 
+    def store_transitions(self, obs0, context0, action, reward, obs1,
+                          context1, done, is_final_step, evaluate=False):
+        """See parent class.
+
+        The transitions are assigned to the first `len(obs0)` environments.
+        The meta periods that are completed by these transitions are stored
+        in the replay buffer at once.
+        """
+        n = len(obs0)
+        envs = np.arange(n)
+        steps = self._num_steps[:n]
+        meta_action = self._meta_action_matrix()[:n]
+        done = np.asarray(done, dtype=bool)
+
+        # Compute the worker rewards and add them to the arrays of rewards.
+        self._worker_rewards[envs, steps] = self.worker_reward_scale * \
+            self.worker_reward_fn(obs0, meta_action, obs1)
+
         # Add the environmental observations and done masks, and the manager
-        # and worker actions to their respective lists.
-        self._worker_actions.append(action)
-        self._meta_actions.append(self.meta_action.flatten())
-        self._observations.append(self._get_obs(obs0, self.meta_action, 0))
+        # and worker actions to their respective arrays.
+        self._worker_actions[envs, steps] = action
+        self._meta_actions[envs, steps] = meta_action
+        self._observations[envs, steps] = self._get_obs(obs0, meta_action, 1)
 
         # Modify the done mask in accordance with the TD3 algorithm. Done
         # masks that correspond to the final step are set to False.
-        self._dones.append(done and not is_final_step)
+        self._dones[envs, steps] = done & ~np.asarray(is_final_step)
 
         # Increment the meta reward with the most recent reward.
-        self.meta_reward += reward
+        meta_reward = np.zeros(self.num_envs)
+        meta_reward[:] = self.meta_reward
+        meta_reward[:n] += reward
+        self.meta_reward = meta_reward
 
         # Modify the previous meta observation whenever the action has changed.
-        if len(self._observations) == 1:
-            self.prev_meta_obs = self._get_obs(obs0, context0, 0)
+        first = steps == 0
+        if first.any():
+            self.prev_meta_obs[:n][first] = \
+                self._get_obs(obs0, context0, 1)[first]
+
+        self._num_steps[:n] += 1
+
+        # Add samples to the replay buffer for the meta periods that are done.
+        flush = (self._num_steps[:n] == self.meta_period) | done
+        if flush.any():
+            idx = np.flatnonzero(flush)
+            lengths = self._num_steps[idx]
 
-        # Add a sample to the replay buffer.
-        if len(self._observations) == self.meta_period or done:
             # Add the last observation.
-            self._observations.append(self._get_obs(obs1, self.meta_action, 0))
+            self._observations[idx, lengths] = self._get_obs(
+                obs1[idx], meta_action[idx], 1)
 
             # Add the contextual observation to the most recent environmental
             # observation, if applicable.
-            meta_obs1 = self._get_obs(obs1, context1, 0)
+            meta_obs1 = self._get_obs(
+                obs1[idx], None if context1 is None else context1[idx], 1)
 
             if not evaluate:
-                # Store a sample in the replay buffer.
-                self.replay_buffer.add(
-                    obs_t=self._observations,
-                    goal_t=self._meta_actions[0],
-                    action_t=self._worker_actions,
-                    reward_t=self._worker_rewards,
-                    done=self._dones,
-                    meta_obs_t=(self.prev_meta_obs, meta_obs1),
-                    meta_reward_t=self.meta_reward,
-                )
+                self._store_meta_periods(idx, lengths, meta_obs1)
 
-                if self.hindsight:
-                    # Implement hindsight action and goal transitions.
-                    goal, obs, rewards = self._hindsight_actions_goals(
-                        meta_action=self.meta_action,
-                        initial_observations=self._observations,
-                        initial_rewards=self._worker_rewards
-                    )
+            # Clear the worker rewards and actions, and the environmental
+            # observation and reward.
+            self._clear_envs(idx)
+
+    def _store_meta_periods(self, idx, lengths, meta_obs1):
+        """Store the current meta periods of some environments.
 
-                    # Store the hindsight sample in the replay buffer.
-                    self.replay_buffer.add(
-                        obs_t=obs,
-                        goal_t=goal,
-                        action_t=self._worker_actions,
-                        reward_t=rewards,
-                        done=self._dones,
-                        meta_obs_t=(self.prev_meta_obs, meta_obs1),
-                        meta_reward_t=self.meta_reward,
+        Parameters
+        ----------
+        idx : np.ndarray
+            the indices of the environments
+        lengths : np.ndarray
+            the number of steps in the meta period of every environment
+        meta_obs1 : np.ndarray
+            the final Manager observations of every meta period
+        """
+        # Store the samples in the replay buffer.
+        with self.replay_buffer.lock:
+            self.replay_buffer.add_batch(
+                obs_t=self._observations[idx],
+                goal_t=self._meta_actions[idx, 0],
+                action_t=self._worker_actions[idx],
+                reward_t=self._worker_rewards[idx],
+                done=self._dones[idx],
+                lengths=lengths,
+                meta_obs_t=(self.prev_meta_obs[idx], meta_obs1),
+                meta_reward_t=self.meta_reward[idx],
+            )
+
+        # Hindsight transitions are only stored if they are not relabeled when
+        # sampled from the replay buffer.
+        if self.hindsight and not self.lazy_hindsight:
+            # Implement hindsight action and goal transitions.
+            obs = self._observations[idx].copy()
+            rewards = self._worker_rewards[idx].copy()
+            goal = self._meta_actions[idx, 0].copy()
+            for i, (j, length) in enumerate(zip(idx, lengths)):
+                goal[i], obs[i, :length + 1], rewards[i, :length] = \
+                    self._hindsight_actions_goals(
+                        meta_action=self._meta_actions[j, 0],
+                        initial_observations=obs[i, :length + 1],
                     )
 
-            # Clear the worker rewards and actions, and the environmental
-            # observation and reward.
-            self.clear_memory()
+            # Store the hindsight samples in the replay buffer.
+            with self.replay_buffer.lock:
+                self.replay_buffer.add_batch(
+                    obs_t=obs,
+                    goal_t=goal,
+                    action_t=self._worker_actions[idx],
+                    reward_t=rewards,
+                    done=self._dones[idx],
+                    lengths=lengths,
+                    meta_obs_t=(self.prev_meta_obs[idx], meta_obs1),
+                    meta_reward_t=self.meta_reward[idx],
+                )
+
+    def _meta_action_matrix(self):
+        """Return the current meta actions, with one row per environment."""
+        return np.array(self.meta_action, dtype=np.float64).reshape(
+            self.num_envs, -1)
 
     @property
     def _update_meta(self):
-        """Return True if the meta-action should be updated by the policy.
+        """Return whether the meta-actions should be updated by the policy.
+
+        This is done by checking the number of steps of the current meta
+        periods, which are reset whenever the meta-period has been met or the
+        environment has been reset.
 
-        This is done by checking the length of the observation lists that are
-        passed to the replay buffer, which are cleared whenever the meta-period
-        has been met or the environment has been reset.
+        Returns
+        -------
+        np.ndarray
+            (num_envs,) boolean vector with one element per environment
         """
-        return len(self._observations) == 0
+        return self._num_steps == 0
 
     def clear_memory(self):
         """Clear internal memory that is used by the replay buffer.
@@ -582,12 +1027,18 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         By clearing memory, the Manager policy is then informed during the
         `get_action` procedure to update the meta-action.
         """
-        self.meta_reward = 0
-        self._observations = []
-        self._worker_actions = []
-        self._worker_rewards = []
-        self._dones = []
-        self._meta_actions = []
+        self._clear_envs(np.arange(self.num_envs))
+
+    def _clear_envs(self, idx):
+        """Clear the memory of the current meta periods of some environments.
+
+        Parameters
+        ----------
+        idx : np.ndarray
+            the indices of the environments
+        """
+        self.meta_reward[idx] = 0
+        self._num_steps[idx] = 0
 
     def get_td_map(self):
         """See parent class."""
@@ -597,8 +1048,8 @@ class GoalConditionedPolicy(ActorCriticPolicy):
 
         # Get a batch.
         meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
-            worker_obs1, worker_act, worker_rew, worker_done, _ = \
-            self.replay_buffer.sample()
+            worker_obs1, worker_act, worker_rew, worker_done, *_ = \
+            self._sample_batch()
 
         td_map = {}
         td_map.update(self.manager.get_td_map_from_batch(
@@ -612,6 +1063,66 @@ class GoalConditionedPolicy(ActorCriticPolicy):
     #                       Auxiliary methods for HIRO                        #
     # ======================================================================= #
 
+    def _corrected_meta_action(self,
+                               meta_obs0,
+                               meta_obs1,
+                               meta_action,
+                               additional):
+        """Return the off-policy corrections of a batch of meta-actions.
+
+        If `correction_staleness` is not None, the corrections are read from
+        the replay buffer's cache, and only the corrections that are missing
+        or stale are recomputed (and cached).
+
+        Parameters
+        ----------
+        meta_obs0 : array_like
+            (batch_size, m_obs_dim) matrix of Manager observations
+        meta_obs1 : array_like
+            (batch_size, m_obs_dim) matrix of next time step Manager
+            observations
+        meta_action : array_like
+            (batch_size, m_ac_dim) matrix of Manager actions
+        additional : dict
+            the additional information of the batch, see the
+            `_encode_sample` method of the replay buffer
+
+        Returns
+        -------
+        numpy.ndarray
+            (batch_size, m_ac_dim) matrix of most likely Manager actions
+        """
+        if self.replay_buffer.correction_staleness is None:
+            return self._sample_best_meta_action(
+                meta_obs0=meta_obs0,
+                meta_obs1=meta_obs1,
+                meta_action=meta_action,
+                worker_obses=additional["worker_obses"],
+                worker_actions=additional["worker_actions"],
+                k=8
+            )
+
+        idxes = additional["idxes"]
+        with self.replay_buffer.lock:
+            corrected, stale = self.replay_buffer.get_corrections(
+                idxes, meta_action, self._worker_updates)
+
+        if stale.any():
+            corrected[stale] = self._sample_best_meta_action(
+                meta_obs0=meta_obs0[stale],
+                meta_obs1=meta_obs1[stale],
+                meta_action=meta_action[stale],
+                worker_obses=additional["worker_obses"][stale],
+                worker_actions=additional["worker_actions"][stale],
+                k=8
+            )
+            with self.replay_buffer.lock:
+                self.replay_buffer.store_corrections(
+                    idxes[stale], meta_action[stale], corrected[stale],
+                    self._worker_updates)
+
+        return corrected
+
     def _sample_best_meta_action(self,
                                  meta_obs0,
                                  meta_obs1,
@@ -762,14 +1273,142 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         """
         raise NotImplementedError
 
+    def _setup_off_policy_corrections(self,
+                                      goal_space,
+                                      meta_period,
+                                      num_samples=8,
+                                      sc=0.5):
+        """Create the operation that relabels the goals of the Manager.
+
+        This is the tensorflow implementation of `_sample_best_meta_action`.
+        The candidate goals are sampled similar to the `_sample` method, and
+        the candidate goal that maximizes the log-probability of the actions
+        of the Worker is selected.
+
+        Parameters
+        ----------
+        goal_space : gym.spaces.Box
+            the action space of the Manager
+        meta_period : int
+            manger action period
+        num_samples : int
+            number of candidate goals, including the initial goal and the
+            mean value
+        sc : float
+            scaling factor for the normal distribution
+
+        Returns
+        -------
+        tf.Tensor
+            (batch_size, m_ac_dim) matrix of most likely Manager actions
+        """
+        goal_dim = goal_space.shape[0]
+        worker_ob_dim = self.ob_space.shape[0] + goal_dim
+        random_samples = num_samples - 2
+
+        with tf.compat.v1.variable_scope("off_policy_corrections"):
+            self.meta_obs0_ph = tf.compat.v1.placeholder(
+                tf.float32, shape=(None, None), name="meta_obs0")
+            self.meta_obs1_ph = tf.compat.v1.placeholder(
+                tf.float32, shape=(None, None), name="meta_obs1")
+            self.meta_actions_ph = tf.compat.v1.placeholder(
+                tf.float32, shape=(None, goal_dim), name="meta_actions")
+            self.worker_obses_ph = tf.compat.v1.placeholder(
+                tf.float32,
+                shape=(None, worker_ob_dim, meta_period + 1),
+                name="worker_obses")
+            self.worker_actions_ph = tf.compat.v1.placeholder(
+                tf.float32,
+                shape=(None, self.ac_space.shape[0], meta_period),
+                name="worker_actions")
+
+        batch_size = tf.shape(self.meta_actions_ph)[0]
+
+        # The mean of the candidate goals is the change in state over the meta
+        # period. This is computed from the Manager observations since the
+        # Worker observations of meta periods that end early are padded.
+        loc = self.meta_obs1_ph[:, :goal_dim] - self.meta_obs0_ph[:, :goal_dim]
+
+        # Collect the (batch_size, num_samples, goal_dim) candidate goals.
+        scale = sc * (goal_space.high - goal_space.low) / 2
+        normal_samples = tf.random.normal(
+            (batch_size, random_samples, goal_dim))
+        candidates = tf.concat(
+            [loc[:, None, :] + normal_samples * scale,
+             loc[:, None, :],
+             self.meta_actions_ph[:, None, :]], axis=1)
+
+        # Clip the values based on the Manager action space range.
+        candidates = tf.clip_by_value(
+            candidates, goal_space.low, goal_space.high)
+
+        # Create (batch_size, num_samples, meta_period, goal_dim) repeated
+        # representations of each candidate goal for each worker observation
+        # in a meta period.
+        goals = tf.tile(candidates[:, :, None, :], (1, 1, meta_period, 1))
+
+        # If relative goals are being used, update the later goals to match
+        # what they would be under the relative goals difference approach.
+        if self.relative_goals:
+            goal_diff = self.worker_obses_ph[:, :goal_dim, :-1] - \
+                self.worker_obses_ph[:, :goal_dim, :1]
+            goals += tf.transpose(goal_diff, (0, 2, 1))[:, None, :, :]
+
+        # Create the worker observations of every candidate goal, and the
+        # repeated worker actions. The last observation is removed since it
+        # does not correspond to any action for the current meta-period.
+        obs = tf.transpose(
+            self.worker_obses_ph[:, :-goal_dim, :-1], (0, 2, 1))
+        worker_obs = tf.concat(
+            [tf.tile(obs[:, None, :, :], (1, num_samples, 1, 1)), goals],
+            axis=3)
+        worker_actions = tf.tile(
+            tf.transpose(self.worker_actions_ph, (0, 2, 1))[:, None, :, :],
+            (1, num_samples, 1, 1))
+
+        # Compute the fitness of each candidate goal. The fitness is the sum of
+        # the log-probabilities of each action for the given goal.
+        log_probs = self._worker_log_probs(
+            tf.reshape(worker_obs, (-1, worker_ob_dim)),
+            tf.reshape(worker_actions, (-1, self.ac_space.shape[0])))
+        fitness = tf.reduce_sum(
+            tf.reshape(log_probs, (-1, num_samples, meta_period)), axis=2)
+
+        # For each sample, choose the meta action that maximizes the fitness.
+        indx = tf.argmax(fitness, axis=1, output_type=tf.int32)
+
+        return tf.gather_nd(
+            candidates, tf.stack([tf.range(batch_size), indx], axis=1))
+
+    def _worker_log_probs(self, obs, actions):
+        """Create the log-probabilities of the actions of the Worker.
+
+        The variables of the Worker policy are reused.
+
+        Parameters
+        ----------
+        obs : tf.Tensor
+            (N, w_obs_dim) matrix of Worker observations, including the goals
+        actions : tf.Tensor
+            (N, w_ac_dim) matrix of Worker actions
+
+        Returns
+        -------
+        tf.Tensor
+            (N,) vector of log-probabilities (or their approximations) of the
+            actions given the observations
+
+        Helps
+        -----
+        * _setup_off_policy_corrections(self)
+        """
+        raise NotImplementedError
+
     # ======================================================================= #
     #                       Auxiliary methods for HAC                         #
     # ======================================================================= #
 
-    def _hindsight_actions_goals(self,
-                                 meta_action,
-                                 initial_observations,
-                                 initial_rewards):
+    def _hindsight_actions_goals(self, meta_action, initial_observations):
         """Calculate hindsight goal and action transitions.
 
         These are then stored in the replay buffer along with the original
@@ -785,8 +1424,6 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         initial_observations : array_like
             the original worker observations with the non-hindsight goals
             appended to them
-        initial_rewards : array_like
-            the original worker rewards
 
         Returns
         -------
@@ -803,32 +1440,32 @@ class GoalConditionedPolicy(ActorCriticPolicy):
         * store_transition(self):
         """
         goal_dim = meta_action.shape[0]
-        observations = deepcopy(initial_observations)
-        rewards = deepcopy(initial_rewards)
-        hindsight_goal = 0 if self.relative_goals \
-            else observations[-1][:goal_dim]
-        obs_tp1 = observations[-1]
-
-        for i in range(1, len(observations) + 1):
-            obs_t = observations[-i]
-
-            # Calculate the hindsight goal in using relative goals.
-            # If not, the hindsight goal is simply a subset of the
-            # final state observation.
-            if self.relative_goals:
-                hindsight_goal += obs_tp1[:goal_dim] - obs_t[:goal_dim]
-
-            # Modify the Worker intrinsic rewards based on the new
-            # hindsight goal.
-            if i > 1:
-                rewards[-(i - 1)] = self.worker_reward_scale \
-                    * self.worker_reward_fn(obs_t, hindsight_goal, obs_tp1)
-
-            obs_tp1 = deepcopy(obs_t)
-
-            # Replace the goal with the goal that the worker
-            # actually achieved.
-            observations[-i][-goal_dim:] = hindsight_goal
+        initial_observations = np.asarray(initial_observations)
+        observations = initial_observations.copy()
+        achieved_goals = initial_observations[:, :goal_dim]
+
+        # Calculate the hindsight goal of every step. For relative goals, this
+        # is the change in state until the end of the meta period, computed
+        # as a reverse cumulative sum of the changes in state. If not, the
+        # hindsight goal is simply a subset of the final state observation.
+        if self.relative_goals:
+            deltas = achieved_goals[1:] - achieved_goals[:-1]
+            hindsight_goals = np.zeros_like(achieved_goals)
+            hindsight_goals[:-1] = np.cumsum(deltas[::-1], axis=0)[::-1]
+        else:
+            hindsight_goals = np.tile(
+                achieved_goals[-1], (len(observations), 1))
+
+        # Modify the Worker intrinsic rewards based on the new hindsight
+        # goals.
+        rewards = self.worker_reward_scale * self.worker_reward_fn(
+            initial_observations[:-1],
+            hindsight_goals[:-1],
+            initial_observations[1:])
+
+        # Replace the goals with the goals that the worker actually achieved.
+        observations[:, -goal_dim:] = hindsight_goals
+        hindsight_goal = hindsight_goals[0]
 
         return hindsight_goal, observations, rewards
 
@@ -1,12 +1,75 @@
 """Script containing the HierReplayBuffer object."""
-import random
 import numpy as np
 
 from hbaselines.fcnet.replay_buffer import ReplayBuffer
+from hbaselines.utils.storage import ObservationEncoder
 
 
 class HierReplayBuffer(ReplayBuffer):
-    """Hierarchical variant of ReplayBuffer."""
+    """Hierarchical variant of ReplayBuffer.
+
+    Every element in the buffer corresponds to a single meta period, and is
+    stored across preallocated numpy arrays (one row per meta period) instead
+    of a list of Python objects. This allows for batches (including the
+    additional worker_obses/worker_actions terms) to be collected via a few
+    vectorized gathers. These arrays may also be backed by files on disk (see
+    the `storage` parameter), and the Manager and Worker observations may be
+    stored in a compact encoding (see the `obs_encoding` parameter).
+
+    If `relabel_strategy` is not None, the goals of a fraction of the Worker
+    samples in every batch are relabeled in hindsight when they are sampled,
+    and the Manager actions of these samples are replaced with the goal that
+    was achieved by the end of their meta period. This is equivalent to
+    storing a second, relabeled copy of every meta period, but without the
+    associated memory cost. As in the stored variant, the first `meta_ac_dim`
+    elements of the Worker observations are treated as the achieved goals,
+    and the final `meta_ac_dim` elements as the goals of the Worker.
+
+    If `correction_staleness` is not None, the goals computed by the off-policy
+    corrections of every meta period may be cached in the buffer (see the
+    `get_corrections` and `store_corrections` methods). Every cached goal is
+    stored along with the Manager action it was computed from and the number
+    of Worker updates (the version of the Worker policy) at the time, and is
+    only reused if the sampled Manager action matches and the Worker has been
+    updated at most `correction_staleness` times since. The cache is not
+    included in the snapshots of the buffer.
+
+    Attributes
+    ----------
+    meta_obs_t : np.ndarray
+        (buffer_size, meta_obs_dim) matrix of the initial Manager observation
+        of every meta period
+    meta_obs_tp1 : np.ndarray
+        (buffer_size, meta_obs_dim) matrix of the Manager observation at the
+        end of every meta period
+    meta_action_t : np.ndarray
+        (buffer_size, meta_ac_dim) matrix of Manager actions (goals)
+    meta_reward_t : np.ndarray
+        (buffer_size,) vector of Manager rewards
+    worker_obses_t : np.ndarray
+        (buffer_size, meta_period + 1, worker_obs_dim) array of the Worker
+        observations within every meta period
+    worker_actions_t : np.ndarray
+        (buffer_size, meta_period, worker_ac_dim) array of the Worker actions
+        within every meta period
+    worker_rewards_t : np.ndarray
+        (buffer_size, meta_period) matrix of the Worker rewards within every
+        meta period
+    worker_dones_t : np.ndarray
+        (buffer_size, meta_period) matrix of the done masks within every meta
+        period
+    lengths : np.ndarray
+        (buffer_size,) vector of the number of Worker actions stored in every
+        meta period. This may be less than the meta period if the episode
+        terminated before the meta period was met.
+    correction_staleness : int or None
+        the number of Worker updates after which cached off-policy corrections
+        are recomputed. None if the corrections are not cached.
+    correction_hits : int
+        the number of cached off-policy corrections that were reused
+    correction_lookups : int
+        the number of off-policy corrections that were looked up in the cache
+    """
 
     def __init__(self,
                  buffer_size,
@@ -15,7 +78,24 @@ class HierReplayBuffer(ReplayBuffer):
                  meta_obs_dim,
                  meta_ac_dim,
                  worker_obs_dim,
-                 worker_ac_dim):
+                 worker_ac_dim,
+                 prioritized=False,
+                 alpha=0.6,
+                 beta=0.4,
+                 eps=1e-6,
+                 storage="memory",
+                 buffer_dir=None,
+                 obs_encoding="float32",
+                 relabel_strategy=None,
+                 relabel_fraction=0.5,
+                 relative_goals=False,
+                 reward_fn=None,
+                 reward_scale=1.,
+                 meta_obs_low=None,
+                 meta_obs_high=None,
+                 worker_obs_low=None,
+                 worker_obs_high=None,
+                 correction_staleness=None):
         """Instantiate the hierarchical replay buffer.
 
         Parameters
@@ -25,6 +105,8 @@ class HierReplayBuffer(ReplayBuffer):
             overflows the old memories are dropped.
         batch_size : int
             number of elements that are to be returned as a batch
+        meta_period : int
+            manger action period
         meta_obs_dim : int
             number of elements in the Manager observations
         meta_ac_dim : int
@@ -33,16 +115,132 @@ class HierReplayBuffer(ReplayBuffer):
             number of elements in the Worker observations
         worker_ac_dim : int
             number of elements in the Worker actions
+        prioritized : bool
+            whether to sample meta periods in proportion to their priorities.
+            If set to True, the `sample` method additionally returns the
+            importance weights and the indices of the sampled meta periods.
+        alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization). Only used if `prioritized` is set to True.
+        beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction). Only used if `prioritized` is set to True.
+        eps : float
+            small positive term added to the priorities to ensure that every
+            element can be sampled. Only used if `prioritized` is set to True.
+        storage : str
+            the storage backend of the buffer, one of "memory", "memmap", or
+            "shared"
+        buffer_dir : str or None
+            the directory memory-mapped files are stored in. Not used if
+            `storage` is set to "memory".
+        obs_encoding : str
+            the encoding the Manager and Worker observations are stored in,
+            one of "float32", "float16", "uint8", or "uint16"
+        relabel_strategy : str or None
+            the strategy used to choose the hindsight goals of relabeled
+            samples, one of "final" (the goal achieved at the end of the meta
+            period) or "future" (the goal achieved at a random step after the
+            sampled step). If set to None, samples are not relabeled.
+        relabel_fraction : float
+            the fraction of the samples in every batch that are relabeled
+        relative_goals : bool
+            whether the goals are specified relative to the current
+            observation
+        reward_fn : function
+            the Worker reward function, used to compute the rewards of
+            relabeled samples. Takes as input (states, goals, next_states),
+            each with a leading batch dimension. Required if
+            `relabel_strategy` is not None.
+        reward_scale : float
+            the value that the outputs of `reward_fn` are scaled by
+        meta_obs_low : array_like or None
+            the lower bound of every element in the Manager observations. Used
+            to calibrate the "uint8" and "uint16" encodings.
+        meta_obs_high : array_like or None
+            the upper bound of every element in the Manager observations. Used
+            to calibrate the "uint8" and "uint16" encodings.
+        worker_obs_low : array_like or None
+            the lower bound of every element in the Worker observations. Used
+            to calibrate the "uint8" and "uint16" encodings.
+        worker_obs_high : array_like or None
+            the upper bound of every element in the Worker observations. Used
+            to calibrate the "uint8" and "uint16" encodings.
+        correction_staleness : int or None
+            the number of Worker updates after which cached off-policy
+            corrections are recomputed. If set to None, the corrections are
+            not cached.
         """
         super(HierReplayBuffer, self).__init__(
-            buffer_size, batch_size, worker_obs_dim, worker_ac_dim)
+            buffer_size=buffer_size,
+            batch_size=batch_size,
+            obs_dim=worker_obs_dim,
+            ac_dim=worker_ac_dim,
+            prioritized=prioritized,
+            alpha=alpha,
+            beta=beta,
+            eps=eps,
+            storage=storage,
+            buffer_dir=buffer_dir,
+            obs_encoding=obs_encoding,
+            obs_low=worker_obs_low,
+            obs_high=worker_obs_high,
+        )
+
+        if relabel_strategy not in [None, "final", "future"]:
+            raise ValueError(
+                "relabel_strategy must be one of None, 'final', or 'future', "
+                "not '{}'.".format(relabel_strategy))
 
         self._meta_period = meta_period
         self._worker_ob_dim = worker_obs_dim
         self._worker_ac_dim = worker_ac_dim
+        self._relabel_strategy = relabel_strategy
+        self._relabel_fraction = relabel_fraction
+        self._relative_goals = relative_goals
+        self._reward_fn = reward_fn
+        self._reward_scale = reward_scale
+
+        # The Worker observations are encoded by the encoder of the parent
+        # class, while the Manager observations have their own encoder.
+        self._obs_encoders["meta_obs"] = ObservationEncoder(
+            obs_encoding, meta_obs_dim, meta_obs_low, meta_obs_high)
+        meta_obs_dtype = self._obs_encoders["meta_obs"].dtype
+        worker_obs_dtype = self._obs_encoders["obs"].dtype
 
         # Used to store buffer data.
-        self._storage = [None for _ in range(buffer_size)]
+        zeros = self._allocator.zeros
+        self.meta_obs_t = zeros(
+            "meta_obs_t", (buffer_size, meta_obs_dim), dtype=meta_obs_dtype)
+        self.meta_obs_tp1 = zeros(
+            "meta_obs_tp1", (buffer_size, meta_obs_dim), dtype=meta_obs_dtype)
+        self.meta_action_t = zeros(
+            "meta_action_t", (buffer_size, meta_ac_dim))
+        self.meta_reward_t = zeros(
+            "meta_reward_t", (buffer_size,))
+        self.worker_obses_t = zeros(
+            "worker_obses_t", (buffer_size, meta_period + 1, worker_obs_dim),
+            dtype=worker_obs_dtype)
+        self.worker_actions_t = zeros(
+            "worker_actions_t", (buffer_size, meta_period, worker_ac_dim))
+        self.worker_rewards_t = zeros(
+            "worker_rewards_t", (buffer_size, meta_period))
+        self.worker_dones_t = zeros(
+            "worker_dones_t", (buffer_size, meta_period))
+        self.lengths = zeros("lengths", (buffer_size,), dtype=np.int32)
+
+        # Used to cache the off-policy corrections. These depend on the
+        # current Worker policy, and are therefore not stored by the allocator
+        # (i.e. in snapshots). A version of -1 denotes an empty entry.
+        self.correction_staleness = correction_staleness
+        self.correction_hits = 0
+        self.correction_lookups = 0
+        if correction_staleness is not None:
+            self._correction_goal = np.zeros(
+                (buffer_size, meta_ac_dim), dtype=np.float32)
+            self._correction_origin = np.zeros(
+                (buffer_size, meta_ac_dim), dtype=np.float32)
+            self._correction_version = np.full(buffer_size, -1, dtype=np.int64)
 
         # Variables that are used when returning samples
         self.meta_obs0 = np.zeros(
@@ -88,24 +286,118 @@ class HierReplayBuffer(ReplayBuffer):
               observation
             * meta_reward_t: the reward of the manager
         """
-        # Store the manager samples, then the worker samples.
-        data = (kwargs["meta_obs_t"], goal_t, kwargs["meta_reward_t"],
-                obs_t, action_t, reward_t, done)
+        idx = self._next_idx
+        n_steps = len(action_t)
+
+        # Encode the observations, if needed.
+        meta_obs0, meta_obs1 = self._encode_obs(
+            "meta_obs", ["meta_obs_t", "meta_obs_tp1"], *kwargs["meta_obs_t"])
+        obs_t, padding = self._encode_obs(
+            "obs", ["worker_obses_t"], obs_t, np.zeros(self._worker_ob_dim))
 
-        # Add the element to the list. If the list is already the max size of
-        # the replay buffer, then replace the oldest sample with this one.
-        self._storage[self._next_idx] = data
+        # Store the manager samples.
+        self.meta_obs_t[idx, :] = meta_obs0
+        self.meta_obs_tp1[idx, :] = meta_obs1
+        self.meta_action_t[idx, :] = goal_t
+        self.meta_reward_t[idx] = kwargs["meta_reward_t"]
+
+        # Store the worker samples. Any elements past the end of the current
+        # meta period are zeroed out, in case they contain data from a sample
+        # that was previously stored in this slot.
+        self.worker_obses_t[idx, :n_steps + 1, :] = obs_t
+        self.worker_obses_t[idx, n_steps + 1:, :] = padding
+        self.worker_actions_t[idx, :n_steps, :] = action_t
+        self.worker_actions_t[idx, n_steps:, :] = 0
+        self.worker_rewards_t[idx, :n_steps] = reward_t
+        self.worker_rewards_t[idx, n_steps:] = 0
+        self.worker_dones_t[idx, :n_steps] = done
+        self.worker_dones_t[idx, n_steps:] = 0
+        self.lengths[idx] = n_steps
+        self._init_priority(idx)
+        self._clear_corrections(idx)
 
         # Increment the next index and size terms
         self._next_idx = (self._next_idx + 1) % self._maxsize
         self._size = min(self._size + 1, self._maxsize)
+        self._num_added += 1
+
+    def add_batch(self, obs_t, goal_t, action_t, reward_t, done, lengths,
+                  **kwargs):
+        """Add a batch of meta periods to the buffer.
+
+        The meta periods are padded to `meta_period` steps, and stored in
+        order, as if they were added one at a time via the `add` method.
+
+        Parameters
+        ----------
+        obs_t : array_like
+            (n, meta_period + 1, worker_obs_dim) array of worker observations
+        goal_t : array_like
+            (n, meta_ac_dim) matrix of meta actions
+        action_t : array_like
+            (n, meta_period, worker_ac_dim) array of worker actions
+        reward_t : array_like
+            (n, meta_period) matrix of worker rewards
+        done : array_like
+            (n, meta_period) matrix of done masks
+        lengths : array_like
+            (n,) vector of the number of steps in every meta period. Any
+            elements past the end of a meta period are ignored.
+        kwargs : Any
+            additional parameters, including:
+
+            * meta_obs_t: a tuple of the (n, meta_obs_dim) matrices of manager
+              observations and next observations
+            * meta_reward_t: the (n,) vector of manager rewards
+        """
+        lengths = np.asarray(lengths)
+        idxes = (self._next_idx + np.arange(len(lengths))) % self._maxsize
+
+        # Encode the observations, if needed.
+        meta_obs0, meta_obs1 = self._encode_obs(
+            "meta_obs", ["meta_obs_t", "meta_obs_tp1"], *kwargs["meta_obs_t"])
+        obs_t, padding = self._encode_obs(
+            "obs", ["worker_obses_t"], obs_t, np.zeros(self._worker_ob_dim))
+
+        # Store the manager samples.
+        self.meta_obs_t[idxes, :] = meta_obs0
+        self.meta_obs_tp1[idxes, :] = meta_obs1
+        self.meta_action_t[idxes, :] = goal_t
+        self.meta_reward_t[idxes] = kwargs["meta_reward_t"]
+
+        # Store the worker samples. Any elements past the end of every meta
+        # period are zeroed out.
+        valid = np.arange(self._meta_period + 1) <= lengths[:, None]
+        self.worker_obses_t[idxes] = np.where(
+            valid[:, :, None], obs_t, padding)
+        valid = valid[:, :-1]
+        self.worker_actions_t[idxes] = np.where(
+            valid[:, :, None], action_t, 0)
+        self.worker_rewards_t[idxes] = np.where(valid, reward_t, 0)
+        self.worker_dones_t[idxes] = np.where(valid, done, 0)
+        self.lengths[idxes] = lengths
+        self._init_priority(idxes)
+        self._clear_corrections(idxes)
+
+        # Increment the next index and size terms
+        self._next_idx = int(idxes[-1] + 1) % self._maxsize
+        self._size = min(self._size + len(lengths), self._maxsize)
+        self._num_added += len(lengths)
+
+    def load(self, path):
+        """See parent class.
+
+        Any cached off-policy corrections are removed.
+        """
+        super(HierReplayBuffer, self).load(path)
+        self._clear_corrections(slice(None))
 
     def _encode_sample(self, idxes, **kwargs):
         """Return a sample from the replay buffer based on indices.
 
         Parameters
         ----------
-        idxes : list of int
+        idxes : array_like
             list of random indices
         kwargs : dict
             additional parameters, including:
@@ -141,67 +433,237 @@ class HierReplayBuffer(ReplayBuffer):
             additional information; used for features such as the off-policy
             corrections or centralized value functions
         """
+        idxes = np.asarray(idxes)
+        lengths = self.lengths[idxes]
+        meta_encoder = self._obs_encoders["meta_obs"]
+        worker_encoder = self._obs_encoders["obs"]
+        meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
+            worker_obs1, worker_act, worker_rew, worker_done = \
+            self._sample_outputs(len(idxes))
+
+        # Collect the Manager samples. The meta done value corresponds to the
+        # last done value of the meta period. Observations are decoded from
+        # their stored encoding.
+        meta_obs0[:] = meta_encoder.decode(self.meta_obs_t[idxes])
+        meta_obs1[:] = meta_encoder.decode(self.meta_obs_tp1[idxes])
+        np.take(self.meta_action_t, idxes, axis=0, out=meta_act)
+        np.take(self.meta_reward_t, idxes, out=meta_rew)
+        meta_done[:] = self.worker_dones_t[idxes, lengths - 1]
+
+        # Sample one obs0/obs1/action/reward from each of the chosen meta
+        # periods.
+        indx_val = (np.random.random_sample(len(idxes)) * lengths).astype(int)
+
+        # Collect the Worker samples. The (meta period, time step) indices are
+        # used directly instead of flattening the arrays, since the rows of
+        # memory-mapped arrays are padded and cannot be reshaped in place.
+        worker_obs0[:] = worker_encoder.decode(
+            self.worker_obses_t[idxes, indx_val])
+        worker_obs1[:] = worker_encoder.decode(
+            self.worker_obses_t[idxes, indx_val + 1])
+        worker_act[:] = self.worker_actions_t[idxes, indx_val]
+        worker_rew[:] = self.worker_rewards_t[idxes, indx_val]
+        worker_done.fill(0)  # see docstring
+
+        # Relabel the goals of a fraction of the samples in hindsight.
+        if self._relabel_strategy is not None:
+            self._relabel(idxes, lengths, indx_val, meta_act, worker_obs0,
+                          worker_obs1, worker_rew)
+
         # Do not encode additional information information in samples if it is
         # not needed. Waste of compute resources.
         if kwargs.get("with_additional", True):
             additional = {
-                "worker_obses": np.zeros(
-                    (self._batch_size, self._worker_ob_dim,
-                     self._meta_period + 1),
-                    dtype=np.float32),
-                "worker_actions": np.zeros(
-                    (self._batch_size, self._worker_ac_dim, self._meta_period),
-                    dtype=np.float32),
+                "worker_obses": worker_encoder.decode(
+                    self.worker_obses_t[idxes]).transpose((0, 2, 1)),
+                "worker_actions":
+                    self.worker_actions_t[idxes].transpose((0, 2, 1)),
+                "idxes": idxes,
             }
         else:
             additional = None
 
-        for i, indx in enumerate(idxes):
-            # Extract the elements of the sample.
-            meta_obs, meta_action, meta_reward, worker_obses, worker_actions, \
-                worker_rewards, worker_dones = self._storage[indx]
-
-            # Separate the current and next step meta observations.
-            meta_obs0, meta_obs1 = meta_obs
-
-            # The meta done value corresponds to the last done value.
-            meta_done = worker_dones[-1]
-
-            # Sample one obs0/obs1/action/reward from the list of per-meta-
-            # period variables.
-            indx_val = random.randint(0, len(worker_obses)-2)
-            worker_obs0 = worker_obses[indx_val]
-            worker_obs1 = worker_obses[indx_val + 1]
-            worker_action = worker_actions[indx_val]
-            worker_reward = worker_rewards[indx_val]
-            worker_done = 0  # see docstring
-
-            # Add the new sample to the list of returned samples.
-            self.meta_obs0[i, :] = np.array(meta_obs0, copy=False)
-            self.meta_obs1[i, :] = np.array(meta_obs1, copy=False)
-            self.meta_act[i, :] = np.array(meta_action, copy=False)
-            self.meta_rew[i] = np.array(meta_reward, copy=False)
-            self.meta_done[i] = np.array(meta_done, copy=False)
-            self.worker_obs0[i, :] = np.array(worker_obs0, copy=False)
-            self.worker_obs1[i, :] = np.array(worker_obs1, copy=False)
-            self.worker_act[i, :] = np.array(worker_action, copy=False)
-            self.worker_rew[i] = np.array(worker_reward, copy=False)
-            self.worker_done[i] = np.array(worker_done, copy=False)
-
-            if kwargs.get("with_additional", True):
-                for j in range(len(worker_obses)):
-                    additional["worker_obses"][i, :, j] = worker_obses[j]
-                for j in range(len(worker_actions)):
-                    additional["worker_actions"][i, :, j] = worker_actions[j]
-
-        return self.meta_obs0, \
-            self.meta_obs1, \
-            self.meta_act, \
-            self.meta_rew, \
-            self.meta_done, \
-            self.worker_obs0, \
-            self.worker_obs1, \
-            self.worker_act, \
-            self.worker_rew, \
-            self.worker_done, \
+        return meta_obs0, \
+            meta_obs1, \
+            meta_act, \
+            meta_rew, \
+            meta_done, \
+            worker_obs0, \
+            worker_obs1, \
+            worker_act, \
+            worker_rew, \
+            worker_done, \
             additional
+
+    @property
+    def correction_hit_rate(self):
+        """Return the fraction of off-policy corrections read from the cache.
+
+        This is 0 if no corrections have been looked up.
+        """
+        return self.correction_hits / max(self.correction_lookups, 1)
+
+    def get_corrections(self, idxes, meta_action, version):
+        """Return the cached off-policy corrections of sampled meta periods.
+
+        Parameters
+        ----------
+        idxes : array_like
+            (batch_size,) vector of the indices of the sampled meta periods
+        meta_action : array_like
+            (batch_size, meta_ac_dim) matrix of the sampled Manager actions
+        version : int
+            the number of updates the Worker policy has performed so far
+
+        Returns
+        -------
+        numpy.ndarray
+            (batch_size, meta_ac_dim) matrix of Manager actions, in which the
+            actions of cached meta periods are replaced by their corrections
+        numpy.ndarray
+            (batch_size,) boolean vector that is set to True for the meta
+            periods whose corrections are missing or stale, and should be
+            recomputed
+        """
+        idxes = np.asarray(idxes)
+        cached_version = self._correction_version[idxes]
+        hits = (cached_version >= 0) \
+            & (version - cached_version <= self.correction_staleness) \
+            & np.all(self._correction_origin[idxes] == meta_action, axis=1)
+
+        self.correction_hits += int(hits.sum())
+        self.correction_lookups += len(idxes)
+
+        meta_action = np.array(meta_action, dtype=np.float32)
+        meta_action[hits] = self._correction_goal[idxes[hits]]
+
+        return meta_action, ~hits
+
+    def store_corrections(self, idxes, meta_action, goals, version):
+        """Store the off-policy corrections of sampled meta periods.
+
+        Parameters
+        ----------
+        idxes : array_like
+            (n,) vector of the indices of the meta periods
+        meta_action : array_like
+            (n, meta_ac_dim) matrix of the Manager actions the corrections
+            were computed from
+        goals : array_like
+            (n, meta_ac_dim) matrix of the corrected Manager actions
+        version : int
+            the number of updates the Worker policy has performed so far
+        """
+        self._correction_goal[idxes] = goals
+        self._correction_origin[idxes] = meta_action
+        self._correction_version[idxes] = version
+
+    def _clear_corrections(self, idxes):
+        """Remove the cached corrections of replaced meta periods."""
+        if self.correction_staleness is not None:
+            self._correction_version[idxes] = -1
+
+    def _relabel(self,
+                 idxes,
+                 lengths,
+                 indx_val,
+                 meta_act,
+                 worker_obs0,
+                 worker_obs1,
+                 worker_rew):
+        """Relabel the goals of a random subset of the samples in hindsight.
+
+        The goals of the Worker samples are replaced with the goals achieved
+        at the step chosen by the relabeling strategy (or, for relative goals,
+        the difference between these and the current observation), and their
+        rewards are recomputed accordingly. The Manager actions are replaced
+        with the goals achieved by the end of their meta period. The samples
+        are modified in-place.
+
+        Parameters
+        ----------
+        idxes : np.ndarray
+            the indices of the sampled meta periods
+        lengths : np.ndarray
+            the number of Worker actions in every sampled meta period
+        indx_val : np.ndarray
+            the sampled step within every meta period
+        meta_act : np.ndarray
+            the sampled Manager actions
+        worker_obs0 : np.ndarray
+            the sampled Worker observations
+        worker_obs1 : np.ndarray
+            the sampled next Worker observations
+        worker_rew : np.ndarray
+            the sampled Worker rewards
+        """
+        relabel = np.random.random_sample(len(idxes)) < self._relabel_fraction
+        if not relabel.any():
+            return
+
+        goal_dim = meta_act.shape[1]
+        encoder = self._obs_encoders["obs"]
+        idxes = idxes[relabel]
+        lengths = lengths[relabel]
+        indx_val = indx_val[relabel]
+
+        # Choose the step whose achieved goal is used as the hindsight goal of
+        # the Worker. For the "future" strategy, this is a step between the
+        # sampled next observation and the end of the meta period.
+        if self._relabel_strategy == "final":
+            target = lengths
+        else:
+            target = indx_val + 1 + (np.random.random_sample(len(idxes)) *
+                                     (lengths - indx_val)).astype(int)
+
+        achieved = encoder.decode(
+            self.worker_obses_t[idxes, target])[:, :goal_dim]
+        final = encoder.decode(
+            self.worker_obses_t[idxes, lengths])[:, :goal_dim]
+        obs0 = worker_obs0[relabel]
+        obs1 = worker_obs1[relabel]
+
+        if self._relative_goals:
+            initial = encoder.decode(
+                self.worker_obses_t[idxes, 0])[:, :goal_dim]
+            goal0 = achieved - obs0[:, :goal_dim]
+            goal1 = achieved - obs1[:, :goal_dim]
+            meta_goal = final - initial
+        else:
+            goal0 = achieved
+            goal1 = achieved
+            meta_goal = final
+
+        obs0[:, -goal_dim:] = goal0
+        obs1[:, -goal_dim:] = goal1
+        worker_obs0[relabel] = obs0
+        worker_obs1[relabel] = obs1
+        worker_rew[relabel] = self._reward_scale * self._reward_fn(
+            obs0, goal0, obs1)
+        meta_act[relabel] = meta_goal
+
+    def _sample_outputs(self, n):
+        """Return the arrays that the samples are to be stored in.
+
+        If the number of samples matches the batch size, the preallocated
+        arrays are reused. Otherwise (e.g. in `sample_many`), new arrays are
+        created.
+        """
+        outputs = [
+            self.meta_obs0,
+            self.meta_obs1,
+            self.meta_act,
+            self.meta_rew,
+            self.meta_done,
+            self.worker_obs0,
+            self.worker_obs1,
+            self.worker_act,
+            self.worker_rew,
+            self.worker_done,
+        ]
+
+        if n == self._batch_size:
+            return outputs
+        else:
+            return [np.zeros((n,) + val.shape[1:], dtype=val.dtype)
+                    for val in outputs]
@@ -38,17 +38,33 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
                  layers,
                  act_fun,
                  use_huber,
+                 prioritized_replay,
+                 prioritized_replay_alpha,
+                 prioritized_replay_beta,
+                 prioritized_replay_eps,
+                 storage,
+                 buffer_dir,
+                 deduplicate_obs,
+                 obs_encoding,
+                 prefetch_batches,
+                 n_step,
                  meta_period,
                  worker_reward_scale,
                  relative_goals,
                  off_policy_corrections,
+                 in_graph_corrections,
+                 correction_staleness,
                  hindsight,
+                 lazy_hindsight,
+                 hindsight_strategy,
+                 hindsight_fraction,
                  connected_gradients,
                  cg_weights,
                  use_fingerprints,
                  fingerprint_range,
                  centralized_value_functions,
-                 env_name=""):
+                 env_name="",
+                 num_envs=1):
         """Instantiate the goal-conditioned hierarchical policy.
 
         Parameters
@@ -95,6 +111,50 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
             specifies whether to use the huber distance function as the loss
             for the critic. If set to False, the mean-squared error metric is
             used instead
+        prioritized_replay : bool
+            whether to use prioritized experience replay. See:
+            https://arxiv.org/abs/1511.05952
+        prioritized_replay_alpha : float
+            how much prioritization is used (0 - no prioritization, 1 - full
+            prioritization)
+        prioritized_replay_beta : float
+            to what degree to use importance weights (0 - no corrections, 1 -
+            full correction)
+        prioritized_replay_eps : float
+            small positive term added to the priorities to ensure that every
+            sample can be drawn
+        storage : str
+            the storage backend of the replay buffer, one of "memory" (in-RAM
+            numpy arrays) or "memmap" (numpy arrays memory-mapped to files in
+            `buffer_dir`)
+        buffer_dir : str or None
+            the directory memory-mapped replay buffer files are stored in. If
+            set to None, the default temporary directory is used. Only used if
+            `storage` is set to "memmap".
+        deduplicate_obs : bool
+            whether to store every observation in the replay buffer once,
+            instead of storing the observations and next observations
+            separately. This roughly halves the memory used by the
+            observations. Note that the hierarchical replay buffer already
+            stores every Worker observation once, so this only affects the
+            (unused) replay buffers of the Manager and Worker policies.
+        obs_encoding : str
+            the encoding observations are stored in within the replay buffer,
+            one of "float32", "float16", "uint8", or "uint16". The integer
+            encodings quantize every element of the observation affinely
+            between its bounds in the observation space or, if these are not
+            finite, its running minimum and maximum.
+        prefetch_batches : int
+            the number of minibatches that are sampled in advance by a
+            background thread, overlapping the sampling procedure with the
+            gradient updates. If set to 0, minibatches are sampled when they
+            are needed.
+        n_step : int
+            the number of consecutive transitions used to compute the target
+            values of the critic. If greater than 1, the discounted rewards of
+            up to `n_step` transitions (of the same episode) are summed, and
+            the value of the final next observation is discounted accordingly.
+            Only used by the feedforward policies.
         meta_period : int
             manger action period
         worker_reward_scale : float
@@ -105,9 +165,32 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
         off_policy_corrections : bool
             whether to use off-policy corrections during the update procedure.
             See: https://arxiv.org/abs/1805.08296
+        in_graph_corrections : bool
+            whether to perform the off-policy corrections within the
+            tensorflow graph, as part of the update operation of the Manager
+            policy. Only used if `off_policy_corrections` is set to True.
+        correction_staleness : int or None
+            the number of Worker updates after which the off-policy
+            corrections cached in the replay buffer are recomputed. If set to
+            None, the corrections are recomputed every time they are sampled.
+            Not used if the corrections are performed within the tensorflow
+            graph.
         hindsight : bool
             whether to include hindsight action and goal transitions in the
             replay buffer. See: https://arxiv.org/abs/1712.00948
+        lazy_hindsight : bool
+            whether to relabel the goals of the samples in hindsight when they
+            are sampled from the replay buffer, instead of storing a second,
+            relabeled copy of every meta period. Only used if `hindsight` is
+            set to True.
+        hindsight_strategy : str
+            the strategy used to choose the hindsight goals, one of "final"
+            (the goal achieved at the end of the meta period) or "future" (the
+            goal achieved at a random later step of the meta period). Only used
+            if `lazy_hindsight` is set to True.
+        hindsight_fraction : float
+            the fraction of the samples in every batch whose goals are
+            relabeled. Only used if `lazy_hindsight` is set to True.
         connected_gradients : bool
             whether to connect the graph between the manager and worker
         cg_weights : float
@@ -123,6 +206,10 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
         centralized_value_functions : bool
             specifies whether to use centralized value functions for the
             Manager and Worker critic functions
+        num_envs : int
+            the number of environments the policy interacts with in parallel.
+            The transitions of every environment are collected separately,
+            and the Manager issues goals for every environment independently.
         """
         super(GoalConditionedPolicy, self).__init__(
             sess=sess,
@@ -140,17 +227,33 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
             layers=layers,
             act_fun=act_fun,
             use_huber=use_huber,
+            prioritized_replay=prioritized_replay,
+            prioritized_replay_alpha=prioritized_replay_alpha,
+            prioritized_replay_beta=prioritized_replay_beta,
+            prioritized_replay_eps=prioritized_replay_eps,
+            storage=storage,
+            buffer_dir=buffer_dir,
+            deduplicate_obs=deduplicate_obs,
+            obs_encoding=obs_encoding,
+            prefetch_batches=prefetch_batches,
+            n_step=n_step,
             meta_period=meta_period,
             worker_reward_scale=worker_reward_scale,
             relative_goals=relative_goals,
             off_policy_corrections=off_policy_corrections,
+            in_graph_corrections=in_graph_corrections,
+            correction_staleness=correction_staleness,
             hindsight=hindsight,
+            lazy_hindsight=lazy_hindsight,
+            hindsight_strategy=hindsight_strategy,
+            hindsight_fraction=hindsight_fraction,
             connected_gradients=connected_gradients,
             cg_weights=cg_weights,
             use_fingerprints=use_fingerprints,
             fingerprint_range=fingerprint_range,
             centralized_value_functions=centralized_value_functions,
             env_name=env_name,
+            num_envs=num_envs,
             meta_policy=FeedForwardPolicy,
             worker_policy=FeedForwardPolicy,
             additional_params=dict(
@@ -160,6 +263,22 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
             ),
         )
 
+    def _inference_action(self, policy, scope, obs, apply_noise):
+        """See parent class.
+
+        The exploration noise is Gaussian, similar to the `get_action` method
+        of the policy.
+        """
+        with tf.compat.v1.variable_scope("{}/model".format(scope)):
+            action = policy.make_actor(obs, reuse=True, scope="pi")
+
+        # Add the exploration noise, and clip by bounds.
+        noise = tf.random.normal(tf.shape(action)) * policy.noise
+        action += tf.cast(apply_noise, tf.float32) * noise
+
+        return tf.clip_by_value(
+            action, policy.ac_space.low, policy.ac_space.high)
+
     # ======================================================================= #
     #                       Auxiliary methods for HIRO                        #
     # ======================================================================= #
@@ -188,78 +307,68 @@ class GoalConditionedPolicy(BaseGoalConditionedPolicy):
         -----
         * _sample_best_meta_action(self):
         """
-        fitness = []
         batch_size, goal_dim, num_samples = meta_actions.shape
         _, _, meta_period = worker_actions.shape
 
-        # Loop through the elements of the batch.
-        for i in range(batch_size):
-            # Extract the candidate goals for the current element in the batch.
-            # The worker observations and actions from the meta period of the
-            # current batch are also collected to compute the log-probability
-            # of a given candidate goal.
-            goals_per_sample = meta_actions[i, :, :].T
-            worker_obses_per_sample = worker_obses[i, :, :].T
-            worker_actions_per_sample = worker_actions[i, :, :].T
-
-            # This will be used to store the cumulative log-probabilities of a
-            # given candidate goal for the entire meta-period.
-            fitness_per_sample = np.zeros(num_samples)
-
-            # Create repeated representations of each worker observation for
-            # each candidate goal. The indexing of worker_obses_per_sample is
-            # meant to do the following:
-            #  1. We remove the last observation since it does not correspond
-            #     to any action for the current meta-period.
-            #  2. Since the worker observations contain the goal (context) for
-            #     the last `goal_dim` elements, these elements are removed to
-            #     only provide the environmental observation.
-            tiled_worker_obses_per_sample = np.tile(
-                worker_obses_per_sample[:-1, :-goal_dim],
-                (num_samples, 1)
-            )
-
-            # Create repeated representations of each candidate goal for each
-            # worker observation in a meta period.
-            tiled_goals_per_sample = np.tile(
-                goals_per_sample, meta_period).reshape(
-                (num_samples * meta_period, goal_dim))
-
-            # If relative goals are being used, update the later goals to match
-            # what they would be under the relative goals difference approach.
-            if self.relative_goals:
-                goal_diff = worker_obses_per_sample[:-1, :] - np.tile(
-                    worker_obses_per_sample[0, :], (meta_period, 1))
-                tiled_goals_per_sample += \
-                    np.tile(goal_diff, (num_samples, 1))[:, :goal_dim]
-
-            # Compute the actions the Worker would perform given a specific
-            # observation/goal for the current instantiation of the policy.
-            pred_actions = self.worker.get_action(
-                tiled_worker_obses_per_sample,
-                tiled_goals_per_sample,
-                apply_noise=False,
-                random_actions=False
-            )
-
-            # Compute error as the distance between expected and actual actions
-            normalized_error = -np.mean(
-                np.square(
-                    np.tile(worker_actions_per_sample, (num_samples, 1))
-                    - pred_actions
-                ),
-                axis=1
-            )
-
-            # Sum the different normalized errors to get the fitness of each
-            # candidate goal.
-            for j in range(num_samples):
-                fitness_per_sample[j] = np.sum(
-                    normalized_error[j * meta_period: (j+1) * meta_period])
-
-            fitness.append(fitness_per_sample)
-
-        return np.array(fitness)
+        # Collect the (batch_size, meta_period, obs_dim) environmental
+        # observations of every meta period. The indexing of worker_obses is
+        # meant to do the following:
+        #  1. We remove the last observation since it does not correspond to
+        #     any action for the current meta-period.
+        #  2. Since the worker observations contain the goal (context) for the
+        #     last `goal_dim` elements, these elements are removed to only
+        #     provide the environmental observation.
+        obs = worker_obses[:, :-goal_dim, :-1].transpose((0, 2, 1))
+
+        # Create (batch_size, num_samples, meta_period, goal_dim) repeated
+        # representations of each candidate goal for each worker observation
+        # in a meta period.
+        goals = np.repeat(
+            meta_actions.transpose((0, 2, 1))[:, :, None, :],
+            meta_period, axis=2)
+
+        # If relative goals are being used, update the later goals to match
+        # what they would be under the relative goals difference approach.
+        if self.relative_goals:
+            goal_diff = worker_obses[:, :goal_dim, :-1] - \
+                worker_obses[:, :goal_dim, :1]
+            goals = goals + goal_diff.transpose((0, 2, 1))[:, None, :, :]
+
+        # Compute the actions the Worker would perform given a specific
+        # observation/goal for the current instantiation of the policy. This
+        # is done for all elements of the batch and candidate goals at once.
+        pred_actions = self.worker.get_action(
+            np.repeat(obs[:, None, :, :], num_samples, axis=1).reshape(
+                (batch_size * num_samples * meta_period, -1)),
+            goals.reshape((batch_size * num_samples * meta_period, goal_dim)),
+            apply_noise=False,
+            random_actions=False
+        ).reshape((batch_size, num_samples, meta_period, -1))
+
+        # Compute error as the distance between expected and actual actions.
+        normalized_error = -np.mean(
+            np.square(
+                worker_actions.transpose((0, 2, 1))[:, None, :, :]
+                - pred_actions
+            ),
+            axis=3
+        )
+
+        # Sum the different normalized errors to get the fitness of each
+        # candidate goal.
+        return np.sum(normalized_error, axis=2)
+
+    def _worker_log_probs(self, obs, actions):
+        """See parent class.
+
+        Similar to `_log_probs`, the log-probabilities are approximated by the
+        negative squared distance between the actions and the actions of the
+        Worker policy.
+        """
+        with tf.compat.v1.variable_scope("Worker/model"):
+            pred_actions = self.worker.make_actor(obs, reuse=True, scope="pi")
+
+        return -tf.reduce_mean(tf.square(actions - pred_actions), axis=1)
 
     # ======================================================================= #
     #                      Auxiliary methods for HRL-CG                       #
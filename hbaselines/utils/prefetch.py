@@ -0,0 +1,177 @@
+"""Utility methods for sampling replay buffer minibatches in the background.
+
+While the gradient updates of a policy are computed by tensorflow, the Python
+thread of the training procedure sits idle. The `ReplayPrefetcher` object
+uses this time to sample (and decode) the next minibatches in a background
+thread, so that sampling is overlapped with the gradient updates instead of
+being performed serially between them.
+"""
+import queue
+import threading
+
+import numpy as np
+
+
+class ReplayPrefetcher(object):
+    """Samples minibatches from a replay buffer in a background thread.
+
+    The sampled minibatches are placed in a bounded queue holding up to
+    `num_batches` minibatches. Once the queue is full, the background thread
+    waits until a minibatch is consumed via the `get` method.
+
+    Some replay buffers (e.g. HierReplayBuffer) reuse the same arrays for
+    every sample they return. The samples are therefore copied into a ring of
+    `num_batches + 2` sets of output arrays: one per queued minibatch, one for
+    the minibatch that is currently being sampled, and one for the minibatch
+    that was last returned by `get`. A minibatch returned by `get` is thus
+    only valid until the next call to `get`.
+
+    Accesses to the replay buffer from the background thread are guarded by
+    the `lock` attribute of the replay buffer. Any modifications of the replay
+    buffer (e.g. `add` or `update_priorities`) should hold this lock as well.
+
+    Note that the prefetched minibatches do not include samples that were
+    added to the replay buffer after the minibatches were sampled, and, for
+    prioritized replay buffers, do not reflect any priorities that were
+    updated in the meantime.
+
+    Attributes
+    ----------
+    replay_buffer : hbaselines.fcnet.replay_buffer.ReplayBuffer
+        the replay buffer that minibatches are sampled from
+    num_batches : int
+        the maximum number of minibatches that are sampled in advance
+    """
+
+    def __init__(self, replay_buffer, num_batches, **kwargs):
+        """Instantiate the prefetcher.
+
+        The background thread is not started until the first call to `get`.
+
+        Parameters
+        ----------
+        replay_buffer : hbaselines.fcnet.replay_buffer.ReplayBuffer
+            the replay buffer that minibatches are sampled from
+        num_batches : int
+            the maximum number of minibatches that are sampled in advance
+        kwargs : dict
+            additional arguments that are passed to the `sample` method of the
+            replay buffer
+        """
+        if num_batches < 1:
+            raise ValueError("num_batches must be positive, not {}.".format(
+                num_batches))
+
+        self.replay_buffer = replay_buffer
+        self.num_batches = num_batches
+        self._kwargs = kwargs
+        self._queue = queue.Queue(maxsize=num_batches)
+        self._outputs = [None] * (num_batches + 2)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self):
+        """Return the next minibatch.
+
+        This should only be called once the replay buffer can be sampled
+        from.
+
+        Returns
+        -------
+        tuple
+            the same terms as returned by the `sample` method of the replay
+            buffer. These are only valid until the next call to this method.
+
+        Raises
+        ------
+        Exception
+            any exception raised by the replay buffer in the background thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+        samples = self._queue.get()
+        if isinstance(samples, Exception):
+            self._thread = None
+            raise samples
+
+        return samples
+
+    def close(self):
+        """Stop the background thread and discard any prefetched minibatches.
+
+        The background thread is restarted by the next call to `get`.
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+        # Discard any minibatches that were added before the thread stopped.
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        self._thread = None
+        self._stop.clear()
+
+    def _run(self):
+        """Sample minibatches until the prefetcher is closed."""
+        slot = 0
+        try:
+            while not self._stop.is_set():
+                with self.replay_buffer.lock:
+                    samples = self.replay_buffer.sample(**self._kwargs)
+                    samples = self._copy(samples, self._outputs[slot])
+                self._outputs[slot] = samples
+                slot = (slot + 1) % len(self._outputs)
+
+                # Wait for space in the queue, while checking periodically
+                # whether the prefetcher has been closed.
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(samples, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as e:
+            self._queue.put(e)
+
+    def _copy(self, src, dst):
+        """Copy a (nested) set of samples into a set of output arrays.
+
+        Parameters
+        ----------
+        src : tuple or dict or np.ndarray or None
+            the samples
+        dst : tuple or dict or np.ndarray or None
+            the output arrays. New arrays are created if this is set to None,
+            or if the shapes or data types of the samples have changed.
+
+        Returns
+        -------
+        tuple or dict or np.ndarray or None
+            the output arrays, containing a copy of the samples
+        """
+        if src is None:
+            return None
+        elif isinstance(src, dict):
+            return {key: self._copy(src[key], None if dst is None else
+                                    dst.get(key))
+                    for key in src.keys()}
+        elif isinstance(src, (tuple, list)):
+            if dst is None or len(dst) != len(src):
+                dst = [None] * len(src)
+            return tuple(self._copy(s, d) for s, d in zip(src, dst))
+        elif dst is None or dst.shape != np.shape(src) \
+                or dst.dtype != np.asarray(src).dtype:
+            return np.array(src)
+        else:
+            np.copyto(dst, src)
+            return dst
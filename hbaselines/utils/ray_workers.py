@@ -0,0 +1,279 @@
+"""Utility methods for collecting samples with distributed rollout workers.
+
+For environments whose simulation dominates the cost of training (e.g. the
+SUMO-based Flow environments), samples may be collected by multiple Ray
+actors, each holding its own copy of the environment and the policy. The
+actors may be distributed over the nodes of a Ray cluster. The
+`RolloutWorker` object implements the operations of a single actor, and is
+wrapped into a Ray actor via `create_rollout_workers`.
+"""
+import random
+
+import numpy as np
+import ray
+import tensorflow as tf
+
+from hbaselines.utils.misc import create_env
+from hbaselines.utils.tf_util import make_session
+
+
+class RolloutWorker(object):
+    """Collects samples from an environment with a local copy of a policy.
+
+    The samples are not stored in the replay buffer of the local policy, but
+    are returned by the `collect` method in batches. They are nonetheless
+    provided to the `store_transition` method of the local policy, with
+    `evaluate` set to True, so that policies with internal state (e.g. the
+    meta periods of goal-conditioned policies) are updated accordingly.
+
+    Attributes
+    ----------
+    env : gym.Env
+        the training environment
+    horizon : int
+        the time horizon of the environment. Used to compute the
+        `is_final_step` term of every sample.
+    graph : tf.Graph
+        the graph of the local policy
+    sess : tf.compat.v1.Session
+        the session of the local policy
+    policy_tf : hbaselines.fcnet.base.ActorCriticPolicy
+        the local copy of the policy
+    obs : array_like
+        the most recent observation of the environment
+    episode_step : int
+        the number of steps since the most recent rollout began
+    episode_reward : float
+        the cumulative reward since the most recent rollout began
+    """
+
+    def __init__(self,
+                 env,
+                 policy,
+                 observation_space,
+                 action_space,
+                 context_space,
+                 horizon,
+                 policy_kwargs,
+                 render=False):
+        """Instantiate the worker.
+
+        Parameters
+        ----------
+        env : str or gym.Env
+            the environment, or the name of a registered environment
+        policy : type [ hbaselines.fcnet.base.ActorCriticPolicy ]
+            the policy model to use
+        observation_space : gym.spaces.*
+            the observation space of the environment
+        action_space : gym.spaces.*
+            the action space of the environment
+        context_space : gym.spaces.* or None
+            the context space of the environment
+        horizon : int
+            the time horizon of the environment
+        policy_kwargs : dict
+            policy-specific hyperparameters
+        render : bool
+            whether to render the environment
+        """
+        self.env = create_env(env, render, evaluate=False)
+        self.horizon = horizon
+        self.render = render
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = make_session(num_cpu=1, graph=self.graph)
+
+            self.policy_tf = policy(
+                self.sess,
+                observation_space,
+                action_space,
+                context_space,
+                **policy_kwargs
+            )
+
+            # Create the operation that assigns the weights of the trained
+            # policy to the local policy.
+            self._weights_ph = []
+            assign_ops = []
+            for var in tf.compat.v1.get_collection(
+                    tf.compat.v1.GraphKeys.TRAINABLE_VARIABLES):
+                ph = tf.compat.v1.placeholder(var.dtype.base_dtype, var.shape)
+                self._weights_ph.append(ph)
+                assign_ops.append(tf.compat.v1.assign(var, ph))
+            self._assign_op = tf.group(*assign_ops)
+
+            with self.sess.as_default():
+                self.sess.run(tf.compat.v1.global_variables_initializer())
+                self.policy_tf.initialize()
+
+        self.obs = self.env.reset()
+        self.episode_step = 0
+        self.episode_reward = 0.
+
+    def seed(self, seed):
+        """Set the seed of the worker's random number generators.
+
+        Parameters
+        ----------
+        seed : int
+            the seed value
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+        if hasattr(self.env, "seed"):
+            self.env.seed(seed)
+
+    def set_weights(self, weights):
+        """Assign the weights of the trained policy to the local policy.
+
+        Parameters
+        ----------
+        weights : list of np.ndarray
+            the values of the trainable variables of the trained policy, in
+            the order in which they were created
+        """
+        self.sess.run(
+            self._assign_op,
+            feed_dict=dict(zip(self._weights_ph, weights)))
+
+    def collect(self, num_steps, random_actions=False):
+        """Collect samples from the environment.
+
+        The environment is reset once its episode is done.
+
+        Parameters
+        ----------
+        num_steps : int
+            the number of samples to collect
+        random_actions : bool
+            if set to True, actions are sampled randomly from the action space
+            instead of being computed by the policy. This is used for
+            exploration purposes.
+
+        Returns
+        -------
+        dict
+            the samples, with one element per step in every array:
+
+            * "obs0", "action", "reward", "obs1", "done", "is_final_step":
+              the terms of every sample (see the `store_transition` method of
+              the policies)
+            * "context0", "context1": the contextual terms of every sample, or
+              None if no context is provided by the environment
+            * "meta_action": the Manager actions of every sample, for
+              goal-conditioned policies. None otherwise.
+            * "q1", "q2": the critic values of every sample
+
+            In addition, "episode_rewards" and "episode_steps" contain the
+            returns and lengths of the episodes that were completed.
+        """
+        samples = {key: [] for key in [
+            "obs0", "context0", "action", "reward", "obs1", "context1",
+            "done", "is_final_step", "meta_action", "q1", "q2"]}
+        episode_rewards = []
+        episode_steps = []
+
+        for _ in range(num_steps):
+            # Collect the contextual term. None if it is not passed.
+            context = [self.env.current_context] \
+                if hasattr(self.env, "current_context") else None
+
+            # Predict the next action.
+            obs = np.array(self.obs).reshape(
+                (1,) + self.env.observation_space.shape)
+            action = self.policy_tf.get_action(
+                obs, context,
+                apply_noise=True,
+                random_actions=random_actions)
+            q1_value, q2_value = self.policy_tf.value(obs, context, action)
+            action = action.flatten()
+
+            # Execute the next action.
+            new_obs, reward, done, _ = self.env.step(action)
+
+            # Visualize the current step.
+            if self.render:
+                self.env.render()  # pragma: no cover
+
+            # Get the contextual term.
+            context0 = context1 = getattr(self.env, "current_context", None)
+            is_final_step = self.episode_step >= self.horizon - 1
+
+            # Update the internal state of the local policy.
+            self.policy_tf.store_transition(
+                self.obs, context0, action, reward, new_obs, context1, done,
+                is_final_step, evaluate=True)
+
+            samples["obs0"].append(self.obs)
+            samples["context0"].append(context0)
+            samples["action"].append(action)
+            samples["reward"].append(reward)
+            samples["obs1"].append(new_obs)
+            samples["context1"].append(context1)
+            samples["done"].append(done)
+            samples["is_final_step"].append(is_final_step)
+            samples["meta_action"].append(
+                getattr(self.policy_tf, "meta_action", None))
+            samples["q1"].append(q1_value)
+            samples["q2"].append(q2_value)
+
+            # Book-keeping.
+            self.episode_reward += reward
+            self.episode_step += 1
+            self.obs = new_obs.copy()
+
+            if done:
+                episode_rewards.append(self.episode_reward)
+                episode_steps.append(self.episode_step)
+                self.episode_reward = 0.
+                self.episode_step = 0
+                self.obs = self.env.reset()
+
+        # Stack the terms of every step. The scalar terms are stored in
+        # vectors, and all other terms in matrices.
+        scalars = ["reward", "done", "is_final_step", "q1", "q2"]
+        samples = {
+            key: np.array(val).flatten() if key in scalars
+            else self._stack(val)
+            for key, val in samples.items()
+        }
+        samples["episode_rewards"] = episode_rewards
+        samples["episode_steps"] = episode_steps
+
+        return samples
+
+    @staticmethod
+    def _stack(values):
+        """Stack the values of every step into a matrix, if available."""
+        if values[0] is None:
+            return None
+        return np.stack([np.asarray(v).flatten() for v in values])
+
+
+def create_rollout_workers(num_workers, **kwargs):
+    """Create Ray actors that collect samples with a copy of a policy.
+
+    If Ray has not been initialized, a local Ray cluster is started. In order
+    to distribute the workers over multiple nodes, connect to an existing
+    cluster via `ray.init` before calling this method.
+
+    Parameters
+    ----------
+    num_workers : int
+        the number of workers
+    kwargs : dict
+        the arguments of every `RolloutWorker` object
+
+    Returns
+    -------
+    list of ray.actor.ActorHandle
+        the handles of the remote `RolloutWorker` objects
+    """
+    if not ray.is_initialized():
+        ray.init()
+
+    remote_worker = ray.remote(num_cpus=1)(RolloutWorker)
+
+    return [remote_worker.remote(**kwargs) for _ in range(num_workers)]
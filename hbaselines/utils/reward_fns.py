@@ -6,6 +6,8 @@ policies.
 
 All reward functions here return new rewards and discounts.
 """
+import threading
+
 import numpy as np
 
 
@@ -26,11 +28,15 @@ def negative_distance(states,
     Parameters
     ----------
     states : array_like
-        A (num_state_dims,) array representing a batch of states.
+        A (num_state_dims,) array representing a state, or a
+        (batch_size, num_state_dims) array representing a batch of states.
     next_states : array_like
-        A (num_state_dims,) array representing a batch of next states.
+        A (num_state_dims,) array representing a next state, or a
+        (batch_size, num_state_dims) array representing a batch of next
+        states.
     goals : array_like
-        A (num_context_dims,) array representing a batch of contexts.
+        A (num_context_dims,) array representing a context, or a
+        (batch_size, num_context_dims) array representing a batch of contexts.
     state_scales : float
         multiplicative scale for (next) states
     goal_scales : float
@@ -61,10 +67,10 @@ def negative_distance(states,
     """
     # Get the indexed versions of the states and goals.
     if state_indices is not None:
-        states = states[state_indices]
-        next_states = next_states[state_indices]
+        states = states[..., state_indices]
+        next_states = next_states[..., state_indices]
     if goal_indices is not None:
-        goals = goals[goal_indices]
+        goals = goals[..., goal_indices]
 
     # Check for relative context.
     if relative_context:
@@ -76,7 +82,154 @@ def negative_distance(states,
     dist = np.sum(sq_dists, -1)
     dist = np.sqrt(dist + epsilon)
 
-    bonus = float(dist < bonus_epsilon)
+    bonus = np.asarray(dist < bonus_epsilon, dtype=np.float64)
     dist *= reward_scales
 
     return bonus + offset - dist
+
+
+class NegativeDistance(object):
+    """Batched variant of `negative_distance` with fixed parameters.
+
+    Instances are called as `reward_fn(states, goals, next_states)`, where
+    every input is either a single (1-D) element or a (batch_size, dim) batch
+    of elements, and return the same values as `negative_distance`. This
+    allows the rewards of entire batches or meta periods to be computed at
+    once.
+
+    The state and goal indices are converted to slices (if contiguous) or to
+    integer arrays once, and the intermediate terms are computed in
+    preallocated buffers that are reused by every call with the same batch
+    size, so that only the returned rewards are allocated. The buffers are
+    separate for every thread.
+
+    Attributes
+    ----------
+    state_indices : slice or np.ndarray or None
+        the precomputed state indices
+    goal_indices : slice or np.ndarray or None
+        the precomputed goal indices
+    max_buffers : int
+        the maximum number of buffers that are stored at a time
+    """
+
+    max_buffers = 64
+
+    def __init__(self,
+                 state_scales=1.0,
+                 goal_scales=1.0,
+                 reward_scales=1.0,
+                 state_indices=None,
+                 goal_indices=None,
+                 relative_context=False,
+                 epsilon=1e-10,
+                 bonus_epsilon=0.,
+                 offset=0.0):
+        """Instantiate the reward function.
+
+        See `negative_distance` for a description of the parameters.
+        """
+        self.state_scales = state_scales
+        self.goal_scales = goal_scales
+        self.reward_scales = reward_scales
+        self.state_indices = self._precompute_indices(state_indices)
+        self.goal_indices = self._precompute_indices(goal_indices)
+        self.relative_context = relative_context
+        self.epsilon = epsilon
+        self.bonus_epsilon = bonus_epsilon
+        self.offset = offset
+
+        # (thread, shape) -> intermediate buffers
+        self._buffers = {}
+
+    @staticmethod
+    def _precompute_indices(indices):
+        """Return a slice (or integer array) equivalent to a list of indices.
+
+        Slices of contiguous (or evenly spaced) indices return views of the
+        inputs, and do not require any allocation.
+        """
+        if indices is None:
+            return None
+
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0 or np.any(indices < 0):
+            return indices
+
+        steps = np.diff(indices)
+        step = int(steps[0]) if len(steps) > 0 else 1
+        if step > 0 and np.all(steps == step):
+            return slice(int(indices[0]), int(indices[-1]) + 1, step)
+
+        return indices
+
+    def _get_buffers(self, shape):
+        """Return the intermediate buffers for a given shape."""
+        key = (threading.get_ident(), shape)
+        if key not in self._buffers:
+            # Bound the number of buffers when the batch sizes vary (e.g. the
+            # number of samples relabeled in hindsight).
+            if len(self._buffers) >= self.max_buffers:
+                self._buffers.clear()
+            self._buffers[key] = (np.empty(shape), np.empty(shape))
+        return self._buffers[key]
+
+    def __call__(self, states, goals, next_states):
+        """Return the negative euclidean distance of next_states and goals.
+
+        Parameters
+        ----------
+        states : array_like
+            a (num_state_dims,) array representing a state, or a
+            (batch_size, num_state_dims) array representing a batch of states
+        goals : array_like
+            a (num_context_dims,) array representing a context, or a
+            (batch_size, num_context_dims) array representing a batch of
+            contexts
+        next_states : array_like
+            a (num_state_dims,) array representing a next state, or a
+            (batch_size, num_state_dims) array representing a batch of next
+            states
+
+        Returns
+        -------
+        float or array_like
+            the reward, or the rewards for each element in the batch
+        """
+        next_states = np.asarray(next_states)
+        single = next_states.ndim == 1
+        states = np.atleast_2d(states)
+        goals = np.atleast_2d(goals)
+        next_states = np.atleast_2d(next_states)
+
+        # Get the indexed versions of the states and goals.
+        if self.state_indices is not None:
+            states = states[..., self.state_indices]
+            next_states = next_states[..., self.state_indices]
+        if self.goal_indices is not None:
+            goals = goals[..., self.goal_indices]
+
+        diff, scaled_goals = self._get_buffers(next_states.shape)
+
+        # Check for relative context.
+        if self.relative_context:
+            np.add(states, goals, out=scaled_goals)
+            scaled_goals *= self.goal_scales
+        else:
+            np.multiply(goals, self.goal_scales, out=scaled_goals)
+
+        np.multiply(next_states, self.state_scales, out=diff)
+        diff -= scaled_goals
+
+        # Apply the L2 norm.
+        dist = np.einsum("ij,ij->i", diff, diff)
+        dist += self.epsilon
+        np.sqrt(dist, out=dist)
+
+        # The bonus is only computed if it can be non-zero.
+        bonus = dist < self.bonus_epsilon if self.bonus_epsilon > 0 else 0
+        dist *= self.reward_scales
+        np.subtract(self.offset, dist, out=dist)
+        dist += bonus
+
+        return dist[0] if single else dist
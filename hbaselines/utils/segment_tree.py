@@ -0,0 +1,139 @@
+"""Array-based segment trees used by the prioritized replay buffers.
+
+The trees are stored as a single flat numpy array, with the root at index 1
+and the children of node i located at indices 2i and 2i+1. The leaves occupy
+the second half of the array. All batched operations are vectorized across the
+elements of the batch and loop only over the levels of the tree, resulting in
+O(log N) numpy calls per operation regardless of the batch size.
+"""
+import numpy as np
+
+
+class SegmentTree(object):
+    """Base segment tree object.
+
+    Attributes
+    ----------
+    capacity : int
+        number of leaves in the tree. This is the requested capacity rounded up
+        to the nearest power of two.
+    """
+
+    def __init__(self, capacity, operation, neutral_element):
+        """Instantiate the segment tree.
+
+        Parameters
+        ----------
+        capacity : int
+            the minimum number of elements the tree must be able to store
+        operation : numpy.ufunc
+            the (associative) operation used to combine two nodes of the tree,
+            e.g. np.add or np.minimum
+        neutral_element : float
+            the neutral element of the operation, e.g. 0 for np.add or inf for
+            np.minimum. Unset leaves are assigned this value.
+        """
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+
+        self._operation = operation
+        self._value = np.full(
+            2 * self.capacity, neutral_element, dtype=np.float64)
+
+    def reduce(self):
+        """Return the result of the operation over all elements."""
+        return self._value[1]
+
+    def __setitem__(self, idx, val):
+        """Set the value of one or more leaves, and update their ancestors.
+
+        Parameters
+        ----------
+        idx : int or array_like
+            the index (or indices) of the leaves
+        val : float or array_like
+            the new value(s) of the leaves
+        """
+        if np.ndim(idx) == 0:
+            # Fast path for single elements, which are set every time a sample
+            # is added to the replay buffer.
+            idx = int(idx) + self.capacity
+            self._value[idx] = val
+            idx //= 2
+            while idx >= 1:
+                self._value[idx] = self._operation(
+                    self._value[2 * idx], self._value[2 * idx + 1])
+                idx //= 2
+        else:
+            idx = np.asarray(idx) + self.capacity
+            self._value[idx] = val
+
+            # Update the parents of the modified nodes one level at a time.
+            # Since all leaves are located at the same depth, all modified
+            # nodes at a given iteration are located at the same level as well.
+            idx = np.unique(idx // 2)
+            while idx[0] >= 1:
+                self._value[idx] = self._operation(
+                    self._value[2 * idx], self._value[2 * idx + 1])
+                idx = np.unique(idx // 2)
+
+    def __getitem__(self, idx):
+        """Return the value of one or more leaves."""
+        return self._value[np.asarray(idx) + self.capacity]
+
+
+class SumSegmentTree(SegmentTree):
+    """Segment tree where every node is the sum of its children."""
+
+    def __init__(self, capacity):
+        """See parent class."""
+        super(SumSegmentTree, self).__init__(
+            capacity=capacity,
+            operation=np.add,
+            neutral_element=0.0
+        )
+
+    def find_prefixsum_idx(self, prefixsum):
+        """Find the highest indices whose prefix sums are below some values.
+
+        For every element in `prefixsum`, this returns the highest index i such
+        that sum(arr[0] + ... + arr[i - 1]) <= prefixsum, where arr is the
+        array of leaves. If all leaves are non-negative, this can be used to
+        sample indices with probabilities proportional to their values.
+
+        Parameters
+        ----------
+        prefixsum : array_like
+            the upper bounds on the sums of the prefixes, one per element in
+            the batch
+
+        Returns
+        -------
+        np.ndarray
+            the indices satisfying the above condition
+        """
+        mass = np.array(prefixsum, dtype=np.float64, copy=True, ndmin=1)
+        idx = np.ones(mass.shape[0], dtype=np.int64)
+
+        # Descend the tree one level at a time for all elements of the batch.
+        while idx[0] < self.capacity:
+            left = 2 * idx
+            left_val = self._value[left]
+            go_right = mass > left_val
+            mass -= np.where(go_right, left_val, 0.)
+            idx = left + go_right
+
+        return idx - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    """Segment tree where every node is the minimum of its children."""
+
+    def __init__(self, capacity):
+        """See parent class."""
+        super(MinSegmentTree, self).__init__(
+            capacity=capacity,
+            operation=np.minimum,
+            neutral_element=float('inf')
+        )
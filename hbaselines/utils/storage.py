@@ -0,0 +1,452 @@
+"""Utility methods for allocating the arrays of the replay buffers.
+
+Three storage backends are supported:
+
+* "memory": arrays are allocated as regular in-RAM numpy arrays.
+* "memmap": arrays are backed by files on disk via np.memmap. The resident
+  memory is then bounded by the OS page cache instead of the capacity of the
+  buffer, allowing for buffers that do not fit in RAM.
+* "shared": arrays are backed by files in the shared memory filesystem of the
+  system (/dev/shm, if available). These are never written to disk, and can be
+  mapped by other processes (see `ArrayAllocator.attach`), allowing for
+  buffers that are written and read by different processes without copying
+  or pickling their content.
+
+For the "memmap" and "shared" backends, every array is stored in a separate
+file (starting at a page boundary), and the rows of each array are padded such
+that their size in bytes is either a power of two smaller than a page or a
+multiple of the page size. As a result, no row straddles more pages than
+necessary, and gathering a random minibatch of rows touches as few pages as
+possible.
+
+This script also contains the methods used to write and read snapshots of
+these arrays (see `save_snapshot` and `load_snapshot`), and to store the
+observations in a compact encoding (see `ObservationEncoder`).
+"""
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+# The storage backends that are currently supported.
+STORAGE_TYPES = ["memory", "memmap", "shared"]
+
+# The directory the shared memory filesystem is mounted to. This is the same
+# directory that POSIX shared memory segments are created in on Linux.
+SHARED_MEMORY_DIR = "/dev/shm"
+
+# The observation encodings that are currently supported, and the data types
+# they are stored as.
+OBS_ENCODINGS = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "uint8": np.uint8,
+    "uint16": np.uint16,
+}
+
+
+def aligned_row_size(row_bytes, page_size=mmap.PAGESIZE):
+    """Return the number of bytes a row should occupy in a memory map.
+
+    Rows smaller than a page are padded to the nearest power of two, so that
+    a page contains an integer number of rows. Larger rows are padded to a
+    multiple of the page size.
+
+    Parameters
+    ----------
+    row_bytes : int
+        the number of bytes in a row
+    page_size : int
+        the size of a memory page, in bytes
+
+    Returns
+    -------
+    int
+        the padded number of bytes in a row
+    """
+    if row_bytes >= page_size:
+        return -(-row_bytes // page_size) * page_size
+
+    padded = 1
+    while padded < row_bytes:
+        padded *= 2
+    return padded
+
+
+class ArrayAllocator(object):
+    """Allocates the (zero-initialized) arrays of a replay buffer.
+
+    Attributes
+    ----------
+    storage : str
+        the storage backend, one of "memory", "memmap", or "shared"
+    path : str or None
+        the directory the memory-mapped files are stored in. Set to None if
+        the arrays are stored in memory.
+    attached : bool
+        whether the allocator maps the arrays of another allocator (see
+        `attach`) instead of creating new ones
+    names : list of str
+        the names of all arrays allocated so far
+    """
+
+    def __init__(self, storage="memory", buffer_dir=None):
+        """Instantiate the allocator.
+
+        Parameters
+        ----------
+        storage : str
+            the storage backend, one of "memory", "memmap", or "shared"
+        buffer_dir : str or None
+            the directory in which memory-mapped files are created. A unique
+            sub-directory is created for every allocator, and deleted once the
+            allocator is garbage collected. If set to None, the shared memory
+            filesystem is used for the "shared" backend, and the default
+            temporary directory of the system otherwise. Not used if `storage`
+            is set to "memory".
+        """
+        if storage not in STORAGE_TYPES:
+            raise ValueError("storage must be one of {}, not '{}'.".format(
+                STORAGE_TYPES, storage))
+
+        self.storage = storage
+        self.path = None
+        self.names = []
+        self.attached = False
+
+        if storage == "shared" and buffer_dir is None and \
+                os.path.isdir(SHARED_MEMORY_DIR):
+            buffer_dir = SHARED_MEMORY_DIR
+
+        if storage != "memory":
+            if buffer_dir is not None:
+                os.makedirs(buffer_dir, exist_ok=True)
+            self.path = tempfile.mkdtemp(prefix="replay_", dir=buffer_dir)
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self.path, ignore_errors=True)
+
+    @classmethod
+    def attach(cls, path, storage="shared"):
+        """Return an allocator that maps the arrays of another allocator.
+
+        The arrays returned by the `zeros` method of this allocator are mapped
+        from the files created by the original allocator (in the same order),
+        and are not zero-initialized. Modifications are visible to both. The
+        files are not deleted when this allocator is garbage collected.
+
+        Parameters
+        ----------
+        path : str
+            the directory the files of the original allocator are stored in
+        storage : str
+            the storage backend of the original allocator, one of "memmap" or
+            "shared"
+
+        Returns
+        -------
+        hbaselines.utils.storage.ArrayAllocator
+            the allocator
+        """
+        if storage not in ["memmap", "shared"]:
+            raise ValueError("Only memory-mapped arrays can be attached to.")
+
+        allocator = cls.__new__(cls)
+        allocator.storage = storage
+        allocator.path = path
+        allocator.names = []
+        allocator.attached = True
+
+        return allocator
+
+    def zeros(self, name, shape, dtype=np.float32):
+        """Return a new zero-initialized array.
+
+        Parameters
+        ----------
+        name : str
+            the name of the array. This should match the name of the attribute
+            the array is assigned to, and is used to name the files of
+            memory-mapped arrays and snapshots.
+        shape : tuple of int
+            the shape of the array. The first dimension corresponds to the
+            rows of the array (i.e. the elements of the buffer).
+        dtype : type
+            the data type of the array
+
+        Returns
+        -------
+        np.ndarray
+            the array. For the "memmap" backend, this is a view of the padded
+            memory-mapped file.
+        """
+        shape = tuple(shape)
+        self.names.append(name)
+
+        if self.storage == "memory":
+            return np.zeros(shape, dtype=dtype)
+
+        # Compute the number of elements per (padded) row.
+        itemsize = np.dtype(dtype).itemsize
+        row_elems = int(np.prod(shape[1:], dtype=np.int64))
+        padded_elems = aligned_row_size(row_elems * itemsize) // itemsize
+
+        # Files opened in "w+" mode are created as sparse files, so disk space
+        # is only consumed for the rows that are written to. Attached
+        # allocators open the existing files instead.
+        arr = np.memmap(
+            os.path.join(self.path, "{}.dat".format(name)),
+            dtype=dtype,
+            mode="r+" if self.attached else "w+",
+            shape=(shape[0], padded_elems),
+        )
+
+        return arr[:, :row_elems].reshape(shape)
+
+
+class ObservationEncoder(object):
+    """Encodes observations in a compact (possibly quantized) format.
+
+    For the "float32" and "float16" encodings, observations are simply cast to
+    the corresponding data type. For the "uint8" and "uint16" encodings, every
+    dimension of the observation is mapped affinely to the integer levels of
+    the data type:
+
+        q = round((x - offset) / scale),    x ~= q * scale + offset
+
+    The offset and scale of dimensions with finite bounds are computed from
+    these bounds. For the remaining dimensions, they are computed from the
+    running minimum and maximum of the observations. When this range expands,
+    `update` returns True, and any previously encoded observations must be
+    re-encoded via `requantize`.
+
+    Attributes
+    ----------
+    encoding : str
+        the name of the encoding
+    dtype : type
+        the data type encoded observations are stored as
+    quantized : bool
+        whether the encoding uses affine quantization
+    low : np.ndarray
+        the lower bound of every dimension. Only used for quantized encodings.
+    high : np.ndarray
+        the upper bound of every dimension. Only used for quantized encodings.
+    offset : np.ndarray
+        the value of every dimension represented by level 0
+    scale : np.ndarray
+        the difference between the values of consecutive levels
+    """
+
+    def __init__(self, encoding, dim, low=None, high=None, margin=0.1):
+        """Instantiate the encoder.
+
+        Parameters
+        ----------
+        encoding : str
+            the name of the encoding, one of "float32", "float16", "uint8", or
+            "uint16"
+        dim : int
+            number of elements in the observations
+        low : array_like or None
+            the lower bound of every dimension of the observations. Non-finite
+            bounds are replaced with running statistics.
+        high : array_like or None
+            the upper bound of every dimension of the observations. Non-finite
+            bounds are replaced with running statistics.
+        margin : float
+            the fraction of the range the running bounds are widened by when
+            they are expanded. This reduces the number of times stored
+            observations need to be re-encoded.
+        """
+        if encoding not in OBS_ENCODINGS:
+            raise ValueError("encoding must be one of {}, not '{}'.".format(
+                sorted(OBS_ENCODINGS.keys()), encoding))
+
+        self.encoding = encoding
+        self.dtype = OBS_ENCODINGS[encoding]
+        self.quantized = encoding in ["uint8", "uint16"]
+        self.margin = margin
+
+        low = np.full(dim, -np.inf) if low is None else \
+            np.asarray(low, dtype=np.float64).flatten()
+        high = np.full(dim, np.inf) if high is None else \
+            np.asarray(high, dtype=np.float64).flatten()
+        self._fixed = np.isfinite(low) & np.isfinite(high)
+        self.low = np.where(self._fixed, low, np.inf)
+        self.high = np.where(self._fixed, high, -np.inf)
+        self._levels = np.iinfo(self.dtype).max if self.quantized else None
+        self._update_scale()
+
+    def _update_scale(self):
+        """Recompute the offset and scale terms from the bounds."""
+        seen = self.high >= self.low
+        self.offset = np.where(seen, self.low, 0.).astype(np.float32)
+        self.scale = np.where(
+            self.high > self.low, (self.high - self.low) / (self._levels or 1),
+            1.).astype(np.float32)
+
+    def set_bounds(self, low, high):
+        """Set the (running) bounds of every dimension.
+
+        This is used when restoring observations that were encoded with
+        previously computed bounds.
+        """
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self._update_scale()
+
+    def update(self, x):
+        """Update the running bounds with one or more new observations.
+
+        Parameters
+        ----------
+        x : array_like
+            the observation, or a list of observations
+
+        Returns
+        -------
+        bool
+            True if the offset and scale terms were modified, False otherwise
+        """
+        if not self.quantized or self._fixed.all():
+            return False
+
+        x = np.asarray(x, dtype=np.float64).reshape(-1, len(self.low))
+        x_min = x.min(axis=0)
+        x_max = x.max(axis=0)
+        expand_low = ~self._fixed & (x_min < self.low)
+        expand_high = ~self._fixed & (x_max > self.high)
+        if not (expand_low.any() or expand_high.any()):
+            return False
+
+        low = np.where(expand_low, x_min, self.low)
+        high = np.where(expand_high, x_max, self.high)
+        width = self.margin * np.where(high > low, high - low, 0.)
+        self.low = np.where(expand_low, low - width, low)
+        self.high = np.where(expand_high, high + width, high)
+        self._update_scale()
+
+        return True
+
+    def encode(self, x):
+        """Return the encoded form of one or more observations."""
+        if not self.quantized:
+            return np.asarray(x, dtype=self.dtype)
+
+        q = np.rint((np.asarray(x, dtype=np.float32) - self.offset)
+                    / self.scale)
+        return np.clip(q, 0, self._levels).astype(self.dtype)
+
+    def decode(self, q):
+        """Return the (float32) observations from their encoded form."""
+        if not self.quantized:
+            return np.asarray(q, dtype=np.float32)
+
+        return q.astype(np.float32) * self.scale + self.offset
+
+    def requantize(self, q, offset, scale, chunk_size=65536):
+        """Re-encode observations that were encoded with different terms.
+
+        Parameters
+        ----------
+        q : np.ndarray
+            the encoded observations. These are modified in-place.
+        offset : np.ndarray
+            the offset term the observations were encoded with
+        scale : np.ndarray
+            the scale term the observations were encoded with
+        chunk_size : int
+            the number of observations that are re-encoded at a time. This
+            bounds the size of the temporary arrays.
+        """
+        for i in range(0, q.shape[0], chunk_size):
+            chunk = q[i:i + chunk_size]
+            chunk[:] = self.encode(chunk.astype(np.float32) * scale + offset)
+
+
+def save_snapshot(path, arrays, info, rows=None):
+    """Write a snapshot of a set of arrays to a directory.
+
+    Every array is written to a separate .npy file with a single bulk write.
+    The info dictionary is written last, so that snapshots that were
+    interrupted midway are never considered complete.
+
+    Parameters
+    ----------
+    path : str
+        the directory to store the snapshot in
+    arrays : dict of str: np.ndarray
+        the arrays to store, indexed by their names
+    info : dict
+        additional (JSON serializable) information to store with the snapshot
+    rows : array_like or None
+        the rows of the arrays to store. If set to None, the full arrays are
+        stored. Otherwise, the snapshot is incremental, and should be applied
+        on top of the snapshot it was computed from.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    # Remove the info file of any snapshot previously stored in this path.
+    info_path = os.path.join(path, "info.json")
+    if os.path.exists(info_path):
+        os.remove(info_path)
+
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        np.save(os.path.join(path, "_rows.npy"), rows)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, "{}.npy".format(name)),
+                arr if rows is None else arr[rows])
+
+    info = dict(info, incremental=rows is not None)
+    with open(info_path, "w") as f:
+        json.dump(info, f)
+
+
+def load_snapshot(path):
+    """Read a snapshot written by `save_snapshot`.
+
+    The arrays are not copied into memory. Instead, they are memory-mapped in
+    copy-on-write mode, so that pages are only read from disk when they are
+    accessed, and modifications to the arrays are never written back to the
+    snapshot.
+
+    Parameters
+    ----------
+    path : str
+        the directory the snapshot is stored in
+
+    Returns
+    -------
+    dict of str: np.ndarray
+        the (memory-mapped) arrays, indexed by their names
+    dict
+        the additional information stored with the snapshot
+    np.ndarray or None
+        the rows the arrays correspond to, for incremental snapshots. None
+        for full snapshots.
+
+    Raises
+    ------
+    FileNotFoundError
+        if the snapshot does not exist or is incomplete
+    """
+    with open(os.path.join(path, "info.json")) as f:
+        info = json.load(f)
+
+    arrays = {}
+    for fname in os.listdir(path):
+        if fname.endswith(".npy") and fname != "_rows.npy":
+            arrays[fname[:-4]] = np.load(
+                os.path.join(path, fname), mmap_mode="c")
+
+    rows = None
+    if info["incremental"]:
+        rows = np.load(os.path.join(path, "_rows.npy"))
+
+    return arrays, info, rows
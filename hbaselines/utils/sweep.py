@@ -0,0 +1,469 @@
+"""Utility methods for performing hyperparameter sweeps.
+
+A sweep trains a policy once for every configuration of a search space (see
+`expand_spec`). The trials are scheduled onto a bounded pool of local
+processes, and trials whose evaluation returns fall behind those of the other
+trials may be stopped early via successive halving (see `SuccessiveHalving`).
+"""
+import copy
+import csv
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from hbaselines.algorithms import OffPolicyRLAlgorithm
+from hbaselines.utils.misc import ensure_dir
+from hbaselines.utils.train import get_hyperparameters, partition_cpus
+
+
+# the distributions that the values of a search space may be sampled from
+DISTRIBUTIONS = ["choice", "uniform", "loguniform", "randint"]
+
+
+def expand_spec(spec, num_samples=1, seed=None):
+    """Return the configurations of a search space.
+
+    The value of every hyperparameter in the search space may either be:
+
+    * a list of values. A configuration is created for every combination of
+      these values (i.e. a grid search).
+    * a dictionary with a single key in `DISTRIBUTIONS`, whose value
+      specifies the distribution that the hyperparameter is sampled from,
+      e.g. {"loguniform": [1e-4, 1e-3]} or {"choice": [5, 10, 20]}. The
+      bounds of "randint" are inclusive.
+    * any other value, which is used by every configuration.
+
+    Parameters
+    ----------
+    spec : dict
+        the search space
+    num_samples : int
+        the number of times the grid is repeated. The sampled hyperparameters
+        are sampled anew for every configuration.
+    seed : int or None
+        the seed of the random number generator that the hyperparameters are
+        sampled with
+
+    Returns
+    -------
+    list of dict
+        the configuration of every trial
+
+    Raises
+    ------
+    ValueError
+        if an unknown distribution is specified
+    """
+    rng = np.random.RandomState(seed)
+
+    # Validate the distributions of the sampled hyperparameters.
+    for key, val in spec.items():
+        if isinstance(val, dict) and \
+                (len(val) != 1 or list(val)[0] not in DISTRIBUTIONS):
+            raise ValueError(
+                "Unknown distribution for hyperparameter {}: {}. Must be one "
+                "of {}.".format(key, val, DISTRIBUTIONS))
+
+    grid_keys = [key for key, val in spec.items() if isinstance(val, list)]
+
+    configs = []
+    for _ in range(num_samples):
+        for grid_values in itertools.product(
+                *[spec[key] for key in grid_keys]):
+            config = {}
+            for key, val in spec.items():
+                if isinstance(val, list):
+                    config[key] = grid_values[grid_keys.index(key)]
+                elif isinstance(val, dict):
+                    config[key] = _sample(rng, *list(val.items())[0])
+                else:
+                    config[key] = val
+            configs.append(config)
+
+    return configs
+
+
+def _sample(rng, distribution, args):
+    """Sample a value from one of the distributions in `DISTRIBUTIONS`."""
+    if distribution == "choice":
+        return args[rng.randint(len(args))]
+    elif distribution == "uniform":
+        return float(rng.uniform(*args))
+    elif distribution == "loguniform":
+        return float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+    else:
+        return int(rng.randint(args[0], args[1] + 1))
+
+
+class SuccessiveHalving(object):
+    """Early stopping of trials via asynchronous successive halving.
+
+    Trials are compared at a set of milestones: `grace_steps`,
+    `grace_steps * reduction_factor`, `grace_steps * reduction_factor^2`, and
+    so on. The first result of a trial after every milestone is recorded, and
+    the trial is stopped if this result is not within the top
+    1/`reduction_factor` of the results that have been recorded at the
+    milestone so far. Trials are compared once they reach a milestone, so no
+    trial has to wait for the remaining trials.
+
+    Attributes
+    ----------
+    reduction_factor : float
+        the fraction of trials that are kept at every milestone is
+        1/`reduction_factor`
+    milestones : list of int
+        the number of training steps at which the trials are compared
+    rung_results : dict
+        the results of every trial at every milestone
+    """
+
+    def __init__(self, grace_steps, max_steps, reduction_factor=3):
+        """Instantiate the scheduler.
+
+        Parameters
+        ----------
+        grace_steps : int
+            the number of training steps before a trial may be stopped
+        max_steps : int
+            the total number of training steps of every trial
+        reduction_factor : float
+            the fraction of trials that are kept at every milestone is
+            1/`reduction_factor`
+        """
+        self.reduction_factor = reduction_factor
+
+        self.milestones = []
+        milestone = grace_steps
+        while milestone < max_steps:
+            self.milestones.append(int(milestone))
+            milestone *= reduction_factor
+
+        self.rung_results = {milestone: {} for milestone in self.milestones}
+
+    def should_stop(self, trial, step, value):
+        """Record the result of a trial and return whether to stop it.
+
+        Parameters
+        ----------
+        trial : int
+            the index of the trial
+        step : int
+            the number of training steps that the trial has performed
+        value : float
+            the result of the trial, e.g. the average evaluation return
+
+        Returns
+        -------
+        bool
+            True if the trial should be stopped, False otherwise
+        """
+        for milestone in reversed(self.milestones):
+            results = self.rung_results[milestone]
+            if step < milestone or trial in results:
+                continue
+
+            results[trial] = value
+            cutoff = np.percentile(
+                list(results.values()), 100 * (1 - 1 / self.reduction_factor))
+
+            return value < cutoff
+
+        return False
+
+
+def apply_config(args, config):
+    """Return the training arguments with the values of a configuration.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the training arguments, see `hbaselines.utils.train.parse_options`
+    config : dict
+        the values of the hyperparameters of a trial. The names of the
+        hyperparameters must match the names of the training arguments.
+
+    Returns
+    -------
+    argparse.Namespace
+        the training arguments of the trial
+
+    Raises
+    ------
+    ValueError
+        if the configuration contains an unknown hyperparameter
+    """
+    trial_args = copy.copy(args)
+    for key, val in config.items():
+        if not hasattr(trial_args, key):
+            raise ValueError("Unknown hyperparameter: {}".format(key))
+        setattr(trial_args, key, val)
+
+    return trial_args
+
+
+def train_trial(args, policy, config, log_dir, cpus=None):
+    """Train a policy with the hyperparameters of a trial.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the training arguments, see `hbaselines.utils.train.parse_options`
+    policy : type [ hbaselines.fcnet.base.ActorCriticPolicy ]
+        the policy class to use
+    config : dict
+        the values of the hyperparameters of the trial
+    log_dir : str
+        the directory the results of the trial are stored in
+    cpus : list of int or None
+        the CPUs that are assigned to the trial
+
+    Returns
+    -------
+    int
+        the total number of training steps that were performed
+    """
+    trial_args = apply_config(args, config)
+    hp = get_hyperparameters(trial_args, policy)
+
+    # Split the threads of the CPUs that are assigned to this trial.
+    if cpus is not None:
+        hp['n_cpus'] = len(cpus)
+        hp['cpu_affinity'] = cpus
+
+    # Add the hyperparameters to the folder.
+    ensure_dir(log_dir)
+    params_with_extra = hp.copy()
+    params_with_extra['seed'] = trial_args.seed
+    params_with_extra['env_name'] = trial_args.env_name
+    params_with_extra['policy_name'] = policy.__name__
+    params_with_extra['algorithm'] = trial_args.alg
+    params_with_extra['config'] = config
+    with open(os.path.join(log_dir, 'hyperparameters.json'), 'w') as f:
+        json.dump(params_with_extra, f, sort_keys=True, indent=4)
+
+    alg = OffPolicyRLAlgorithm(
+        policy=policy,
+        env=trial_args.env_name,
+        eval_env=trial_args.env_name if trial_args.evaluate else None,
+        **hp
+    )
+
+    alg.learn(
+        total_timesteps=trial_args.total_steps,
+        log_dir=log_dir,
+        log_interval=trial_args.log_interval,
+        eval_interval=trial_args.eval_interval,
+        save_interval=trial_args.save_interval,
+        seed=trial_args.seed,
+    )
+
+    return alg.total_steps
+
+
+def read_eval_results(log_dir, start=0):
+    """Return the evaluation results of a trial.
+
+    If the trial is evaluated on multiple environments, the returns are
+    averaged over the environments. Rows with missing terms (e.g. a row that
+    is still being written) are skipped.
+
+    Parameters
+    ----------
+    log_dir : str
+        the directory the results of the trial are stored in
+    start : int
+        the number of evaluations to skip
+
+    Returns
+    -------
+    list of (int, float)
+        the number of training steps and the average return of every
+        evaluation
+    """
+    files = sorted(glob.glob(os.path.join(log_dir, "eval_*.csv")))
+
+    steps, returns = None, []
+    for fp in files:
+        with open(fp) as f:
+            rows = [row for row in csv.DictReader(f)
+                    if row.get("total_step") and row.get("average_return")]
+        steps = [int(float(row["total_step"])) for row in rows]
+        returns.append([float(row["average_return"]) for row in rows])
+
+    if steps is None:
+        return []
+
+    # Only use the evaluations that are available for every environment.
+    num_evals = min(len(ret) for ret in returns)
+    mean_returns = np.mean([ret[:num_evals] for ret in returns], axis=0)
+
+    return list(zip(steps[:num_evals], mean_returns))[start:]
+
+
+def run_sweep(run_trial,
+              configs,
+              log_dirs,
+              n_parallel=1,
+              scheduler=None,
+              summary_path=None,
+              poll_interval=5):
+    """Perform the trials of a hyperparameter sweep.
+
+    Up to `n_parallel` trials are performed concurrently, each in a separate
+    process that is pinned to an even share of the available CPUs (see
+    `hbaselines.utils.train.partition_cpus`). The evaluation results of the
+    running trials are periodically read from their log directories and
+    passed to the scheduler, which may stop trials early.
+
+    Once all trials are done, a summary with the status and final evaluation
+    return of every trial is printed and, if `summary_path` is specified,
+    stored in a csv file.
+
+    Parameters
+    ----------
+    run_trial : callable
+        the training operation. Called as `run_trial(config, log_dir, cpus)`
+        and returns the number of training steps that were performed. Must be
+        picklable.
+    configs : list of dict
+        the configuration of every trial
+    log_dirs : list of str
+        the directory the results of every trial are stored in
+    n_parallel : int
+        the maximum number of trials that are performed concurrently
+    scheduler : SuccessiveHalving or None
+        the early stopping scheduler. If set to None, every trial is trained
+        to completion.
+    summary_path : str or None
+        the csv file that the summary is stored in
+    poll_interval : float
+        the number of seconds between reads of the evaluation results
+
+    Returns
+    -------
+    list of dict
+        the summary of every trial
+    """
+    # Processes that have imported tensorflow cannot be forked safely.
+    start_method = "forkserver" if "forkserver" in \
+        multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(start_method)
+
+    slots = partition_cpus(n_parallel)
+    free_slots = list(range(n_parallel))
+    pending = list(range(len(configs)))
+    running = {}
+    evals = {trial: [] for trial in pending}
+    results = ctx.Queue()
+    summaries = {}
+
+    def finish(trial, status, steps=None):
+        """Free the slot of a trial and store its summary."""
+        process, slot, start_time = running.pop(trial)
+        process.join()
+        free_slots.append(slot)
+        evals[trial].extend(
+            read_eval_results(log_dirs[trial], start=len(evals[trial])))
+        summaries[trial] = {
+            "trial": trial,
+            "status": status,
+            "duration": time.time() - start_time,
+            "steps": steps if steps is not None else
+            (evals[trial][-1][0] if evals[trial] else 0),
+            "return": evals[trial][-1][1] if evals[trial] else float("nan"),
+            "config": json.dumps(configs[trial], sort_keys=True),
+        }
+
+    while pending or running:
+        # Start the next trials on the free CPUs.
+        while pending and free_slots:
+            slot = free_slots.pop(0)
+            trial = pending.pop(0)
+            process = ctx.Process(
+                target=_run_trial_process,
+                args=(run_trial, trial, configs[trial], log_dirs[trial],
+                      slots[slot], results))
+            process.start()
+            running[trial] = (process, slot, time.time())
+
+        # Collect the trials that are done.
+        try:
+            trial, status, steps = results.get(timeout=poll_interval)
+            if trial in running:
+                finish(trial, status, steps)
+        except queue.Empty:
+            pass
+
+        for trial in list(running.keys()):
+            process = running[trial][0]
+
+            # Check for processes that terminated without a result, e.g.
+            # because they were killed.
+            if process.exitcode not in (None, 0):
+                finish(trial, "failed")
+                continue
+
+            if scheduler is None:
+                continue
+
+            # Pass the new evaluation results to the scheduler, and stop the
+            # trial if it falls behind.
+            new_evals = read_eval_results(
+                log_dirs[trial], start=len(evals[trial]))
+            evals[trial].extend(new_evals)
+            if any(scheduler.should_stop(trial, step, value)
+                   for step, value in new_evals):
+                process.terminate()
+                finish(trial, "stopped")
+
+    summaries = [summaries[trial] for trial in range(len(configs))]
+
+    # Print the summary of every trial, from best to worst.
+    print("-" * 57)
+    for summary in sorted(summaries, key=lambda s: (
+            np.isnan(s["return"]), -s["return"])):
+        print("| trial {:<5} | {:<7} | {:>10} steps | {:>12.3f} |".format(
+            summary["trial"], summary["status"], summary["steps"],
+            summary["return"]))
+    print("-" * 57)
+
+    # Store the summary in a csv file.
+    if summary_path is not None:
+        with open(summary_path, "w") as f:
+            w = csv.DictWriter(f, fieldnames=summaries[0].keys())
+            w.writeheader()
+            w.writerows(summaries)
+
+    return summaries
+
+
+def _run_trial_process(run_trial, trial, config, log_dir, cpus, results):
+    """Perform a trial in a worker process.
+
+    The status of the trial is placed in the `results` queue once it is done.
+    """
+    # Exit cleanly if the trial is stopped, so that the processes of the
+    # environments are shut down as well.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    try:
+        steps = run_trial(config, log_dir, cpus)
+        status = "done"
+    except Exception:
+        traceback.print_exc()
+        steps = 0
+        status = "failed"
+
+    results.put((trial, status, steps))
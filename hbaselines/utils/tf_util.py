@@ -2,7 +2,10 @@
 import tensorflow as tf
 
 
-def make_session(num_cpu, graph=None):
+def make_session(num_cpu,
+                 graph=None,
+                 intra_op_threads=None,
+                 inter_op_threads=None):
     """Return a session that will use <num_cpu> CPU's only.
 
     Parameters
@@ -11,6 +14,12 @@ def make_session(num_cpu, graph=None):
         number of CPUs to use for TensorFlow
     graph : tf.Graph
         the graph of the session
+    intra_op_threads : int or None
+        the number of threads used to parallelize the computation of single
+        operations (e.g. matrix multiplications). Defaults to `num_cpu`.
+    inter_op_threads : int or None
+        the number of threads used to compute independent operations in
+        parallel. Defaults to `num_cpu`.
 
     Returns
     -------
@@ -19,8 +28,8 @@ def make_session(num_cpu, graph=None):
     """
     tf_config = tf.compat.v1.ConfigProto(
         allow_soft_placement=True,
-        inter_op_parallelism_threads=num_cpu,
-        intra_op_parallelism_threads=num_cpu)
+        inter_op_parallelism_threads=inter_op_threads or num_cpu,
+        intra_op_parallelism_threads=intra_op_threads or num_cpu)
     # Prevent tensorflow from taking all the gpu memory
     tf_config.gpu_options.allow_growth = True
     return tf.compat.v1.Session(config=tf_config, graph=graph)
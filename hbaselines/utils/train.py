@@ -1,5 +1,14 @@
 """Utility methods when performing training."""
 import argparse
+import csv
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import numpy as np
+
 from hbaselines.algorithms.off_policy import TD3_PARAMS
 from hbaselines.algorithms.off_policy import SAC_PARAMS
 from hbaselines.algorithms.off_policy import FEEDFORWARD_PARAMS
@@ -13,6 +22,16 @@ def get_hyperparameters(args, policy):
     algorithm_params = {
         "nb_train_steps": args.nb_train_steps,
         "nb_rollout_steps": args.nb_rollout_steps,
+        "num_envs": args.num_envs,
+        "async_rollouts": args.async_rollouts,
+        "max_replay_ratio": args.max_replay_ratio,
+        "actor_sync_interval": args.actor_sync_interval,
+        "num_rollout_workers": args.num_rollout_workers,
+        "n_cpus": args.n_cpus,
+        "intra_op_threads": args.intra_op_threads,
+        "inter_op_threads": args.inter_op_threads,
+        "cpu_affinity": args.cpu_affinity,
+        "autotune_threads": args.autotune_threads,
         "nb_eval_episodes": args.nb_eval_episodes,
         "actor_update_freq": args.actor_update_freq,
         "meta_update_freq": args.meta_update_freq,
@@ -33,6 +52,16 @@ def get_hyperparameters(args, policy):
         "gamma": args.gamma,
         "layer_norm": args.layer_norm,
         "use_huber": args.use_huber,
+        "prioritized_replay": args.prioritized_replay,
+        "prioritized_replay_alpha": args.prioritized_replay_alpha,
+        "prioritized_replay_beta": args.prioritized_replay_beta,
+        "prioritized_replay_eps": args.prioritized_replay_eps,
+        "storage": args.storage,
+        "buffer_dir": args.buffer_dir,
+        "deduplicate_obs": args.deduplicate_obs,
+        "obs_encoding": args.obs_encoding,
+        "prefetch_batches": args.prefetch_batches,
+        "n_step": args.n_step,
     }
 
     # add TD3 parameters
@@ -56,7 +85,12 @@ def get_hyperparameters(args, policy):
             "worker_reward_scale": args.worker_reward_scale,
             "relative_goals": args.relative_goals,
             "off_policy_corrections": args.off_policy_corrections,
+            "in_graph_corrections": args.in_graph_corrections,
+            "correction_staleness": args.correction_staleness,
             "hindsight": args.hindsight,
+            "lazy_hindsight": args.lazy_hindsight,
+            "hindsight_strategy": args.hindsight_strategy,
+            "hindsight_fraction": args.hindsight_fraction,
             "connected_gradients": args.connected_gradients,
             "cg_weights": args.cg_weights,
             "use_fingerprints": args.use_fingerprints,
@@ -99,6 +133,11 @@ def parse_options(description, example_usage, args):
         '--n_training', type=int, default=1,
         help='Number of training operations to perform. Each training '
              'operation is performed on a new seed. Defaults to 1.')
+    parser.add_argument(
+        '--n_parallel', type=int, default=1,
+        help='Number of training operations that are performed concurrently, '
+             'each in a separate process. The available CPUs are split evenly '
+             'between the processes. Defaults to 1.')
     parser.add_argument(
         '--total_steps',  type=int, default=1000000,
         help='Total number of timesteps used during training.')
@@ -116,6 +155,11 @@ def parse_options(description, example_usage, args):
         '--save_interval', type=int, default=50000,
         help='number of simulation steps in the training environment before '
              'the model is saved')
+    parser.add_argument(
+        '--ray_address', type=str, default=None,
+        help='the address of the Ray cluster that the rollout workers are '
+             'created in. If not specified, a local Ray cluster is started '
+             'when rollout workers are used.')
 
     # algorithm-specific hyperparameters
     parser = create_algorithm_parser(parser)
@@ -137,6 +181,54 @@ def create_algorithm_parser(parser):
     parser.add_argument(
         '--nb_rollout_steps', type=int, default=1,
         help='the number of rollout steps')
+    parser.add_argument(
+        '--num_envs', type=int, default=1,
+        help='the number of training environments. If greater than one, the '
+             'environments are stepped in parallel worker processes, and '
+             'every rollout step collects one sample from each environment.')
+    parser.add_argument(
+        '--async_rollouts', action='store_true',
+        help='whether to collect samples in a separate actor thread while the '
+             'policy is trained. The actor computes actions with a copy of '
+             'the policy whose weights are periodically synced with the '
+             'trained policy.')
+    parser.add_argument(
+        '--max_replay_ratio', type=float, default=None,
+        help='the maximum number of training steps per collected sample. If '
+             'the learner gets ahead of the actor, training is paused until '
+             'new samples are collected. Only used if `async_rollouts` is '
+             'set.')
+    parser.add_argument(
+        '--actor_sync_interval', type=int, default=10,
+        help='the number of training steps after which the weights of the '
+             'actor are synced with the trained policy. Only used if '
+             '`async_rollouts` is set, or if `num_rollout_workers` is greater '
+             'than zero.')
+    parser.add_argument(
+        '--num_rollout_workers', type=int, default=0,
+        help='the number of Ray actors that collect samples, each with its '
+             'own environment and copy of the policy. If greater than zero, '
+             'every rollout step collects one sample from each worker.')
+    parser.add_argument(
+        '--n_cpus', type=int, default=3,
+        help='the number of CPUs used by the tensorflow session. This is the '
+             'default size of both thread pools of the session.')
+    parser.add_argument(
+        '--intra_op_threads', type=int, default=None,
+        help='the number of threads used to parallelize the computation of '
+             'single operations. Defaults to `n_cpus`.')
+    parser.add_argument(
+        '--inter_op_threads', type=int, default=None,
+        help='the number of threads used to compute independent operations '
+             'in parallel. Defaults to `n_cpus`.')
+    parser.add_argument(
+        '--cpu_affinity', type=int, nargs='+', default=None,
+        help='the CPUs that the process is pinned to. If not specified, the '
+             'process may run on any CPU.')
+    parser.add_argument(
+        '--autotune_threads', action='store_true',
+        help='whether to pick the fastest number of threads (up to `n_cpus`) '
+             'for the tensorflow session when the model is created.')
     parser.add_argument(
         '--nb_eval_episodes', type=int, default=50,
         help='the number of evaluation episodes')
@@ -246,6 +338,75 @@ def create_feedforward_parser(parser):
         help="specifies whether to use the huber distance function as the "
              "loss for the critic. If set to False, the mean-squared error "
              "metric is used instead")
+    parser.add_argument(
+        "--prioritized_replay",
+        action="store_true",
+        help="whether to use prioritized experience replay. See: "
+             "https://arxiv.org/abs/1511.05952")
+    parser.add_argument(
+        "--prioritized_replay_alpha",
+        type=float,
+        default=FEEDFORWARD_PARAMS["prioritized_replay_alpha"],
+        help="how much prioritization is used (0 - no prioritization, 1 - "
+             "full prioritization)")
+    parser.add_argument(
+        "--prioritized_replay_beta",
+        type=float,
+        default=FEEDFORWARD_PARAMS["prioritized_replay_beta"],
+        help="to what degree to use importance weights (0 - no corrections, "
+             "1 - full correction)")
+    parser.add_argument(
+        "--prioritized_replay_eps",
+        type=float,
+        default=FEEDFORWARD_PARAMS["prioritized_replay_eps"],
+        help="small positive term added to the priorities to ensure that "
+             "every sample can be drawn")
+    parser.add_argument(
+        "--storage",
+        type=str,
+        default=FEEDFORWARD_PARAMS["storage"],
+        choices=["memory", "memmap"],
+        help="the storage backend of the replay buffer, one of 'memory' "
+             "(in-RAM numpy arrays) or 'memmap' (numpy arrays memory-mapped "
+             "to files in buffer_dir)")
+    parser.add_argument(
+        "--buffer_dir",
+        type=str,
+        default=FEEDFORWARD_PARAMS["buffer_dir"],
+        help="the directory memory-mapped replay buffer files are stored in. "
+             "If set to None, the default temporary directory is used.")
+    parser.add_argument(
+        "--deduplicate_obs",
+        action="store_true",
+        help="whether to store every observation in the replay buffer once, "
+             "instead of storing the observations and next observations "
+             "separately")
+    parser.add_argument(
+        "--obs_encoding",
+        type=str,
+        default=FEEDFORWARD_PARAMS["obs_encoding"],
+        choices=["float32", "float16", "uint8", "uint16"],
+        help="the encoding observations are stored in within the replay "
+             "buffer. The integer encodings quantize every element of the "
+             "observation affinely between its bounds in the observation "
+             "space or, if these are not finite, its running minimum and "
+             "maximum.")
+    parser.add_argument(
+        "--prefetch_batches",
+        type=int,
+        default=FEEDFORWARD_PARAMS["prefetch_batches"],
+        help="the number of minibatches that are sampled in advance by a "
+             "background thread, overlapping the sampling procedure with the "
+             "gradient updates. If set to 0, minibatches are sampled when "
+             "they are needed.")
+    parser.add_argument(
+        "--n_step",
+        type=int,
+        default=FEEDFORWARD_PARAMS["n_step"],
+        help="the number of consecutive transitions used to compute the "
+             "target values of the critic. If greater than 1, the discounted "
+             "rewards of up to `n_step` transitions (of the same episode) are "
+             "summed. Only used by the feedforward policies.")
 
     return parser
 
@@ -273,11 +434,44 @@ def create_goal_conditioned_parser(parser):
         action="store_true",
         help="whether to use off-policy corrections during the update "
              "procedure. See: https://arxiv.org/abs/1805.08296")
+    parser.add_argument(
+        "--in_graph_corrections",
+        action="store_true",
+        help="whether to perform the off-policy corrections within the "
+             "tensorflow graph, as part of the update operation of the "
+             "Manager policy. Only used if `off_policy_corrections` is set.")
+    parser.add_argument(
+        "--correction_staleness",
+        type=int,
+        default=GOAL_CONDITIONED_PARAMS["correction_staleness"],
+        help="the number of Worker updates after which the off-policy "
+             "corrections cached in the replay buffer are recomputed. If not "
+             "set, the corrections are not cached.")
     parser.add_argument(
         "--hindsight",
         action="store_true",
         help="whether to include hindsight action and goal transitions in the "
              "replay buffer. See: https://arxiv.org/abs/1712.00948")
+    parser.add_argument(
+        "--lazy_hindsight",
+        action="store_true",
+        help="whether to relabel the goals of the samples in hindsight when "
+             "they are sampled from the replay buffer, instead of storing a "
+             "second, relabeled copy of every meta period. Only used if "
+             "`hindsight` is set.")
+    parser.add_argument(
+        "--hindsight_strategy",
+        type=str,
+        default=GOAL_CONDITIONED_PARAMS["hindsight_strategy"],
+        choices=["final", "future"],
+        help="the strategy used to choose the hindsight goals. Only used if "
+             "`lazy_hindsight` is set.")
+    parser.add_argument(
+        "--hindsight_fraction",
+        type=float,
+        default=GOAL_CONDITIONED_PARAMS["hindsight_fraction"],
+        help="the fraction of the samples in every batch whose goals are "
+             "relabeled. Only used if `lazy_hindsight` is set.")
     parser.add_argument(
         "--use_fingerprints",
         action="store_true",
@@ -303,3 +497,183 @@ def create_goal_conditioned_parser(parser):
              "`connected_gradients` is set to True.")
 
     return parser
+
+
+def partition_cpus(num_parts):
+    """Split the CPUs available to the current process into equal parts.
+
+    Parameters
+    ----------
+    num_parts : int
+        the number of parts
+
+    Returns
+    -------
+    list of list of int
+        the CPUs of every part. If there are fewer CPUs than parts, some CPUs
+        are assigned to multiple parts.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count()))  # pragma: no cover
+
+    if len(cpus) < num_parts:
+        return [[cpus[i % len(cpus)]] for i in range(num_parts)]
+
+    return [part.tolist() for part in np.array_split(cpus, num_parts)]
+
+
+def run_seeds(run_seed, seeds, n_parallel=1, summary_path=None):
+    """Perform the training operation of every seed.
+
+    If `n_parallel` is greater than one, up to `n_parallel` seeds are trained
+    concurrently, each in a separate process with its own tensorflow graph.
+    The available CPUs are split evenly between these processes (see
+    `partition_cpus`), and every process is pinned to its CPUs. A seed whose
+    training fails does not affect the remaining seeds.
+
+    Once all seeds are done, a summary with the status, duration and
+    throughput of every seed is printed and, if `summary_path` is specified,
+    appended to a csv file.
+
+    Parameters
+    ----------
+    run_seed : callable
+        the training operation. Called as `run_seed(seed, cpus)`, where `cpus`
+        is the list of CPUs assigned to the seed (or None if the seeds are
+        trained sequentially), and returns the number of training steps that
+        were performed. Must be picklable if `n_parallel` is greater than one.
+    seeds : list of int
+        the seeds to train on
+    n_parallel : int
+        the maximum number of seeds that are trained concurrently
+    summary_path : str or None
+        the csv file that the summary is appended to
+
+    Returns
+    -------
+    list of dict
+        the summary of every seed
+
+    Raises
+    ------
+    RuntimeError
+        if the training operation of any seed failed while training in
+        parallel. When training sequentially, the original exception is
+        raised instead.
+    """
+    if n_parallel > 1:
+        summaries = _run_parallel_seeds(run_seed, seeds, n_parallel)
+    else:
+        summaries = []
+        for seed in seeds:
+            start_time = time.time()
+            steps = run_seed(seed, None)
+            summaries.append(
+                _seed_summary(seed, None, "done", start_time, steps))
+
+    # Print the summary of every seed.
+    print("-" * 57)
+    for summary in summaries:
+        print("| seed {:<10} | {:<7} | {:>12.1f} steps/sec |".format(
+            summary["seed"], summary["status"],
+            summary["steps_per_second"]))
+    print("-" * 57)
+
+    # Append the summary to the csv file.
+    if summary_path is not None:
+        exists = os.path.exists(summary_path)
+        with open(summary_path, "a") as f:
+            w = csv.DictWriter(f, fieldnames=summaries[0].keys())
+            if not exists:
+                w.writeheader()
+            w.writerows(summaries)
+
+    failed = [s["seed"] for s in summaries if s["status"] != "done"]
+    if failed:
+        raise RuntimeError("Training failed for seeds {}.".format(failed))
+
+    return summaries
+
+
+def _seed_summary(seed, cpus, status, start_time, steps):
+    """Return the summary of the training operation of a seed."""
+    duration = time.time() - start_time
+    return {
+        "seed": seed,
+        "cpus": " ".join(str(cpu) for cpu in cpus or []),
+        "status": status,
+        "duration": duration,
+        "steps": steps,
+        "steps_per_second": steps / max(duration, 1e-8),
+    }
+
+
+def _run_seed_process(run_seed, seed, cpus, results):
+    """Perform the training operation of a seed in a worker process.
+
+    The summary of the training operation is placed in the `results` queue.
+    """
+    start_time = time.time()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    try:
+        steps = run_seed(seed, cpus)
+        status = "done"
+    except Exception:
+        traceback.print_exc()
+        steps = 0
+        status = "failed"
+
+    results.put(_seed_summary(seed, cpus, status, start_time, steps))
+
+
+def _run_parallel_seeds(run_seed, seeds, n_parallel):
+    """Perform the training operations of multiple seeds concurrently.
+
+    See `run_seeds` for a description of the arguments.
+    """
+    # Processes that have imported tensorflow cannot be forked safely.
+    start_method = "forkserver" if "forkserver" in \
+        multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(start_method)
+
+    slots = partition_cpus(n_parallel)
+    free_slots = list(range(n_parallel))
+    pending = list(seeds)
+    running = {}
+    results = ctx.Queue()
+    summaries = []
+
+    while pending or running:
+        # Start training the next seeds on the free CPUs.
+        while pending and free_slots:
+            slot = free_slots.pop(0)
+            seed = pending.pop(0)
+            process = ctx.Process(
+                target=_run_seed_process,
+                args=(run_seed, seed, slots[slot], results))
+            process.start()
+            running[seed] = (process, slot, time.time())
+
+        try:
+            summary = results.get(timeout=1)
+        except queue.Empty:
+            # Check for processes that terminated without a summary, e.g.
+            # because they were killed.
+            for seed, (process, slot, start_time) in list(running.items()):
+                if process.exitcode not in (None, 0):
+                    summaries.append(_seed_summary(
+                        seed, slots[slot], "failed", start_time, 0))
+                    del running[seed]
+                    free_slots.append(slot)
+            continue
+
+        if summary["seed"] in running:
+            process, slot, _ = running.pop(summary["seed"])
+            process.join()
+            free_slots.append(slot)
+            summaries.append(summary)
+
+    return sorted(summaries, key=lambda s: s["seed"])
@@ -0,0 +1,224 @@
+"""Utility methods for stepping multiple environments in parallel.
+
+Environments such as the MuJoCo-based Ant environments are CPU-bound, so that
+the number of samples that can be collected by a single environment is capped
+by the speed of a single core. The `SubprocVecEnv` object runs multiple copies
+of an environment in separate worker processes, and steps all of them at once.
+"""
+import multiprocessing
+
+import numpy as np
+
+from hbaselines.utils.misc import create_env
+
+
+def _worker(remote, parent_remote, env, render):
+    """Run an environment in a worker process.
+
+    The worker waits for commands from the main process, and executes them.
+    The supported commands are:
+
+    * "step": perform a step of the environment with the provided action. If
+      the episode is done, the environment is reset immediately, and the
+      initial observation and context of the new episode are returned as well.
+    * "reset": reset the environment.
+    * "getattr": return an attribute of the environment.
+    * "close": close the worker.
+
+    Parameters
+    ----------
+    remote : multiprocessing.connection.Connection
+        the end of the pipe used by the worker
+    parent_remote : multiprocessing.connection.Connection
+        the end of the pipe used by the main process
+    env : str or gym.Env
+        the environment, or the name of a registered environment
+    render : bool
+        whether to render the environment
+    """
+    parent_remote.close()
+    env = create_env(env, render, evaluate=False)
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                obs, reward, done, info = env.step(data)
+                context = getattr(env, "current_context", None)
+                if done:
+                    reset_obs = env.reset()
+                    reset_context = getattr(env, "current_context", None)
+                else:
+                    reset_obs = reset_context = None
+                remote.send((obs, reward, done, info, context, reset_obs,
+                             reset_context))
+            elif cmd == "reset":
+                obs = env.reset()
+                remote.send((obs, getattr(env, "current_context", None)))
+            elif cmd == "getattr":
+                try:
+                    remote.send((True, getattr(env, data)))
+                except AttributeError:
+                    remote.send((False, None))
+            elif cmd == "close":
+                break
+            else:
+                raise NotImplementedError(cmd)
+    except KeyboardInterrupt:  # pragma: no cover
+        pass  # pragma: no cover
+    finally:
+        remote.close()
+
+
+class SubprocVecEnv(object):
+    """A set of environments that are stepped in parallel worker processes.
+
+    Every environment is automatically reset once its episode is done.
+    Attributes that are not defined by this object (e.g. `action_space` or
+    `horizon`) are retrieved from the first environment.
+
+    Attributes
+    ----------
+    num_envs : int
+        the number of environments
+    obs : np.ndarray
+        (num_envs, obs_dim) matrix of the current observations of every
+        environment
+    contexts : np.ndarray or None
+        (num_envs, context_dim) matrix of the current contextual terms of every
+        environment. Set to None if no context is provided by the
+        environments.
+    """
+
+    def __init__(self, env, num_envs, render=False, start_method=None):
+        """Instantiate the environments.
+
+        Parameters
+        ----------
+        env : str or gym.Env
+            the environment, or the name of a registered environment. gym.Env
+            objects must be picklable.
+        num_envs : int
+            the number of environments
+        render : bool
+            whether to render the environments
+        start_method : str or None
+            the method used to start the worker processes (see the
+            multiprocessing package). If set to None, "forkserver" is used
+            when available, as forking a process that holds a tensorflow
+            session is unsafe.
+        """
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in \
+                multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(start_method)
+
+        self.num_envs = num_envs
+        self.obs = None
+        self.contexts = None
+        self._closed = False
+
+        pipes = [ctx.Pipe() for _ in range(num_envs)]
+        self._remotes = [parent for parent, _ in pipes]
+        self._processes = []
+        for parent_remote, remote in pipes:
+            process = ctx.Process(
+                target=_worker, args=(remote, parent_remote, env, render),
+                daemon=True)
+            process.start()
+            remote.close()
+            self._processes.append(process)
+
+    def __getattr__(self, name):
+        """Return an attribute of the first environment."""
+        # Private attributes of this object may not exist yet (e.g. while it
+        # is being unpickled), and are never forwarded.
+        if name.startswith("__") or "_remotes" not in self.__dict__:
+            raise AttributeError(name)
+
+        self._remotes[0].send(("getattr", name))
+        found, value = self._remotes[0].recv()
+        if not found:
+            raise AttributeError(name)
+
+        return value
+
+    def reset(self):
+        """Reset all environments.
+
+        Returns
+        -------
+        np.ndarray
+            (num_envs, obs_dim) matrix of the initial observations
+        """
+        for remote in self._remotes:
+            remote.send(("reset", None))
+        obs, contexts = zip(*[remote.recv() for remote in self._remotes])
+
+        self.obs = np.stack(obs)
+        self.contexts = self._stack_contexts(contexts)
+
+        return self.obs
+
+    def step(self, actions):
+        """Perform a step in every environment.
+
+        Environments whose episodes are done are reset, and their initial
+        observations and contexts are stored in the `obs` and `contexts`
+        attributes, while the final observations of their episodes are
+        returned by this method.
+
+        Parameters
+        ----------
+        actions : array_like
+            (num_envs, ac_dim) matrix of the actions of every environment
+
+        Returns
+        -------
+        np.ndarray
+            (num_envs, obs_dim) matrix of the observations after the step
+        np.ndarray
+            (num_envs,) vector of rewards
+        np.ndarray
+            (num_envs,) vector of done masks
+        list of dict
+            the info dictionaries of every environment
+        np.ndarray or None
+            (num_envs, context_dim) matrix of the contextual terms after the
+            step. Set to None if no context is provided by the environments.
+        """
+        for remote, action in zip(self._remotes, actions):
+            remote.send(("step", action))
+        results = [remote.recv() for remote in self._remotes]
+        obs, rewards, dones, infos, contexts, reset_obs, reset_contexts = \
+            zip(*results)
+
+        # Start the next step from the initial observations of the new
+        # episodes for the environments that were reset.
+        self.obs = np.stack([o0 if o0 is not None else o1
+                             for o0, o1 in zip(reset_obs, obs)])
+        self.contexts = self._stack_contexts(
+            [c0 if d else c1 for c0, c1, d in
+             zip(reset_contexts, contexts, dones)])
+
+        return np.stack(obs), np.array(rewards, dtype=np.float64), \
+            np.array(dones, dtype=bool), list(infos), \
+            self._stack_contexts(contexts)
+
+    def close(self):
+        """Close all environments and terminate the worker processes."""
+        if self._closed:
+            return
+
+        for remote in self._remotes:
+            remote.send(("close", None))
+        for process in self._processes:
+            process.join()
+        self._closed = True
+
+    @staticmethod
+    def _stack_contexts(contexts):
+        """Stack the contextual terms of all environments, if available."""
+        if contexts[0] is None:
+            return None
+        return np.stack([np.asarray(c).flatten() for c in contexts])
@@ -5,6 +5,7 @@ import random
 import shutil
 import os
 import csv
+import ray
 
 from hbaselines.algorithms import OffPolicyRLAlgorithm
 from hbaselines.utils.tf_util import get_trainable_vars
@@ -128,6 +129,7 @@ class TestTD3(unittest.TestCase):
         policy_kwargs.update(TD3_PARAMS)
         policy_kwargs['verbose'] = self.init_parameters['verbose']
         policy_kwargs['env_name'] = self.init_parameters['env']
+        policy_kwargs['num_envs'] = 1
         self.assertDictEqual(alg.policy_kwargs, policy_kwargs)
 
         with alg.graph.as_default():
@@ -242,6 +244,57 @@ class TestTD3(unittest.TestCase):
         self.assertEqual(random.uniform(0, 1), 0.13436424411240122)
         shutil.rmtree('results')
 
+    def test_save_load(self):
+        """Validate the functionality of the save and load methods.
+
+        This is done for the following cases:
+
+        1. the number of steps is restored with a checkpoint, and is not reset
+           when training is resumed
+        2. the replay buffer is restored if it is saved with the checkpoint
+        """
+        policy_params = self.init_parameters.copy()
+        policy_params['policy'] = FeedForwardPolicy
+        os.makedirs(os.path.join('results', 'checkpoints'), exist_ok=True)
+
+        # test case 1
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        alg.total_steps = 5
+        alg.save(os.path.join('results', 'checkpoints/itr'))
+
+        new_alg = OffPolicyRLAlgorithm(**policy_params)
+        new_alg.load(os.path.join('results', 'checkpoints/itr-5'))
+        self.assertEqual(new_alg.total_steps, 5)
+
+        new_alg.learn(0, log_dir='results', initial_exploration_steps=0)
+        self.assertEqual(new_alg.total_steps, 5)
+
+        # test case 2
+        for _ in range(3):
+            alg.policy_tf.store_transition(
+                obs0=np.random.uniform(size=2),
+                context0=None,
+                action=np.random.uniform(size=1),
+                reward=0,
+                obs1=np.random.uniform(size=2),
+                context1=None,
+                done=False,
+                is_final_step=False)
+        alg.total_steps = 8
+        alg.save(os.path.join('results', 'checkpoints/itr'),
+                 save_replay_buffer=True)
+
+        new_alg = OffPolicyRLAlgorithm(**policy_params)
+        new_alg.load(os.path.join('results', 'checkpoints/itr-8'))
+        self.assertEqual(new_alg.total_steps, 8)
+        self.assertEqual(len(new_alg.policy_tf.replay_buffer), 3)
+        np.testing.assert_array_equal(
+            new_alg.policy_tf.replay_buffer.obs_t[:3],
+            alg.policy_tf.replay_buffer.obs_t[:3])
+
+        # Delete generated files.
+        shutil.rmtree('results')
+
     def test_learn_initial_exploration_steps(self):
         """TODO"""
         pass
@@ -250,6 +303,183 @@ class TestTD3(unittest.TestCase):
         """Validate the functionality of the _collect_samples method."""
         pass
 
+    def test_collect_vec_samples(self):
+        """Validate the sample collection of vectorized environments."""
+        policy_params = self.init_parameters.copy()
+        policy_params['policy'] = FeedForwardPolicy
+        policy_params['num_envs'] = 2
+        policy_params['nb_rollout_steps'] = 3
+
+        # Check that the interleaved samples of the environments cannot be
+        # linked by n-step returns or deduplicated observations.
+        for policy_kwargs in [{'n_step': 3}, {'deduplicate_obs': True}]:
+            self.assertRaises(
+                ValueError, OffPolicyRLAlgorithm,
+                **dict(policy_params, policy_kwargs=policy_kwargs))
+
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        self.assertEqual(alg.horizon, 999)
+
+        # Check that every step collects one sample per environment.
+        alg.learn(6, log_dir='results', initial_exploration_steps=5)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 12)
+        self.assertEqual(alg.total_steps, 6)
+        self.assertTupleEqual(alg.obs.shape, (2, 2))
+        np.testing.assert_array_equal(alg.episode_step, [6, 6])
+        self.assertEqual(len(alg.epoch_actions), 6)
+        alg.env.close()
+
+        # Delete generated files.
+        shutil.rmtree('results')
+
+        # Check that goal-conditioned policies track the meta periods of every
+        # environment.
+        policy_params['policy'] = GoalConditionedPolicy
+        policy_params['policy_kwargs'] = {'meta_period': 2}
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        self.assertEqual(alg.policy_tf.num_envs, 2)
+
+        alg.learn(6, log_dir='results', initial_exploration_steps=5)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 6)
+        np.testing.assert_array_equal(alg.policy_tf._num_steps, [0, 0])
+        alg.env.close()
+
+        # Delete generated files.
+        shutil.rmtree('results')
+
+    def test_async_rollouts(self):
+        """Validate the asynchronous actor-learner mode.
+
+        This is done for the following cases:
+
+        1. the actor policy is a copy of the trained policy with the same
+           replay buffer, whose weights are synced via `_sync_actor_weights`,
+           and which does not prefetch minibatches
+        2. training stops once the requested number of samples is collected,
+           and the number of training steps per sample does not exceed the
+           maximum replay ratio
+        """
+        policy_params = self.init_parameters.copy()
+        policy_params['policy'] = FeedForwardPolicy
+        policy_params['async_rollouts'] = True
+        policy_params['max_replay_ratio'] = 1
+        policy_params['actor_sync_interval'] = 1
+        policy_params['policy_kwargs'] = {'prefetch_batches': 1}
+        alg = OffPolicyRLAlgorithm(**policy_params)
+
+        # test case 1
+        self.assertIsNot(alg.actor_tf, alg.policy_tf)
+        self.assertIs(alg.actor_tf.replay_buffer, alg.policy_tf.replay_buffer)
+        self.assertIsNotNone(alg.policy_tf.prefetcher)
+        self.assertIsNone(alg.actor_tf.prefetcher)
+
+        alg._sync_actor_weights()
+        with alg.actor_graph.as_default():
+            actor_vars = get_trainable_vars()
+        for var, actor_var in zip(alg.sess.run(alg.trainable_vars),
+                                  alg.actor_sess.run(actor_vars)):
+            np.testing.assert_array_equal(var, actor_var)
+
+        # test case 2
+        alg.learn(20, log_dir='results', initial_exploration_steps=5)
+        self.assertEqual(alg.total_steps, 20)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 25)
+        self.assertLessEqual(alg.total_updates, alg.total_steps)
+        self.assertIsNone(alg._actor_thread)
+
+        # Delete generated files.
+        shutil.rmtree('results')
+
+    def test_rollout_workers(self):
+        """Validate the sample collection of Ray rollout workers.
+
+        This is done for the following cases:
+
+        1. rollout workers cannot be combined with vectorized environments or
+           asynchronous rollouts
+        2. every rollout step collects one sample per worker, for feedforward
+           and goal-conditioned policies
+        3. the samples of every worker are stored contiguously, so that they
+           can be linked by n-step returns
+        """
+        # test case 1
+        policy_params = self.init_parameters.copy()
+        policy_params['policy'] = FeedForwardPolicy
+        policy_params['num_rollout_workers'] = 2
+        policy_params['_init_setup_model'] = False
+        self.assertRaises(ValueError, OffPolicyRLAlgorithm,
+                          num_envs=2, **policy_params)
+        self.assertRaises(ValueError, OffPolicyRLAlgorithm,
+                          async_rollouts=True, **policy_params)
+
+        # test case 2
+        ray.init(num_cpus=2)
+        self.addCleanup(ray.shutdown)
+
+        policy_params['_init_setup_model'] = True
+        policy_params['nb_rollout_steps'] = 3
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        self.assertEqual(len(alg.rollout_workers), 2)
+
+        alg.learn(6, log_dir='results', initial_exploration_steps=5)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 12)
+        self.assertEqual(alg.total_steps, 6)
+        self.assertEqual(len(alg.epoch_actions), 6)
+        shutil.rmtree('results')
+
+        policy_params['policy'] = GoalConditionedPolicy
+        policy_params['policy_kwargs'] = {'meta_period': 2}
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        self.assertEqual(alg.policy_tf.num_envs, 2)
+
+        alg.learn(6, log_dir='results', initial_exploration_steps=5)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 6)
+        np.testing.assert_array_equal(alg.policy_tf._num_steps, [0, 0])
+        shutil.rmtree('results')
+
+        # test case 3
+        policy_params['policy'] = FeedForwardPolicy
+        policy_params['policy_kwargs'] = {'n_step': 3}
+        alg = OffPolicyRLAlgorithm(**policy_params)
+        alg.learn(0, log_dir='results', initial_exploration_steps=6)
+        self.assertEqual(len(alg.policy_tf.replay_buffer), 6)
+
+        # The first transitions of both workers start 3-step samples.
+        gamma = alg.policy_tf.gamma
+        samples = alg.policy_tf.replay_buffer._encode_n_step_sample(
+            np.array([0, 3]), 3, gamma)
+        np.testing.assert_almost_equal(samples[5], [gamma ** 3, gamma ** 3])
+        shutil.rmtree('results')
+
+    def test_session_threads(self):
+        """Validate the thread-pool configuration of the session.
+
+        This is done for the following cases:
+
+        1. the sizes of the thread pools default to `n_cpus`, and can be
+           specified separately
+        2. autotuning picks one of the candidate sizes for both thread pools
+        """
+        policy_params = self.init_parameters.copy()
+        policy_params['policy'] = FeedForwardPolicy
+
+        # test case 1
+        alg = OffPolicyRLAlgorithm(n_cpus=2, **policy_params)
+        self.assertEqual(alg.intra_op_threads, 2)
+        self.assertEqual(alg.inter_op_threads, 2)
+
+        alg = OffPolicyRLAlgorithm(
+            n_cpus=2, intra_op_threads=4, inter_op_threads=1,
+            **policy_params)
+        self.assertEqual(alg.intra_op_threads, 4)
+        self.assertEqual(alg.inter_op_threads, 1)
+
+        # test case 2
+        alg = OffPolicyRLAlgorithm(
+            n_cpus=3, autotune_threads=True, **policy_params)
+        self.assertIn(alg.intra_op_threads, [1, 2, 3])
+        self.assertEqual(alg.inter_op_threads, alg.intra_op_threads)
+
     def test_evaluate(self):
         """Validate the functionality of the _evaluate method."""
         pass
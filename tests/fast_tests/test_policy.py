@@ -356,6 +356,60 @@ class TestTD3FeedForwardPolicy(unittest.TestCase):
                 target_val = policy.sess.run(target)
             np.testing.assert_almost_equal(model_val, target_val)
 
+    def test_update_many(self):
+        """Validate the update_many() and update_from_batches() methods.
+
+        This is done for the following cases:
+
+        1. no update steps are performed if the replay buffer cannot be
+           sampled from
+        2. one update step is performed per element of `update_actor`, and
+           the actor is only updated when requested
+        3. the TD errors of every batch are returned by update_from_batches if
+           `return_td_error` is set to True
+        """
+        policy_params = self.policy_params.copy()
+        policy_params['batch_size'] = 4
+        policy_params['prioritized_replay'] = True
+        policy = TD3FeedForwardPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        # test case 1
+        critic_loss, actor_loss = policy.update_many([True, False])
+        self.assertListEqual(critic_loss, [[0, 0], [0, 0]])
+        self.assertListEqual(actor_loss, [0, 0])
+
+        # test case 2
+        for _ in range(10):
+            policy.store_transition(
+                obs0=np.random.uniform(size=2),
+                context0=np.random.uniform(size=3),
+                action=np.random.uniform(size=1),
+                reward=np.random.uniform(),
+                obs1=np.random.uniform(size=2),
+                context1=np.random.uniform(size=3),
+                done=False,
+                is_final_step=False)
+
+        critic_loss, actor_loss = policy.update_many([True, False, True])
+        self.assertEqual(len(critic_loss), 3)
+        self.assertEqual(len(actor_loss), 3)
+        self.assertEqual(actor_loss[1], 0)
+
+        # test case 3
+        critic_loss, actor_loss, td_error = policy.update_from_batches(
+            obs0=np.zeros((2, 4, 5)),
+            actions=np.zeros((2, 4, 1)),
+            rewards=np.zeros((2, 4)),
+            obs1=np.zeros((2, 4, 5)),
+            terminals1=np.zeros((2, 4)),
+            update_actor=False,
+            return_td_error=True)
+        self.assertEqual(len(critic_loss), 2)
+        self.assertListEqual(actor_loss, [0, 0])
+        self.assertTupleEqual(td_error.shape, (2, 4))
+
     def test_store_transition(self):
         """Test the `store_transition` method."""
         pass  # TODO
@@ -592,11 +646,11 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
 
         for i in range(4):
             obs0 = np.array([i for _ in range(2)])
-            context0 = np.array([i for _ in range(3)])
+            context0 = np.array([i for _ in range(2)])
             action = np.array([i for _ in range(1)])
             reward = i
             obs1 = np.array([i+1 for _ in range(2)])
-            context1 = np.array([i for _ in range(3)])
+            context1 = np.array([i for _ in range(2)])
             done, is_final_step, evaluate = False, False, False
 
             policy.store_transition(
@@ -612,8 +666,9 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
             )
 
         # unchanged sample
-        meta_obs, meta_action, meta_reward, worker_obses, worker_actions, \
-            worker_rewards, worker_dones = policy.replay_buffer._storage[0]
+        meta_action = policy.replay_buffer.meta_action_t[0]
+        worker_obses = policy.replay_buffer.worker_obses_t[0]
+        worker_rewards = policy.replay_buffer.worker_rewards_t[0]
 
         # check the worker rewards
         for i, rew, in enumerate(reversed(worker_rewards)):
@@ -627,8 +682,9 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
             np.testing.assert_almost_equal(obs[-2:], np.array([5, 5]))
 
         # hindsight sample
-        meta_obs, meta_action, meta_reward, worker_obses, worker_actions, \
-            worker_rewards, worker_dones = policy.replay_buffer._storage[1]
+        meta_action = policy.replay_buffer.meta_action_t[1]
+        worker_obses = policy.replay_buffer.worker_obses_t[1]
+        worker_rewards = policy.replay_buffer.worker_rewards_t[1]
 
         # check the meta action
         np.testing.assert_almost_equal(meta_action, np.array([4, 4]))
@@ -660,11 +716,11 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
 
         for i in range(4):
             obs0 = np.array([i for _ in range(2)])
-            context0 = np.array([i for _ in range(3)])
+            context0 = np.array([i for _ in range(2)])
             action = np.array([i for _ in range(1)])
             reward = i
             obs1 = np.array([i+1 for _ in range(2)])
-            context1 = np.array([i for _ in range(3)])
+            context1 = np.array([i for _ in range(2)])
             done, is_final_step, evaluate = False, False, False
 
             policy.store_transition(
@@ -680,8 +736,9 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
             )
 
         # unchanged sample
-        meta_obs, meta_action, meta_reward, worker_obses, worker_actions, \
-            worker_rewards, worker_dones = policy.replay_buffer._storage[0]
+        meta_action = policy.replay_buffer.meta_action_t[0]
+        worker_obses = policy.replay_buffer.worker_obses_t[0]
+        worker_rewards = policy.replay_buffer.worker_rewards_t[0]
 
         # check the meta action
         np.testing.assert_almost_equal(meta_action, np.array([5, 5]))
@@ -695,8 +752,9 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
             np.testing.assert_almost_equal(rew, -np.sqrt(2) * 4, decimal=3)
 
         # hindsight sample
-        meta_obs, meta_action, meta_reward, worker_obses, worker_actions, \
-            worker_rewards, worker_dones = policy.replay_buffer._storage[1]
+        meta_action = policy.replay_buffer.meta_action_t[1]
+        worker_obses = policy.replay_buffer.worker_obses_t[1]
+        worker_rewards = policy.replay_buffer.worker_rewards_t[1]
 
         # check the meta action
         np.testing.assert_almost_equal(meta_action, np.array([4, 4]))
@@ -709,6 +767,53 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
         for i, rew, in enumerate(reversed(worker_rewards)):
             np.testing.assert_almost_equal(rew, -np.sqrt(2) * i, decimal=3)
 
+    def test_lazy_hindsight(self):
+        """Check the functionality of the lazy_hindsight feature.
+
+        Every meta period should only be stored once, and hindsight goals
+        should be assigned when the samples are drawn from the replay buffer.
+        """
+        policy_params = self.policy_params.copy()
+        policy_params['relative_goals'] = False
+        policy_params['hindsight'] = True
+        policy_params['lazy_hindsight'] = True
+        policy_params['hindsight_strategy'] = "final"
+        policy_params['hindsight_fraction'] = 1
+        policy_params['meta_period'] = 4
+        policy_params['batch_size'] = 2
+        policy = TD3GoalConditionedPolicy(**policy_params)
+
+        policy.meta_action = np.array([5, 5])
+        policy.meta_reward = 0
+
+        for i in range(4):
+            policy.store_transition(
+                obs0=np.array([i for _ in range(2)]),
+                context0=np.array([i for _ in range(2)]),
+                action=np.array([i for _ in range(1)]),
+                reward=i,
+                obs1=np.array([i+1 for _ in range(2)]),
+                context1=np.array([i for _ in range(2)]),
+                done=False,
+                is_final_step=False,
+                evaluate=False
+            )
+
+        # Only the original sample is stored.
+        self.assertEqual(len(policy.replay_buffer), 1)
+        np.testing.assert_almost_equal(
+            policy.replay_buffer.meta_action_t[0], np.array([5, 5]))
+
+        # All samples are relabeled with the final observation.
+        meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
+            worker_obs1, worker_act, worker_rew, worker_done, _ = \
+            policy.replay_buffer._encode_sample(np.array([0, 0]))
+
+        np.testing.assert_almost_equal(meta_act, [[4, 4], [4, 4]])
+        np.testing.assert_almost_equal(worker_obs0[:, -2:], [[4, 4], [4, 4]])
+        np.testing.assert_almost_equal(
+            worker_rew, -np.sqrt(2) * (4 - worker_obs1[:, 0]), decimal=3)
+
     def test_meta_period(self):
         """Verify that the rate of the Manager is dictated by meta_period."""
         # Test for a meta period of 5.
@@ -762,6 +867,75 @@ class TestBaseGoalConditionedPolicy(unittest.TestCase):
             -2.2360679775221506
         )
 
+        # Clear the graph.
+        tf.compat.v1.reset_default_graph()
+
+        # The goals of the Worker are not bounded by the action space of the
+        # Manager, so quantized encodings use running bounds for them.
+        policy_params["obs_encoding"] = "uint8"
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        encoder = policy.replay_buffer._obs_encoders["obs"]
+        np.testing.assert_array_equal(
+            encoder._fixed, [True, True, False, False])
+
+        obs = np.array([[0, 0, -10, 10]])
+        encoder.update(obs)
+        np.testing.assert_almost_equal(
+            encoder.decode(encoder.encode(obs)), obs, 1)
+
+    def test_hindsight_actions_goals(self):
+        """Check the functionality of the _hindsight_actions_goals() method.
+
+        The hindsight goals and rewards are compared against a step-by-step
+        implementation of the procedure, for relative and absolute goals, and
+        for short and full meta periods.
+        """
+        def hindsight_actions_goals(policy, meta_action, observations):
+            goal_dim = meta_action.shape[0]
+            observations = observations.copy()
+            rewards = np.zeros(len(observations) - 1)
+            hindsight_goal = 0 if policy.relative_goals \
+                else observations[-1][:goal_dim].copy()
+            obs_tp1 = observations[-1].copy()
+
+            for i in range(1, len(observations) + 1):
+                obs_t = observations[-i].copy()
+                if policy.relative_goals:
+                    hindsight_goal = hindsight_goal \
+                        + obs_tp1[:goal_dim] - obs_t[:goal_dim]
+                if i > 1:
+                    rewards[-(i - 1)] = policy.worker_reward_scale \
+                        * policy.worker_reward_fn(
+                            obs_t, hindsight_goal, obs_tp1)
+                obs_tp1 = obs_t
+                observations[-i][-goal_dim:] = hindsight_goal
+
+            return hindsight_goal, observations, rewards
+
+        for relative_goals in [False, True]:
+            policy_params = self.policy_params.copy()
+            policy_params['relative_goals'] = relative_goals
+            policy_params['meta_period'] = 4
+            policy = TD3GoalConditionedPolicy(**policy_params)
+
+            for length in [2, 4]:
+                meta_action = np.random.uniform(-1, 1, 2)
+                observations = np.random.uniform(-1, 1, (length + 1, 4))
+                observations[:, -2:] = meta_action
+
+                goal, obs, rewards = policy._hindsight_actions_goals(
+                    meta_action=meta_action,
+                    initial_observations=observations)
+                expected_goal, expected_obs, expected_rewards = \
+                    hindsight_actions_goals(policy, meta_action, observations)
+
+                np.testing.assert_almost_equal(goal, expected_goal)
+                np.testing.assert_almost_equal(obs, expected_obs)
+                np.testing.assert_almost_equal(rewards, expected_rewards)
+
+            # Clear the graph.
+            tf.compat.v1.reset_default_graph()
+
     def test_sample_best_meta_action(self):
         """Check the functionality of the _sample_best_meta_action() method."""
         pass  # TODO
@@ -1042,13 +1216,231 @@ class TestTD3GoalConditionedPolicy(unittest.TestCase):
             np.testing.assert_almost_equal(model_val, target_val)
 
     def test_log_probs(self):
-        """Check the functionality of the log_probs() method."""
-        pass  # TODO
+        """Check the functionality of the log_probs() method.
+
+        The fitness of every candidate goal is compared against the fitness
+        computed separately for every element of the batch and candidate.
+        """
+        policy_params = self.policy_params.copy()
+        policy_params['relative_goals'] = True
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        batch_size, num_samples, meta_period = 3, 4, 5
+        meta_actions = np.random.randn(batch_size, 2, num_samples)
+        worker_obses = np.random.randn(batch_size, 4, meta_period + 1)
+        worker_actions = np.random.randn(batch_size, 1, meta_period)
+
+        fitness = policy._log_probs(meta_actions, worker_obses, worker_actions)
+        self.assertTupleEqual(fitness.shape, (batch_size, num_samples))
+
+        for i in range(batch_size):
+            for j in range(num_samples):
+                obs = worker_obses[i, :2, :-1].T
+                goals = meta_actions[i, :, j] + obs - obs[0]
+                actions = policy.worker.get_action(obs, goals, False, False)
+                self.assertAlmostEqual(
+                    fitness[i, j],
+                    -np.sum(np.mean(
+                        np.square(worker_actions[i].T - actions), axis=1)),
+                    places=4)
+
+    def test_in_graph_corrections(self):
+        """Check the functionality of the in_graph_corrections feature.
+
+        The Worker actions are set to the actions of the Worker policy given
+        the original goals, so the original goals should be the most likely
+        goals.
+        """
+        policy_params = self.policy_params.copy()
+        policy_params['off_policy_corrections'] = True
+        policy_params['in_graph_corrections'] = True
+        policy_params['meta_period'] = 3
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        batch_size = 4
+        goal_space = policy.manager.ac_space
+        meta_actions = np.random.uniform(
+            goal_space.low, goal_space.high, (batch_size, 2))
+        worker_obses = np.random.randn(batch_size, 4, 4)
+        worker_actions = np.array([
+            policy.worker.get_action(
+                worker_obses[i, :2, :-1].T,
+                np.tile(meta_actions[i], (3, 1)),
+                False, False).T
+            for i in range(batch_size)
+        ])
+
+        # The relabeled goals are used by the Manager unless goals are fed.
+        relabeled_goals = policy.sess.run(
+            policy.manager.action_ph,
+            feed_dict={
+                policy.meta_obs0_ph: worker_obses[:, :, 0],
+                policy.meta_obs1_ph: worker_obses[:, :, -1],
+                policy.meta_actions_ph: meta_actions,
+                policy.worker_obses_ph: worker_obses,
+                policy.worker_actions_ph: worker_actions,
+            })
+        np.testing.assert_almost_equal(relabeled_goals, meta_actions, 5)
+
+    def test_in_graph_corrections_truncated(self):
+        """Check the in_graph_corrections feature for short meta periods.
+
+        The meta period ends after two of three steps, so the last Worker
+        observation is padding. The Worker actions are set to the actions of
+        the Worker policy given the change in state over the meta period, so
+        this goal should be selected by both the tensorflow and numpy
+        implementations.
+        """
+        policy_params = self.policy_params.copy()
+        policy_params['off_policy_corrections'] = True
+        policy_params['in_graph_corrections'] = True
+        policy_params['meta_period'] = 3
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        batch_size = 4
+        goal_space = policy.manager.ac_space
+        meta_actions = np.random.uniform(
+            goal_space.low, goal_space.high, (batch_size, 2))
+        worker_obses = np.random.uniform(-1, 1, (batch_size, 4, 4))
+        worker_obses[:, :, -1] = 0
+        meta_obs0 = np.concatenate(
+            [worker_obses[:, :2, 0], np.zeros((batch_size, 2))], axis=1)
+        meta_obs1 = np.concatenate(
+            [worker_obses[:, :2, 2], np.zeros((batch_size, 2))], axis=1)
+
+        # The mean candidate goal computed by the _sample method.
+        goals = policy._sample(meta_obs0, meta_obs1, meta_actions, 8)[:, :, -2]
+        np.testing.assert_almost_equal(
+            goals, worker_obses[:, :2, 2] - worker_obses[:, :2, 0])
+
+        worker_actions = np.array([
+            policy.worker.get_action(
+                worker_obses[i, :2, :-1].T,
+                np.tile(goals[i], (3, 1)),
+                False, False).T
+            for i in range(batch_size)
+        ])
+
+        relabeled_goals = policy.sess.run(
+            policy.manager.action_ph,
+            feed_dict={
+                policy.meta_obs0_ph: meta_obs0,
+                policy.meta_obs1_ph: meta_obs1,
+                policy.meta_actions_ph: meta_actions,
+                policy.worker_obses_ph: worker_obses,
+                policy.worker_actions_ph: worker_actions,
+            })
+        np.testing.assert_almost_equal(relabeled_goals, goals, 5)
+
+        # The numpy implementation selects the same goals.
+        np.testing.assert_almost_equal(
+            policy._sample_best_meta_action(
+                meta_obs0, meta_obs1, meta_actions, worker_obses,
+                worker_actions, k=8),
+            relabeled_goals, 5)
 
     def test_connected_gradients(self):
         """Check the functionality of the connected-gradients feature."""
         pass  # TODO
 
+    def test_update(self):
+        """Check that both levels are updated in a single session call."""
+        policy_params = self.policy_params.copy()
+        policy_params['meta_period'] = 2
+        policy_params['batch_size'] = 2
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        # Store samples in the replay buffer.
+        policy.meta_action = np.array([5, 5])
+        for i in range(8):
+            policy.store_transition(
+                obs0=np.array([i, i]),
+                context0=np.array([i, i]),
+                action=np.array([i]),
+                reward=i,
+                obs1=np.array([i+1, i+1]),
+                context1=np.array([i, i]),
+                done=False,
+                is_final_step=False,
+                evaluate=False
+            )
+
+        # Count the number of session calls.
+        num_calls = []
+        run = policy.sess.run
+
+        def counted_run(*args, **kwargs):
+            num_calls.append(1)
+            return run(*args, **kwargs)
+
+        policy.sess.run = counted_run
+
+        (m_critic_loss, w_critic_loss), (m_actor_loss, w_actor_loss) = \
+            policy.update(update_meta=True, update_meta_actor=True)
+        self.assertEqual(len(num_calls), 1)
+        self.assertEqual(len(m_critic_loss), 2)
+        self.assertEqual(len(w_critic_loss), 2)
+        self.assertNotEqual(m_actor_loss, 0)
+        self.assertNotEqual(w_actor_loss, 0)
+
+        # Check that the manager is not updated if update_meta is False.
+        (m_critic_loss, _), (m_actor_loss, _) = \
+            policy.update(update_meta=False, update_meta_actor=False)
+        self.assertEqual(len(num_calls), 2)
+        self.assertListEqual(m_critic_loss, [0, 0])
+        self.assertEqual(m_actor_loss, 0)
+
+    def test_get_action(self):
+        """Check that both levels are computed in a single session call."""
+        policy_params = self.policy_params.copy()
+        policy_params['relative_goals'] = True
+        policy = TD3GoalConditionedPolicy(**policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+        policy.initialize()
+
+        obs = np.array([[1, 2]])
+        context = np.array([[0, 0]])
+
+        # Count the number of session calls.
+        num_calls = []
+        run = policy.sess.run
+
+        def counted_run(*args, **kwargs):
+            num_calls.append(1)
+            return run(*args, **kwargs)
+
+        policy.sess.run = counted_run
+
+        # Check the case when the goal is computed by the Manager.
+        action = policy.get_action(obs, context, False, False)
+        self.assertEqual(len(num_calls), 1)
+
+        goal = policy.manager.get_action(obs, context, False, False)
+        np.testing.assert_almost_equal(policy.meta_action, goal, decimal=5)
+        np.testing.assert_almost_equal(
+            action, policy.worker.get_action(obs, goal, False, False),
+            decimal=5)
+
+        # Check the case when the goal is computed by the goal transition
+        # function.
+        policy._num_steps[0] = 1
+        policy._observations[0, 0, :2] = [3, 3]
+        policy.meta_action = np.array([[1, 1]])
+        action = policy.get_action(obs, context, False, False)
+
+        np.testing.assert_almost_equal(policy.meta_action, [[3, 2]])
+        np.testing.assert_almost_equal(
+            action, policy.worker.get_action(obs, [[3, 2]], False, False),
+            decimal=5)
+
 
 class TestSACGoalConditionedPolicy(unittest.TestCase):
     """Test GoalConditionedPolicy in hbaselines/goal_conditioned/sac.py."""
@@ -1,8 +1,17 @@
 import unittest
+import multiprocessing
+import os
+import shutil
+import tempfile
 import numpy as np
 
 from hbaselines.fcnet.replay_buffer import ReplayBuffer
-# from hbaselines.goal_conditioned.replay_buffer import HierReplayBuffer
+from hbaselines.fcnet.shared_replay_buffer import SharedReplayBuffer
+from hbaselines.goal_conditioned.replay_buffer import HierReplayBuffer
+from hbaselines.utils.segment_tree import SumSegmentTree, MinSegmentTree
+from hbaselines.utils.storage import ArrayAllocator, ObservationEncoder
+from hbaselines.utils.storage import aligned_row_size
+from hbaselines.utils.prefetch import ReplayPrefetcher
 
 
 class TestReplayBuffer(unittest.TestCase):
@@ -56,15 +65,968 @@ class TestReplayBuffer(unittest.TestCase):
         np.testing.assert_array_almost_equal(obs_tp1, [[3]])
         np.testing.assert_array_almost_equal(done, [False])
 
+    def test_add_batch(self):
+        """Check that batches of transitions are stored in order."""
+        self.replay_buffer.add_batch(
+            obs_t=np.array([[0], [1], [2]]),
+            action=np.array([[3], [4], [5]]),
+            reward=np.array([6, 7, 8]),
+            obs_tp1=np.array([[9], [10], [11]]),
+            done=np.array([0, 0, 1]),
+        )
+
+        # The first transition was overwritten by the third.
+        self.assertEqual(len(self.replay_buffer), 2)
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.obs_t, [[2], [1]])
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.action_t, [[5], [4]])
+        np.testing.assert_array_almost_equal(self.replay_buffer.reward, [8, 7])
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.obs_tp1, [[11], [10]])
+        np.testing.assert_array_almost_equal(self.replay_buffer.done, [1, 0])
+
+
+class TestDeduplicatedReplayBuffer(unittest.TestCase):
+    """Tests for the ReplayBuffer object with deduplicated observations."""
+
+    def setUp(self):
+        self.replay_buffer = ReplayBuffer(
+            buffer_size=5, batch_size=200, obs_dim=1, ac_dim=1,
+            deduplicate_obs=True)
+
+    def tearDown(self):
+        del self.replay_buffer
+
+    def _add(self, obs_t, obs_tp1):
+        self.replay_buffer.add(
+            obs_t=np.array([obs_t]),
+            action=np.array([obs_t]),
+            reward=obs_t,
+            obs_tp1=np.array([obs_tp1]),
+            done=False
+        )
+
+    def test_add_sample(self):
+        """Check the layout of the buffer and the samples it returns."""
+        # Add an episode with two transitions, and the first transition of a
+        # new episode.
+        self._add(0, 1)
+        self._add(1, 2)
+        self._add(10, 11)
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.obs[:, 0], [0, 1, 2, 10, 11])
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.valid, [True, True, False, True, False])
+        self.assertEqual(len(self.replay_buffer), 3)
+
+        # Check that the next observations are recovered, and that the slots
+        # without transitions are never sampled.
+        obs_t, actions, rewards, obs_tp1, _ = self.replay_buffer.sample()
+        np.testing.assert_array_almost_equal(obs_t, actions)
+        np.testing.assert_array_almost_equal(obs_t[:, 0], rewards)
+        np.testing.assert_array_almost_equal(
+            obs_tp1[:, 0], np.where(rewards == 10, 11, rewards + 1))
+        self.assertEqual(len(np.unique(rewards)), 3)
+
+        # Continue the episode past the end of the buffer. This replaces the
+        # first transition with the next observation of the new transition.
+        self._add(11, 12)
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.obs[:, 0], [12, 1, 2, 10, 11])
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.valid, [False, True, False, True, True])
+        self.assertEqual(len(self.replay_buffer), 3)
+
+        obs_t, _, _, obs_tp1, _ = self.replay_buffer.sample()
+        np.testing.assert_array_almost_equal(
+            np.unique(obs_t[:, 0]), [1, 10, 11])
+        np.testing.assert_array_almost_equal(obs_tp1[:, 0], obs_t[:, 0] + 1)
+
+
+class TestNStepReplayBuffer(unittest.TestCase):
+    """Tests for the n-step samples of the ReplayBuffer object."""
+
+    def _replay_buffer(self, deduplicate_obs):
+        """Return a replay buffer that has wrapped around.
+
+        The buffer holds the transitions 1 -> 2 -> 3 -> 4 (terminal) of the
+        first episode, and 10 -> 11 -> 12 of the second episode. The reward of
+        every transition is equal to its initial observation.
+        """
+        replay_buffer = ReplayBuffer(
+            buffer_size=7 if deduplicate_obs else 5, batch_size=1, obs_dim=1,
+            ac_dim=1, deduplicate_obs=deduplicate_obs)
+
+        for obs_t, done in [(0, False), (1, False), (2, False), (3, True),
+                            (10, False), (11, False)]:
+            replay_buffer.add(
+                obs_t=np.array([obs_t]),
+                action=np.array([obs_t]),
+                reward=obs_t,
+                obs_tp1=np.array([obs_t + 1]),
+                done=done,
+            )
+
+        return replay_buffer
+
+    def _check(self, replay_buffer, idxes):
+        obs_t, actions, rewards, obs_tpn, done, discount = \
+            replay_buffer._encode_sample(np.array(idxes), n_step=3, gamma=0.5)
+
+        np.testing.assert_array_almost_equal(obs_t[:, 0], [1, 2, 3, 10, 11])
+        np.testing.assert_array_almost_equal(actions[:, 0], [1, 2, 3, 10, 11])
+
+        # Samples are cut short at the end of an episode and at the most
+        # recent transition.
+        np.testing.assert_array_almost_equal(
+            rewards, [1 + 0.5 * 2 + 0.25 * 3, 2 + 0.5 * 3, 3,
+                      10 + 0.5 * 11, 11])
+        np.testing.assert_array_almost_equal(obs_tpn[:, 0], [4, 4, 4, 12, 12])
+        np.testing.assert_array_almost_equal(done, [1, 1, 1, 0, 0])
+        np.testing.assert_array_almost_equal(
+            discount, [0.125, 0.25, 0.5, 0.25, 0.5])
+
+    def test_n_step(self):
+        """Validate the n-step samples, with wraparound."""
+        replay_buffer = self._replay_buffer(deduplicate_obs=False)
+        self._check(replay_buffer, [1, 2, 3, 4, 0])
+
+        # Check that the samples are returned by the `sample` method.
+        *_, discount = replay_buffer.sample(n_step=3, gamma=0.5)
+        self.assertEqual(discount.shape, (1,))
+
+    def test_n_step_deduplicated(self):
+        """Validate the n-step samples of buffers with deduplicated obs."""
+        replay_buffer = self._replay_buffer(deduplicate_obs=True)
+        self._check(replay_buffer, [1, 2, 3, 5, 6])
+
+
+class TestPrioritizedReplayBuffer(unittest.TestCase):
+    """Tests for the ReplayBuffer object with prioritized sampling."""
+
+    def setUp(self):
+        self.replay_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1000, obs_dim=1, ac_dim=1,
+            prioritized=True, alpha=1, beta=1, eps=0)
+
+        for i in range(4):
+            self.replay_buffer.add(
+                obs_t=np.array([i]),
+                action=np.array([i]),
+                reward=i,
+                obs_tp1=np.array([i + 1]),
+                done=False
+            )
+
+    def tearDown(self):
+        del self.replay_buffer
+
+    def test_sample(self):
+        """Check that the samples are drawn in proportion to the priorities.
+
+        This also validates the importance weights and returned indices.
+        """
+        # All new samples are assigned the same priority.
+        obs_t, _, rewards, _, _, weights, idxes = self.replay_buffer.sample()
+        np.testing.assert_array_almost_equal(obs_t[:, 0], idxes)
+        np.testing.assert_array_almost_equal(rewards, idxes)
+        np.testing.assert_array_almost_equal(weights, np.ones(1000))
+        np.testing.assert_array_almost_equal(
+            np.bincount(idxes, minlength=4), [250, 250, 250, 250])
+
+        # Update the priorities of the elements.
+        self.replay_buffer.update_priorities([0, 1, 2, 3], [-1, 2, 3, 4])
+        obs_t, _, _, _, _, weights, idxes = self.replay_buffer.sample()
+        np.testing.assert_array_almost_equal(obs_t[:, 0], idxes)
+        np.testing.assert_array_almost_equal(
+            np.bincount(idxes, minlength=4), [100, 200, 300, 400])
+        np.testing.assert_array_almost_equal(weights, 1 / (idxes + 1))
+
+    def test_sample_many(self):
+        """Validate the `sample_many` method of the replay buffer.
+
+        Every batch is stratified separately, so every batch should contain
+        samples in proportion to the priorities.
+        """
+        self.replay_buffer.update_priorities([0, 1, 2, 3], [1, 2, 3, 4])
+        obs_t, actions, rewards, obs_tp1, done, weights, idxes = \
+            self.replay_buffer.sample_many(3)
+
+        self.assertEqual(obs_t.shape, (3, 1000, 1))
+        self.assertEqual(actions.shape, (3, 1000, 1))
+        self.assertEqual(rewards.shape, (3, 1000))
+        self.assertEqual(obs_tp1.shape, (3, 1000, 1))
+        self.assertEqual(done.shape, (3, 1000))
+        self.assertEqual(weights.shape, (3, 1000))
+        self.assertEqual(idxes.shape, (3, 1000))
+
+        np.testing.assert_array_almost_equal(obs_t[:, :, 0], idxes)
+        np.testing.assert_array_almost_equal(obs_tp1[:, :, 0], idxes + 1)
+        for i in range(3):
+            np.testing.assert_array_almost_equal(
+                np.bincount(idxes[i], minlength=4), [100, 200, 300, 400])
+
+
+class TestSegmentTree(unittest.TestCase):
+    """Tests for the SumSegmentTree and MinSegmentTree objects."""
+
+    def test_sum_tree(self):
+        tree = SumSegmentTree(5)
+        self.assertEqual(tree.capacity, 8)
+
+        tree[2] = 1.0
+        tree[np.array([0, 4])] = np.array([2.0, 3.0])
+        self.assertAlmostEqual(tree.reduce(), 6.0)
+        np.testing.assert_array_almost_equal(tree[[0, 1, 2, 4]], [2, 0, 1, 3])
+
+        np.testing.assert_array_equal(
+            tree.find_prefixsum_idx([0.0, 1.99, 2.5, 3.01, 5.99]),
+            [0, 0, 2, 4, 4])
+
+    def test_min_tree(self):
+        tree = MinSegmentTree(4)
+        tree[np.array([0, 1, 2, 3])] = np.array([4.0, 3.0, 2.0, 5.0])
+        self.assertAlmostEqual(tree.reduce(), 2.0)
+
+        tree[2] = 6.0
+        self.assertAlmostEqual(tree.reduce(), 3.0)
+
+
+class TestArrayAllocator(unittest.TestCase):
+    """Tests for the storage backends of the replay buffers."""
+
+    def test_aligned_row_size(self):
+        self.assertEqual(aligned_row_size(4, page_size=4096), 4)
+        self.assertEqual(aligned_row_size(120, page_size=4096), 128)
+        self.assertEqual(aligned_row_size(4096, page_size=4096), 4096)
+        self.assertEqual(aligned_row_size(4100, page_size=4096), 8192)
+
+    def test_memmap(self):
+        allocator = ArrayAllocator(storage="memmap")
+        path = allocator.path
+        arr = allocator.zeros("arr", (10, 3, 5))
+
+        # Check that the array is a view of a padded memory-mapped file.
+        self.assertIsInstance(arr, np.memmap)
+        self.assertEqual(arr.shape, (10, 3, 5))
+        self.assertEqual(arr.strides[0], 64)
+        self.assertTrue(os.path.isfile(os.path.join(path, "arr.dat")))
+
+        # Check that the array can be written to and gathered from.
+        arr[4] = np.arange(15).reshape(3, 5)
+        np.testing.assert_array_almost_equal(arr[[4, 0], 2], [
+            [10, 11, 12, 13, 14], [0, 0, 0, 0, 0]])
+
+        # Check that the files are deleted with the allocator.
+        del allocator, arr
+        self.assertFalse(os.path.isdir(path))
+
+    def test_bad_storage(self):
+        self.assertRaises(ValueError, ArrayAllocator, storage="disk")
+
+    def test_memmap_replay_buffer(self):
+        """Validate the samples of memory-mapped replay buffers."""
+        replay_buffer = ReplayBuffer(
+            buffer_size=2, batch_size=1, obs_dim=3, ac_dim=1,
+            storage="memmap")
+        self.assertIsInstance(replay_buffer.obs_t, np.memmap)
+
+        replay_buffer.add(
+            obs_t=np.array([0, 1, 2]),
+            action=np.array([3]),
+            reward=4,
+            obs_tp1=np.array([5, 6, 7]),
+            done=True
+        )
+        obs_t, actions_t, rewards, obs_tp1, done = replay_buffer.sample()
+        np.testing.assert_array_almost_equal(obs_t, [[0, 1, 2]])
+        np.testing.assert_array_almost_equal(actions_t, [[3]])
+        np.testing.assert_array_almost_equal(rewards, [4])
+        np.testing.assert_array_almost_equal(obs_tp1, [[5, 6, 7]])
+        np.testing.assert_array_almost_equal(done, [True])
+
+
+class TestObservationEncoder(unittest.TestCase):
+    """Tests for the ObservationEncoder object."""
+
+    def test_float16(self):
+        encoder = ObservationEncoder("float16", 2)
+        q = encoder.encode([0.5, 2.])
+        self.assertEqual(q.dtype, np.float16)
+        self.assertEqual(encoder.decode(q).dtype, np.float32)
+        np.testing.assert_array_almost_equal(encoder.decode(q), [0.5, 2.])
+        self.assertFalse(encoder.update([10., 10.]))
+
+    def test_fixed_bounds(self):
+        encoder = ObservationEncoder(
+            "uint8", 2, low=[0., -1.], high=[1., 1.])
+        q = encoder.encode(np.array([[0., -1.], [1., 1.], [0.25, 2.]]))
+        self.assertEqual(q.dtype, np.uint8)
+        np.testing.assert_array_equal(q, [[0, 0], [255, 255], [64, 255]])
+        np.testing.assert_array_almost_equal(
+            encoder.decode(q), [[0, -1], [1, 1], [0.25, 1]], decimal=2)
+        self.assertFalse(encoder.update([10., 10.]))
+
+    def test_running_bounds(self):
+        encoder = ObservationEncoder(
+            "uint16", 2, low=[0., -np.inf], high=[1., np.inf], margin=0)
+
+        self.assertTrue(encoder.update([[0., 2.], [1., 4.]]))
+        np.testing.assert_array_almost_equal(encoder.low, [0, 2])
+        np.testing.assert_array_almost_equal(encoder.high, [1, 4])
+        q = encoder.encode([0.5, 3.])
+        np.testing.assert_array_almost_equal(
+            encoder.decode(q), [0.5, 3.], decimal=4)
+
+        # Expand the range, and re-encode the previous observation.
+        offset, scale = encoder.offset, encoder.scale
+        self.assertTrue(encoder.update([0.5, 6.]))
+        encoder.requantize(q.reshape(1, 2), offset, scale)
+        np.testing.assert_array_almost_equal(
+            encoder.decode(q), [0.5, 3.], decimal=4)
+        self.assertFalse(encoder.update([0.5, 5.]))
+
+    def test_quantized_replay_buffer(self):
+        """Check the observations returned by quantized replay buffers."""
+        replay_buffer = ReplayBuffer(
+            buffer_size=2, batch_size=1, obs_dim=2, ac_dim=1,
+            obs_encoding="uint8", obs_low=[0, -np.inf], obs_high=[1, np.inf])
+        self.assertEqual(replay_buffer.obs_t.dtype, np.uint8)
+
+        replay_buffer.add(
+            obs_t=np.array([0.2, 0.]),
+            action=np.array([1]),
+            reward=2,
+            obs_tp1=np.array([0.4, 10.]),
+            done=False
+        )
+        obs_t, _, _, obs_tp1, _ = replay_buffer.sample()
+        self.assertEqual(obs_t.dtype, np.float32)
+        np.testing.assert_array_almost_equal(obs_t, [[0.2, 0.]], decimal=2)
+        np.testing.assert_array_almost_equal(
+            obs_tp1, [[0.4, 10.]], decimal=2)
+
+
+class TestReplayBufferSnapshot(unittest.TestCase):
+    """Tests for the save and load methods of the replay buffers."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @staticmethod
+    def _add(replay_buffer, i):
+        replay_buffer.add(
+            obs_t=np.array([i, i]),
+            action=np.array([i]),
+            reward=i,
+            obs_tp1=np.array([i + 1, i + 1]),
+            done=False
+        )
+
+    def test_full(self):
+        """Check that full snapshots restore all elements and indices."""
+        replay_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1)
+        for i in range(3):
+            self._add(replay_buffer, i)
+        replay_buffer.save(os.path.join(self.path, "snap"))
+
+        new_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1)
+        new_buffer.load(os.path.join(self.path, "snap"))
+        self.assertEqual(len(new_buffer), 3)
+        self.assertIsInstance(new_buffer.obs_t, np.memmap)
+        np.testing.assert_array_almost_equal(
+            new_buffer.obs_t, [[0, 0], [1, 1], [2, 2], [0, 0]])
+        np.testing.assert_array_almost_equal(new_buffer.reward, [0, 1, 2, 0])
+
+        # Check that new elements can be added, without modifying the files.
+        self._add(new_buffer, 7)
+        np.testing.assert_array_almost_equal(new_buffer.reward, [0, 1, 2, 7])
+        np.testing.assert_array_almost_equal(
+            np.load(os.path.join(self.path, "snap", "reward.npy")),
+            [0, 1, 2, 0])
+
+        # Check that mismatched buffers cannot be loaded.
+        bad_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=3, ac_dim=1)
+        self.assertRaises(ValueError, bad_buffer.load,
+                          os.path.join(self.path, "snap"))
+
+    def test_memmap(self):
+        """Check that memory-mapped buffers keep their own files on load."""
+        replay_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1)
+        for i in range(3):
+            self._add(replay_buffer, i)
+        replay_buffer.save(os.path.join(self.path, "snap"))
+
+        new_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1,
+            storage="memmap")
+        reward = new_buffer.reward
+        new_buffer.load(os.path.join(self.path, "snap"))
+        self.assertIs(new_buffer.reward, reward)
+        np.testing.assert_array_almost_equal(new_buffer.reward, [0, 1, 2, 0])
+
+        # New elements are written to the files of the buffer.
+        self._add(new_buffer, 7)
+        allocator = ArrayAllocator.attach(
+            new_buffer._allocator.path, storage="memmap")
+        np.testing.assert_array_almost_equal(
+            allocator.zeros("reward", (4,)), [0, 1, 2, 7])
+
+    def test_incremental(self):
+        """Check that incremental snapshots only store new elements."""
+        replay_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1,
+            prioritized=True, alpha=1)
+        for i in range(3):
+            self._add(replay_buffer, i)
+        replay_buffer.save(os.path.join(self.path, "snap1"), incremental=True)
+
+        # Add elements past the end of the buffer.
+        for i in range(3, 5):
+            self._add(replay_buffer, i)
+        replay_buffer.update_priorities([0, 1], [2, 3])
+        replay_buffer.save(os.path.join(self.path, "snap2"), incremental=True)
+        np.testing.assert_array_almost_equal(
+            np.load(os.path.join(self.path, "snap2", "reward.npy")), [3, 4])
+        np.testing.assert_array_almost_equal(
+            np.load(os.path.join(self.path, "snap2", "_rows.npy")), [3, 0])
+
+        new_buffer = ReplayBuffer(
+            buffer_size=4, batch_size=1, obs_dim=2, ac_dim=1,
+            prioritized=True, alpha=1)
+        new_buffer.load(os.path.join(self.path, "snap2"))
+        self.assertEqual(len(new_buffer), 4)
+        self.assertEqual(new_buffer._next_idx, 1)
+        np.testing.assert_array_almost_equal(new_buffer.reward, [4, 1, 2, 3])
+        np.testing.assert_array_almost_equal(
+            new_buffer.obs_tp1[:, 0], [5, 2, 3, 4])
+        self.assertAlmostEqual(new_buffer._it_sum.reduce(), 7, places=5)
+        self.assertAlmostEqual(new_buffer._max_priority, 3, places=5)
+
+    def test_hier(self):
+        """Check that the hierarchical replay buffer can be restored."""
+        kwargs = dict(
+            buffer_size=2,
+            batch_size=1,
+            meta_period=2,
+            meta_obs_dim=1,
+            meta_ac_dim=1,
+            worker_obs_dim=1,
+            worker_ac_dim=1)
+        replay_buffer = HierReplayBuffer(**kwargs)
+        replay_buffer.add(
+            obs_t=[np.array([0]), np.array([1])],
+            goal_t=np.array([2]),
+            action_t=[np.array([3])],
+            reward_t=[4],
+            done=[True],
+            meta_obs_t=(np.array([5]), np.array([6])),
+            meta_reward_t=7,
+        )
+        replay_buffer.save(os.path.join(self.path, "snap"))
+
+        new_buffer = HierReplayBuffer(**kwargs)
+        new_buffer.load(os.path.join(self.path, "snap"))
+        self.assertEqual(len(new_buffer), 1)
+        np.testing.assert_array_almost_equal(new_buffer.lengths, [1, 0])
+        np.testing.assert_array_almost_equal(
+            new_buffer.worker_obses_t[0], [[0], [1], [0]])
+        np.testing.assert_array_almost_equal(new_buffer.meta_reward_t, [7, 0])
+
+
+class TestSharedReplayBuffer(unittest.TestCase):
+    """Tests for the SharedReplayBuffer object."""
+
+    def setUp(self):
+        self.replay_buffer = SharedReplayBuffer(
+            buffer_size=8, batch_size=16, obs_dim=1, ac_dim=1, num_shards=2)
+
+    def tearDown(self):
+        del self.replay_buffer
+
+    @staticmethod
+    def _add(path, shard, num_transitions):
+        """Add transitions to a shard from an attached buffer."""
+        replay_buffer = SharedReplayBuffer.attach(path, shard=shard)
+        for i in range(num_transitions):
+            value = 100 * shard + i
+            replay_buffer.add(
+                obs_t=np.array([value]),
+                action=np.array([value]),
+                reward=value,
+                obs_tp1=np.array([value + 1]),
+                done=False,
+            )
+
+    def test_attach(self):
+        """Check that transitions added by other processes are sampled."""
+        path = self.replay_buffer.path
+        self.assertTrue(os.path.isfile(os.path.join(path, "info.json")))
+
+        processes = [
+            multiprocessing.Process(target=self._add, args=(path, shard, n))
+            for shard, n in [(0, 2), (1, 6)]]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        # Only the three most recent transitions of the second shard can be
+        # sampled, as its oldest slot is about to be overwritten.
+        np.testing.assert_array_equal(self.replay_buffer.shard_counts, [2, 6])
+        self.assertEqual(len(self.replay_buffer), 5)
+
+        obs_t, actions_t, rewards, obs_tp1, done = self.replay_buffer.sample()
+        self.assertEqual(obs_t.shape, (16, 1))
+        self.assertTrue(set(rewards).issubset({0, 1, 103, 104, 105}))
+        np.testing.assert_array_almost_equal(obs_t[:, 0], rewards)
+        np.testing.assert_array_almost_equal(actions_t[:, 0], rewards)
+        np.testing.assert_array_almost_equal(obs_tp1[:, 0], rewards + 1)
+
+    def test_add(self):
+        """Check that transitions cannot be added without a shard."""
+        self.assertRaises(ValueError, self.replay_buffer.add,
+                          obs_t=np.array([0]), action=np.array([0]),
+                          reward=0, obs_tp1=np.array([1]), done=False)
+
+    def test_add_batch(self):
+        """Check that batches of transitions are published one at a time."""
+        replay_buffer = SharedReplayBuffer.attach(
+            self.replay_buffer.path, shard=1)
+        counts = []
+
+        class Recorder(np.ndarray):
+            """Records the published transitions before every write."""
+
+            def __setitem__(self, key, value):
+                counts.append(int(replay_buffer.shard_counts[1]))
+                super(Recorder, self).__setitem__(key, value)
+
+        replay_buffer.done = replay_buffer.done.view(Recorder)
+        replay_buffer.add_batch(
+            obs_t=np.array([[0], [1], [2]]),
+            action=np.array([[0], [1], [2]]),
+            reward=np.array([0, 1, 2]),
+            obs_tp1=np.array([[1], [2], [3]]),
+            done=np.array([False, False, False]),
+        )
+
+        self.assertEqual(counts, [0, 1, 2])
+        np.testing.assert_array_equal(self.replay_buffer.shard_counts, [0, 3])
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.reward, [0, 0, 0, 0, 0, 1, 2, 0])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, SharedReplayBuffer, buffer_size=3,
+                          batch_size=1, obs_dim=1, ac_dim=1, num_shards=2)
+        self.assertRaises(ValueError, SharedReplayBuffer, buffer_size=8,
+                          batch_size=1, obs_dim=1, ac_dim=1, num_shards=2,
+                          shard=2)
+        self.assertRaises(ValueError, SharedReplayBuffer, buffer_size=8,
+                          batch_size=1, obs_dim=1, ac_dim=1,
+                          obs_encoding="uint8")
+
+    def test_sample(self):
+        """Check that empty buffers and n-step returns cannot be sampled."""
+        self.assertRaises(ValueError, self.replay_buffer.sample)
+
+        self._add(self.replay_buffer.path, 1, 3)
+        self.assertRaises(ValueError, self.replay_buffer.sample,
+                          n_step=3, gamma=0.99)
+        self.assertRaises(ValueError, self.replay_buffer.sample_many,
+                          2, n_step=3, gamma=0.99)
+
+        *_, done = self.replay_buffer.sample(n_step=1, gamma=0.99)
+        self.assertEqual(done.shape, (16,))
+
+    def test_snapshot(self):
+        """Check that restored snapshots are visible to attached buffers."""
+        self._add(self.replay_buffer.path, 1, 3)
+        path = tempfile.mkdtemp()
+        self.replay_buffer.save(os.path.join(path, "snapshot"))
+
+        replay_buffer = SharedReplayBuffer(
+            buffer_size=8, batch_size=16, obs_dim=1, ac_dim=1, num_shards=2)
+        attached = SharedReplayBuffer.attach(replay_buffer.path)
+        replay_buffer.load(os.path.join(path, "snapshot"))
+
+        np.testing.assert_array_equal(attached.shard_counts, [0, 3])
+        np.testing.assert_array_almost_equal(
+            attached.reward, [0, 0, 0, 0, 100, 101, 102, 0])
+
+        del attached, replay_buffer
+        shutil.rmtree(path)
+
+
+class TestReplayPrefetcher(unittest.TestCase):
+    """Tests for the ReplayPrefetcher object."""
+
+    def setUp(self):
+        self.replay_buffer = HierReplayBuffer(
+            buffer_size=2,
+            batch_size=4,
+            meta_period=3,
+            meta_obs_dim=2,
+            meta_ac_dim=1,
+            worker_obs_dim=2,
+            worker_ac_dim=1)
+
+        for i in range(2):
+            self.replay_buffer.add(
+                obs_t=[np.array([i, i])] * 4,
+                goal_t=np.array([i]),
+                action_t=[np.array([i])] * 3,
+                reward_t=[i] * 3,
+                done=[False] * 3,
+                meta_obs_t=(np.array([i, i]), np.array([i, i])),
+                meta_reward_t=i,
+            )
+
+        self.prefetcher = ReplayPrefetcher(
+            self.replay_buffer, num_batches=2, with_additional=False)
+
+    def tearDown(self):
+        self.prefetcher.close()
+        del self.prefetcher
+        del self.replay_buffer
+
+    def test_get(self):
+        """Validate the minibatches returned by the `get` method.
+
+        The minibatches should not alias the arrays that are reused by the
+        replay buffer, nor the previously returned minibatch.
+        """
+        samples = self.prefetcher.get()
+        self.assertEqual(len(samples), 11)
+        self.assertIsNone(samples[-1])
+        self.assertIsNot(samples[0], self.replay_buffer.meta_obs0)
+        self.assertIsNot(samples[5], self.replay_buffer.worker_obs0)
+        np.testing.assert_array_almost_equal(samples[0][:, 0], samples[3])
+        np.testing.assert_array_almost_equal(samples[6], samples[0])
+
+        next_samples = self.prefetcher.get()
+        for val, next_val in zip(samples[:-1], next_samples[:-1]):
+            self.assertFalse(np.shares_memory(val, next_val))
+
+    def test_close(self):
+        """Check that the background thread can be stopped and restarted."""
+        self.prefetcher.get()
+        self.prefetcher.close()
+        self.assertIsNone(self.prefetcher._thread)
+        self.assertTrue(self.prefetcher._queue.empty())
+
+        samples = self.prefetcher.get()
+        self.assertEqual(samples[0].shape, (4, 2))
+
+    def test_error(self):
+        """Check that errors in the background thread are raised by `get`."""
+        # Empty replay buffers cannot be sampled from.
+        prefetcher = ReplayPrefetcher(
+            ReplayBuffer(buffer_size=2, batch_size=1, obs_dim=1, ac_dim=1), 1)
+        self.assertRaises(ValueError, prefetcher.get)
+
+        self.assertRaises(ValueError, ReplayPrefetcher, self.replay_buffer, 0)
+
+
+class TestHierReplayBuffer(unittest.TestCase):
+    """Tests for the HierReplayBuffer object."""
+
+    def setUp(self):
+        self.replay_buffer = HierReplayBuffer(
+            buffer_size=2,
+            batch_size=4,
+            meta_period=3,
+            meta_obs_dim=2,
+            meta_ac_dim=1,
+            worker_obs_dim=2,
+            worker_ac_dim=1)
+
+    def tearDown(self):
+        del self.replay_buffer
+
+    def test_buffer_size(self):
+        """Validate the buffer_size output from the replay buffer."""
+        self.assertEqual(self.replay_buffer.buffer_size, 2)
+
+    def test_add_sample(self):
+        """Test the `add` and `sample` methods the replay buffer.
+
+        The first sample contains a full meta period, while the second is
+        terminated early. Both are checked to be returned with the right
+        padding and meta done values.
+        """
+        # Add a full meta period.
+        self.replay_buffer.add(
+            obs_t=[np.array([0, 0]), np.array([1, 1]), np.array([2, 2]),
+                   np.array([3, 3])],
+            goal_t=np.array([4]),
+            action_t=[np.array([5]), np.array([6]), np.array([7])],
+            reward_t=[8, 9, 10],
+            done=[False, False, False],
+            meta_obs_t=(np.array([11, 11]), np.array([12, 12])),
+            meta_reward_t=13,
+        )
+
+        # Check is_full and can_sample in the False case.
+        self.assertEqual(self.replay_buffer.is_full(), False)
+        self.assertEqual(self.replay_buffer.can_sample(), False)
+
+        # Add a meta period that terminated after a single step.
+        self.replay_buffer.add(
+            obs_t=[np.array([20, 20]), np.array([21, 21])],
+            goal_t=np.array([22]),
+            action_t=[np.array([23])],
+            reward_t=[26],
+            done=[True],
+            meta_obs_t=(np.array([25, 25]), np.array([26, 26])),
+            meta_reward_t=27,
+        )
+
+        # Check is_full in the True case.
+        self.assertEqual(self.replay_buffer.is_full(), True)
+
+        # Test the `_encode_sample` method.
+        meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
+            worker_obs1, worker_act, worker_rew, worker_done, additional = \
+            self.replay_buffer._encode_sample(np.array([0, 1, 1, 0]))
+
+        np.testing.assert_array_almost_equal(
+            meta_obs0, [[11, 11], [25, 25], [25, 25], [11, 11]])
+        np.testing.assert_array_almost_equal(
+            meta_obs1, [[12, 12], [26, 26], [26, 26], [12, 12]])
+        np.testing.assert_array_almost_equal(meta_act, [[4], [22], [22], [4]])
+        np.testing.assert_array_almost_equal(meta_rew, [13, 27, 27, 13])
+        np.testing.assert_array_almost_equal(meta_done, [0, 1, 1, 0])
+
+        # Worker samples must come from consecutive steps of the same meta
+        # period.
+        np.testing.assert_array_almost_equal(worker_obs1 - worker_obs0, 1)
+        np.testing.assert_array_almost_equal(
+            worker_act[:, 0],
+            np.where(worker_obs0[:, 0] < 20,
+                     worker_obs0[:, 0] + 5,
+                     worker_obs0[:, 0] + 3))
+        np.testing.assert_array_almost_equal(worker_rew, worker_act[:, 0] + 3)
+        np.testing.assert_array_almost_equal(worker_done, [0, 0, 0, 0])
+
+        # Check the additional terms, which are zero-padded past the end of
+        # the meta period.
+        np.testing.assert_array_almost_equal(
+            additional["worker_obses"][1],
+            [[20, 21, 0, 0], [20, 21, 0, 0]])
+        np.testing.assert_array_almost_equal(
+            additional["worker_actions"][0], [[5, 6, 7]])
+        np.testing.assert_array_almost_equal(
+            additional["worker_actions"][1], [[23, 0, 0]])
+
+        # Check that the additional terms can be removed.
+        *_, additional = self.replay_buffer._encode_sample(
+            np.array([0, 1, 1, 0]), with_additional=False)
+        self.assertIsNone(additional)
+
+        # Overwrite the first sample and check that the padding is reset.
+        self.replay_buffer.add(
+            obs_t=[np.array([30, 30]), np.array([31, 31])],
+            goal_t=np.array([32]),
+            action_t=[np.array([33])],
+            reward_t=[34],
+            done=[False],
+            meta_obs_t=(np.array([35, 35]), np.array([36, 36])),
+            meta_reward_t=37,
+        )
+        np.testing.assert_array_almost_equal(
+            self.replay_buffer.worker_obses_t[0],
+            [[30, 30], [31, 31], [0, 0], [0, 0]])
+        self.assertEqual(self.replay_buffer.lengths[0], 1)
+
+    def test_sample_many(self):
+        """Validate the `sample_many` method of the replay buffer."""
+        for i in range(2):
+            self.replay_buffer.add(
+                obs_t=[np.array([i, i])] * 4,
+                goal_t=np.array([i]),
+                action_t=[np.array([i])] * 3,
+                reward_t=[i] * 3,
+                done=[False] * 3,
+                meta_obs_t=(np.array([i, i]), np.array([i, i])),
+                meta_reward_t=i,
+            )
+
+        meta_obs0, meta_obs1, meta_act, meta_rew, meta_done, worker_obs0, \
+            worker_obs1, worker_act, worker_rew, worker_done, additional = \
+            self.replay_buffer.sample_many(3)
+
+        self.assertEqual(meta_obs0.shape, (3, 4, 2))
+        self.assertEqual(meta_act.shape, (3, 4, 1))
+        self.assertEqual(meta_rew.shape, (3, 4))
+        self.assertEqual(worker_obs0.shape, (3, 4, 2))
+        self.assertEqual(worker_act.shape, (3, 4, 1))
+        self.assertEqual(worker_done.shape, (3, 4))
+        self.assertEqual(additional["worker_obses"].shape, (3, 4, 2, 4))
+        self.assertEqual(additional["worker_actions"].shape, (3, 4, 1, 3))
+
+        # The Manager and Worker samples of every element should match.
+        np.testing.assert_array_almost_equal(meta_obs0[:, :, 0], meta_rew)
+        np.testing.assert_array_almost_equal(worker_obs1, meta_obs0)
+        np.testing.assert_array_almost_equal(worker_act, meta_act)
+
+    def test_correction_cache(self):
+        """Validate the cache of off-policy corrections."""
+        replay_buffer = HierReplayBuffer(
+            buffer_size=2,
+            batch_size=4,
+            meta_period=3,
+            meta_obs_dim=2,
+            meta_ac_dim=1,
+            worker_obs_dim=2,
+            worker_ac_dim=1,
+            correction_staleness=2)
+
+        def add(i):
+            replay_buffer.add(
+                obs_t=[np.array([i, i])] * 4,
+                goal_t=np.array([i]),
+                action_t=[np.array([i])] * 3,
+                reward_t=[i] * 3,
+                done=[False] * 3,
+                meta_obs_t=(np.array([i, i]), np.array([i, i])),
+                meta_reward_t=i,
+            )
+
+        add(0)
+        add(1)
+        idxes = np.array([0, 1])
+        meta_act = np.array([[0], [1]])
+
+        # The sampled meta periods include their indices.
+        *_, additional = replay_buffer._encode_sample(np.array([1, 0, 1, 1]))
+        np.testing.assert_array_equal(additional["idxes"], [1, 0, 1, 1])
+
+        # Nothing is cached initially.
+        goals, stale = replay_buffer.get_corrections(idxes, meta_act, 0)
+        np.testing.assert_array_equal(stale, [True, True])
+        np.testing.assert_array_almost_equal(goals, meta_act)
+
+        # Cached corrections are reused until they become stale.
+        replay_buffer.store_corrections(
+            idxes, meta_act, np.array([[5], [6]]), version=0)
+        goals, stale = replay_buffer.get_corrections(idxes, meta_act, 2)
+        np.testing.assert_array_equal(stale, [False, False])
+        np.testing.assert_array_almost_equal(goals, [[5], [6]])
+        goals, stale = replay_buffer.get_corrections(idxes, meta_act, 3)
+        np.testing.assert_array_equal(stale, [True, True])
+
+        # Corrections are not reused for different (e.g. relabeled) goals.
+        goals, stale = replay_buffer.get_corrections(
+            idxes, np.array([[0], [7]]), 1)
+        np.testing.assert_array_equal(stale, [False, True])
+        np.testing.assert_array_almost_equal(goals, [[5], [7]])
+
+        # Corrections are removed once their meta period is replaced.
+        add(0)
+        goals, stale = replay_buffer.get_corrections(idxes, meta_act, 1)
+        np.testing.assert_array_equal(stale, [True, False])
+
+        self.assertEqual(replay_buffer.correction_lookups, 10)
+        self.assertEqual(replay_buffer.correction_hits, 4)
+        self.assertAlmostEqual(replay_buffer.correction_hit_rate, 0.4)
+
+
+class TestHindsightRelabeling(unittest.TestCase):
+    """Tests for the sample-time hindsight relabeling of HierReplayBuffer."""
+
+    @staticmethod
+    def _reward_fn(states, goals, next_states):
+        return -np.abs(next_states[:, 0] - goals[:, 0])
+
+    def _replay_buffer(self, relabel_strategy, relative_goals=False):
+        """Return a replay buffer with a single (full) meta period.
+
+        The first element of the Worker observations at step t is t, and the
+        last element (the goal) is set to 10.
+        """
+        replay_buffer = HierReplayBuffer(
+            buffer_size=1,
+            batch_size=1000,
+            meta_period=3,
+            meta_obs_dim=2,
+            meta_ac_dim=1,
+            worker_obs_dim=3,
+            worker_ac_dim=1,
+            relabel_strategy=relabel_strategy,
+            relabel_fraction=0.5,
+            relative_goals=relative_goals,
+            reward_fn=self._reward_fn,
+            reward_scale=2,
+        )
+
+        replay_buffer.add(
+            obs_t=[np.array([t, t, 10]) for t in range(4)],
+            goal_t=np.array([10]),
+            action_t=[np.array([0])] * 3,
+            reward_t=[-1] * 3,
+            done=[False] * 3,
+            meta_obs_t=(np.array([0, 0]), np.array([3, 3])),
+            meta_reward_t=0,
+        )
+
+        return replay_buffer
+
+    def test_final(self):
+        """Validate the "final" relabeling strategy."""
+        replay_buffer = self._replay_buffer("final")
+        _, _, meta_act, _, _, worker_obs0, worker_obs1, _, worker_rew, _, _ \
+            = replay_buffer.sample()
+
+        # Roughly half of the samples should be relabeled.
+        relabeled = worker_obs0[:, -1] != 10
+        self.assertGreater(relabeled.sum(), 400)
+        self.assertLess(relabeled.sum(), 600)
+
+        # The relabeled goals and Manager actions are the final observation.
+        np.testing.assert_array_almost_equal(worker_obs0[relabeled, -1], 3)
+        np.testing.assert_array_almost_equal(worker_obs1[relabeled, -1], 3)
+        np.testing.assert_array_almost_equal(meta_act[relabeled, 0], 3)
+        np.testing.assert_array_almost_equal(
+            worker_rew[relabeled], -2 * (3 - worker_obs1[relabeled, 0]))
+
+        # The remaining samples are unchanged.
+        np.testing.assert_array_almost_equal(meta_act[~relabeled, 0], 10)
+        np.testing.assert_array_almost_equal(worker_rew[~relabeled], -1)
+
+        # The stored data is not modified.
+        np.testing.assert_array_almost_equal(
+            replay_buffer.worker_obses_t[0, :, -1], 10)
+
+    def test_future(self):
+        """Validate the "future" relabeling strategy with relative goals."""
+        replay_buffer = self._replay_buffer("future", relative_goals=True)
+        _, _, meta_act, _, _, worker_obs0, worker_obs1, _, worker_rew, _, _ \
+            = replay_buffer.sample()
+
+        relabeled = worker_obs0[:, -1] != 10
+        achieved = worker_obs0[relabeled, 0] + worker_obs0[relabeled, -1]
+
+        # The hindsight goals are achieved after the sampled step.
+        self.assertTrue(np.all(achieved >= worker_obs1[relabeled, 0]))
+        self.assertTrue(np.all(achieved <= 3))
+        self.assertEqual(len(np.unique(achieved)), 3)
+        np.testing.assert_array_almost_equal(
+            worker_obs1[relabeled, 0] + worker_obs1[relabeled, -1], achieved)
+        np.testing.assert_array_almost_equal(meta_act[relabeled, 0], 3)
 
-# class TestHierReplayBuffer(unittest.TestCase):
-#     """Tests for the HierReplayBuffer object."""
-#
-#     def setUp(self):
-#         self.replay_buffer = HierReplayBuffer(size=2)
-#
-#     def tearDown(self):
-#         del self.replay_buffer
+    def test_bad_strategy(self):
+        """Check that unknown relabeling strategies are rejected."""
+        self.assertRaises(ValueError, self._replay_buffer, "episode")
 
 
 if __name__ == '__main__':
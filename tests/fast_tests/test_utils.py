@@ -1,10 +1,17 @@
 """Contains tests for the model abstractions and different models."""
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 from gym.spaces import Box
 from hbaselines.utils.train import parse_options, get_hyperparameters
-from hbaselines.utils.reward_fns import negative_distance
+from hbaselines.utils.train import partition_cpus, run_seeds
+from hbaselines.utils.sweep import expand_spec, SuccessiveHalving
+from hbaselines.utils.sweep import read_eval_results
+from hbaselines.utils.reward_fns import negative_distance, NegativeDistance
 from hbaselines.utils.misc import get_manager_ac_space, get_state_indices
+from hbaselines.utils.vec_env import SubprocVecEnv
 from hbaselines.goal_conditioned.td3 import GoalConditionedPolicy
 from hbaselines.algorithms.off_policy import TD3_PARAMS
 from hbaselines.algorithms.off_policy import SAC_PARAMS
@@ -23,13 +30,25 @@ class TestTrain(unittest.TestCase):
             'alg': 'TD3',
             'evaluate': False,
             'n_training': 1,
+            'n_parallel': 1,
             'total_steps': 1000000,
             'seed': 1,
             'log_interval': 2000,
             'eval_interval': 50000,
             'save_interval': 50000,
+            'ray_address': None,
             'nb_train_steps': 1,
             'nb_rollout_steps': 1,
+            'num_envs': 1,
+            'async_rollouts': False,
+            'max_replay_ratio': None,
+            'actor_sync_interval': 10,
+            'num_rollout_workers': 0,
+            'n_cpus': 3,
+            'intra_op_threads': None,
+            'inter_op_threads': None,
+            'cpu_affinity': None,
+            'autotune_threads': False,
             'nb_eval_episodes': 50,
             'reward_scale': 1,
             'render': False,
@@ -49,12 +68,31 @@ class TestTrain(unittest.TestCase):
             'gamma': FEEDFORWARD_PARAMS['gamma'],
             'layer_norm': False,
             'use_huber': False,
+            'prioritized_replay': False,
+            'prioritized_replay_alpha':
+                FEEDFORWARD_PARAMS['prioritized_replay_alpha'],
+            'prioritized_replay_beta':
+                FEEDFORWARD_PARAMS['prioritized_replay_beta'],
+            'prioritized_replay_eps':
+                FEEDFORWARD_PARAMS['prioritized_replay_eps'],
+            'storage': 'memory',
+            'buffer_dir': None,
+            'deduplicate_obs': False,
+            'obs_encoding': 'float32',
+            'prefetch_batches': 0,
+            'n_step': 1,
             'meta_period': GOAL_CONDITIONED_PARAMS['meta_period'],
             'worker_reward_scale':
                 GOAL_CONDITIONED_PARAMS['worker_reward_scale'],
             'relative_goals': False,
             'off_policy_corrections': False,
+            'in_graph_corrections': False,
+            'correction_staleness': None,
             'hindsight': False,
+            'lazy_hindsight': False,
+            'hindsight_strategy': 'final',
+            'hindsight_fraction':
+                GOAL_CONDITIONED_PARAMS['hindsight_fraction'],
             'use_fingerprints': False,
             'centralized_value_functions': False,
             'connected_gradients': False,
@@ -74,6 +112,16 @@ class TestTrain(unittest.TestCase):
             '--save_interval', '6',
             '--nb_train_steps', '7',
             '--nb_rollout_steps', '8',
+            '--num_envs', '33',
+            '--async_rollouts',
+            '--max_replay_ratio', '34',
+            '--actor_sync_interval', '35',
+            '--num_rollout_workers', '36',
+            '--n_cpus', '37',
+            '--intra_op_threads', '38',
+            '--inter_op_threads', '39',
+            '--cpu_affinity', '40', '41',
+            '--autotune_threads',
             '--nb_eval_episodes', '9',
             '--reward_scale', '10',
             '--render',
@@ -96,16 +144,41 @@ class TestTrain(unittest.TestCase):
             '--worker_reward_scale', '24',
             '--relative_goals',
             '--off_policy_corrections',
+            '--in_graph_corrections',
+            '--correction_staleness', '42',
             '--hindsight',
             '--use_fingerprints',
             '--centralized_value_functions',
             '--connected_gradients',
             '--cg_weights', '25',
+            '--prioritized_replay',
+            '--prioritized_replay_alpha', '26',
+            '--prioritized_replay_beta', '27',
+            '--prioritized_replay_eps', '28',
+            '--storage', 'memmap',
+            '--buffer_dir', '29',
+            '--deduplicate_obs',
+            '--obs_encoding', 'uint8',
+            '--prefetch_batches', '30',
+            '--lazy_hindsight',
+            '--hindsight_strategy', 'future',
+            '--hindsight_fraction', '31',
+            '--n_step', '32',
         ])
         hp = get_hyperparameters(args, GoalConditionedPolicy)
         expected_hp = {
             'nb_train_steps': 7,
             'nb_rollout_steps': 8,
+            'num_envs': 33,
+            'async_rollouts': True,
+            'max_replay_ratio': 34,
+            'actor_sync_interval': 35,
+            'num_rollout_workers': 36,
+            'n_cpus': 37,
+            'intra_op_threads': 38,
+            'inter_op_threads': 39,
+            'cpu_affinity': [40, 41],
+            'autotune_threads': True,
             'nb_eval_episodes': 9,
             'reward_scale': 10.0,
             'render': True,
@@ -126,11 +199,26 @@ class TestTrain(unittest.TestCase):
                 'target_noise_clip': 22.0,
                 'layer_norm': True,
                 'use_huber': True,
+                'prioritized_replay': True,
+                'prioritized_replay_alpha': 26.0,
+                'prioritized_replay_beta': 27.0,
+                'prioritized_replay_eps': 28.0,
+                'storage': 'memmap',
+                'buffer_dir': '29',
+                'deduplicate_obs': True,
+                'obs_encoding': 'uint8',
+                'prefetch_batches': 30,
+                'n_step': 32,
                 'meta_period': 23,
                 'worker_reward_scale': 24.0,
                 'relative_goals': True,
                 'off_policy_corrections': True,
+                'in_graph_corrections': True,
+                'correction_staleness': 42,
                 'hindsight': True,
+                'lazy_hindsight': True,
+                'hindsight_strategy': 'future',
+                'hindsight_fraction': 31,
                 'use_fingerprints': True,
                 'centralized_value_functions': True,
                 'connected_gradients': True,
@@ -141,6 +229,165 @@ class TestTrain(unittest.TestCase):
         self.assertEqual(args.log_interval, 4)
         self.assertEqual(args.eval_interval, 5)
 
+    def test_partition_cpus(self):
+        cpus = sorted(os.sched_getaffinity(0))
+
+        # Check that every CPU is assigned to exactly one part.
+        parts = partition_cpus(min(2, len(cpus)))
+        self.assertEqual(sorted(sum(parts, [])), cpus)
+
+        # Check that CPUs are shared if there are more parts than CPUs.
+        parts = partition_cpus(len(cpus) + 1)
+        self.assertEqual(len(parts), len(cpus) + 1)
+        self.assertListEqual(parts[-1], [cpus[0]])
+
+    def test_run_seeds(self):
+        summary_path = "seeds.csv"
+
+        # Test the sequential case.
+        summaries = run_seeds(_run_seed, [1, 2], summary_path=summary_path)
+        self.assertListEqual([s["seed"] for s in summaries], [1, 2])
+        self.assertListEqual([s["steps"] for s in summaries], [10, 20])
+        self.assertListEqual([s["cpus"] for s in summaries], ["", ""])
+
+        # Test the parallel case. The failed seed does not affect the others.
+        self.assertRaises(
+            RuntimeError, run_seeds, _run_seed, [3, 0, 4], n_parallel=2,
+            summary_path=summary_path)
+
+        # Check that the summaries of both runs were stored.
+        with open(summary_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith("seed,cpus,status"))
+        self.assertListEqual(
+            [line.split(",")[2] for line in lines[1:]],
+            ["done", "done", "failed", "done", "done"])
+
+        os.remove(summary_path)
+
+
+class TestSweep(unittest.TestCase):
+    """Tests for the hyperparameter sweep utility methods."""
+
+    def test_expand_spec(self):
+        spec = {
+            "meta_period": [5, 10],
+            "relative_goals": [True, False],
+            "actor_lr": {"loguniform": [1e-4, 1e-3]},
+            "batch_size": {"choice": [64, 128]},
+            "buffer_size": 100,
+        }
+
+        # Check that every combination of the grid is created.
+        configs = expand_spec(spec, num_samples=2, seed=1)
+        self.assertEqual(len(configs), 8)
+        self.assertListEqual(
+            [(c["meta_period"], c["relative_goals"]) for c in configs[:4]],
+            [(5, True), (5, False), (10, True), (10, False)])
+
+        # Check the sampled and constant values.
+        for config in configs:
+            self.assertTrue(1e-4 <= config["actor_lr"] <= 1e-3)
+            self.assertIn(config["batch_size"], [64, 128])
+            self.assertEqual(config["buffer_size"], 100)
+
+        # Check that the sampled values are seeded.
+        self.assertListEqual(configs, expand_spec(spec, 2, seed=1))
+
+        # Check that unknown distributions are detected.
+        self.assertRaises(
+            ValueError, expand_spec, {"actor_lr": {"normal": [0, 1]}})
+
+    def test_successive_halving(self):
+        scheduler = SuccessiveHalving(
+            grace_steps=100, max_steps=1000, reduction_factor=2)
+        self.assertListEqual(scheduler.milestones, [100, 200, 400, 800])
+
+        # Trials are not stopped before the first milestone.
+        self.assertFalse(scheduler.should_stop(0, 50, -10))
+
+        # The first trial at a milestone is always kept.
+        self.assertFalse(scheduler.should_stop(0, 100, 1))
+
+        # Trials are stopped if they fall behind the top half.
+        self.assertFalse(scheduler.should_stop(1, 100, 2))
+        self.assertTrue(scheduler.should_stop(2, 100, 0))
+
+        # A trial is only compared once per milestone.
+        self.assertFalse(scheduler.should_stop(2, 150, -10))
+
+        # Results past multiple milestones are recorded at the last one.
+        self.assertFalse(scheduler.should_stop(1, 500, 2))
+        self.assertDictEqual(scheduler.rung_results[400], {1: 2})
+        self.assertDictEqual(scheduler.rung_results[200], {})
+
+    def test_read_eval_results(self):
+        """Check that rows that are still being written are skipped."""
+        log_dir = tempfile.mkdtemp()
+        with open(os.path.join(log_dir, "eval_0.csv"), "w") as f:
+            f.write("total_step,average_return\n10,1.0\n20,3.0\n30")
+        with open(os.path.join(log_dir, "eval_1.csv"), "w") as f:
+            f.write("total_step,average_return\n10,3.0\n20,5.0\n30,")
+
+        self.assertListEqual(
+            read_eval_results(log_dir), [(10, 2.0), (20, 4.0)])
+        self.assertListEqual(read_eval_results(log_dir, start=1), [(20, 4.0)])
+
+        shutil.rmtree(log_dir)
+
+
+def _run_seed(seed, cpus):
+    """Run a mock training operation of a seed. Fails for seed 0."""
+    if seed == 0:
+        raise ValueError("Failed.")
+    if cpus is not None:
+        assert sorted(os.sched_getaffinity(0)) == cpus
+    return 10 * seed
+
+
+class TestSubprocVecEnv(unittest.TestCase):
+    """Tests for the SubprocVecEnv object."""
+
+    def setUp(self):
+        self.env = SubprocVecEnv("MountainCarContinuous-v0", num_envs=2)
+
+    def tearDown(self):
+        self.env.close()
+        del self.env
+
+    def test_attributes(self):
+        """Check that attributes are retrieved from the environments."""
+        self.assertEqual(self.env.num_envs, 2)
+        self.assertTupleEqual(self.env.action_space.shape, (1,))
+        self.assertTupleEqual(self.env.observation_space.shape, (2,))
+        self.assertEqual(self.env._max_episode_steps, 999)
+        self.assertFalse(hasattr(self.env, "current_context"))
+
+    def test_step(self):
+        """Check that the environments are stepped and reset independently."""
+        obs = self.env.reset()
+        self.assertTupleEqual(obs.shape, (2, 2))
+        self.assertIsNone(self.env.contexts)
+
+        for i in range(999):
+            new_obs, reward, done, info, context = self.env.step(
+                np.zeros((2, 1)))
+            self.assertTupleEqual(new_obs.shape, (2, 2))
+            self.assertTupleEqual(reward.shape, (2,))
+            self.assertEqual(len(info), 2)
+            self.assertIsNone(context)
+
+            # The environments are only done once the time horizon is met.
+            self.assertEqual(done.all(), i == 998)
+            if not done.any():
+                np.testing.assert_array_almost_equal(self.env.obs, new_obs)
+
+        # Check that the environments were reset.
+        self.assertTrue((self.env.obs[:, 1] == 0).all())
+        self.assertTrue((self.env.obs[:, 0] >= -0.6).all())
+        self.assertTrue((self.env.obs[:, 0] <= -0.4).all())
+
 
 class TestRewardFns(unittest.TestCase):
     """Test the reward_fns method."""
@@ -151,6 +398,43 @@ class TestRewardFns(unittest.TestCase):
         c = negative_distance(b, b, a, goal_indices=[1, 2])
         self.assertEqual(c, -8.062257748304752)
 
+        # Check that batches of inputs are supported.
+        c = negative_distance(
+            np.array([b, b]), np.array([b, b]), np.array([a, a]),
+            goal_indices=[1, 2])
+        np.testing.assert_array_almost_equal(
+            c, [-8.062257748304752, -8.062257748304752])
+
+    def test_batched_negative_distance(self):
+        reward_fn = NegativeDistance(goal_indices=[1, 2])
+        a = np.array([1, 2, 10])
+        b = np.array([1, 2])
+
+        # Check that the same rewards are returned for single elements.
+        c = reward_fn(b, a, b)
+        self.assertAlmostEqual(c, -8.062257748304752)
+
+        # Check the rewards of batches, with and without relative contexts.
+        np.random.seed(0)
+        states = np.random.randn(5, 4)
+        next_states = np.random.randn(5, 4)
+        goals = np.random.randn(5, 2)
+        for kwargs in [{"state_indices": [0, 1]},
+                       {"state_indices": [2, 0], "relative_context": True},
+                       {"state_indices": [1, 3], "bonus_epsilon": 2.,
+                        "reward_scales": 2., "offset": 1.}]:
+            reward_fn = NegativeDistance(**kwargs)
+            np.testing.assert_array_almost_equal(
+                reward_fn(states, goals, next_states),
+                negative_distance(states, next_states, goals, **kwargs))
+
+        # Contiguous indices are precomputed as slices.
+        self.assertEqual(
+            NegativeDistance(state_indices=[0, 1]).state_indices,
+            slice(0, 2, 1))
+        np.testing.assert_array_equal(
+            NegativeDistance(state_indices=[2, 0]).state_indices, [2, 0])
+
 
 class TestMisc(unittest.TestCase):
     """Test the the miscellaneous utility methods."""